@@ -0,0 +1,276 @@
+"""
+Semantic cache of RAG answers, so a question that was already answered skips the LLM.
+
+Visitors ask the same things in different words ("what is HNSW?", "What's HNSW"). The
+cache keeps, per index, partition and embedding model, the embedding of each answered
+question, the chunks its answer was based on and the answer. A new question whose
+embedding has a cosine similarity of at least threshold with a cached one gets the
+cached answer, if the chunks still have the content they had when it was answered:
+
+    cache = SemanticAnswerCache(redis_binary, threshold=0.95)
+    entry = cache.lookup(scope, query_blob)
+    if entry is None:
+        answer = ...
+        cache.store(scope, question, query_blob, results, answer)
+
+Entries expire after ttl seconds and the least recently used go first when the cache
+is full. The cache lives in the memory of the datastore service, so it is shared by
+all its clients.
+
+Follow-up questions ("and why is that?") depend on the conversation before them, and
+must neither look up nor store answers: two of them embed alike whatever they refer
+to, and the cache is shared by all conversations. Clients should only use the cache
+for questions that stand alone, e.g. the first question of a conversation that
+looks_like_follow_up does not flag.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from redis.exceptions import RedisError
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_ENTRIES = 512
+
+_WORD = re.compile(r"[\w']+", re.UNICODE)
+_REFERRING_WORDS = frozenset(
+    [
+        "it",
+        "its",
+        "this",
+        "that",
+        "these",
+        "those",
+        "they",
+        "them",
+        "their",
+        "he",
+        "him",
+        "his",
+        "she",
+        "her",
+    ]
+)
+# After these, "that" refers to something ("what does that mean"); after a noun it
+# starts a relative clause ("robots that detect faces")
+_BEFORE_REFERRING_THAT = frozenset(
+    [
+        "is",
+        "was",
+        "are",
+        "does",
+        "do",
+        "did",
+        "can",
+        "about",
+        "of",
+        "for",
+        "with",
+        "like",
+        "in",
+        "on",
+        "to",
+        "why",
+        "how",
+    ]
+)
+_FOLLOW_UP_STARTS = (
+    "and ",
+    "but ",
+    "also ",
+    "so ",
+    "then ",
+    "why?",
+    "how so",
+    "what about ",
+    "how about ",
+    "what else",
+    "more ",
+    "tell me more",
+)
+
+
+def looks_like_follow_up(text, min_words=2, max_words=8):
+    """
+    :param min_words: shorter questions ("why?") are always follow-ups
+    :param max_words: longer questions are only follow-ups when they start with a
+        connective
+    :return: whether a question likely refers to the conversation before it, e.g.
+        "and what about the second one?", "how does it work?" or "why?"
+    """
+    lowered = text.strip().lower()
+    words = _WORD.findall(lowered)
+    if len(words) < min_words or lowered.startswith(_FOLLOW_UP_STARTS):
+        return True
+    # In a longer question, "that" and "it" mostly refer to something in the
+    # question itself
+    return len(words) <= max_words and any(
+        _is_referring(words, i) for i in range(len(words))
+    )
+
+
+def _is_referring(words, i):
+    if words[i] != "that":
+        return words[i] in _REFERRING_WORDS
+    return i < 2 or i == len(words) - 1 or words[i - 1] in _BEFORE_REFERRING_THAT
+
+
+def fingerprint_chunks(redis_conn, doc_ids):
+    """
+    :return: hex digest of the content of chunks, None if one of them is gone
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    for doc_id in doc_ids:
+        pipe.hget(doc_id, "content")
+    digest = hashlib.sha256()
+    for content in pipe.execute():
+        if content is None:
+            return None
+        digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()
+
+
+class SemanticAnswerCache(object):
+    """
+    Answers of earlier questions, looked up by embedding similarity.
+
+    Safe to share between threads.
+
+    :param redis_conn: Redis connection with decode_responses=False, to check that the
+        chunks of an answer did not change
+    :param threshold: minimum cosine similarity of the question embeddings
+    :type threshold: float
+    :param ttl: seconds an answer is kept
+    :type ttl: int
+    :param max_entries: answers kept, over all scopes
+    :type max_entries: int
+    """
+
+    def __init__(
+        self,
+        redis_conn,
+        threshold=DEFAULT_THRESHOLD,
+        ttl=DEFAULT_TTL,
+        max_entries=DEFAULT_MAX_ENTRIES,
+    ):
+        self.redis = redis_conn
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+        self._lock = threading.Lock()
+        # (scope, number) -> entry dict, least recently used first
+        self._entries = OrderedDict()
+        self._counter = 0
+
+    def lookup(self, scope, query_blob, threshold=None):
+        """
+        :param scope: tuple of index, partition and embedding model
+        :param query_blob: embedding of the question as float32 bytes
+        :param threshold: overrides the threshold of the cache
+        :return: dict with question, answer, results, similarity and age (seconds),
+            None on a miss
+        :rtype: dict | None
+        """
+        threshold = self.threshold if threshold is None else threshold
+        query = _unit(query_blob)
+        with self._lock:
+            self._expire()
+            keys = [key for key in self._entries if key[0] == scope]
+            if keys:
+                vectors = np.vstack([self._entries[key]["vector"] for key in keys])
+                similarities = vectors @ query
+                best = int(np.argmax(similarities))
+            if not keys or similarities[best] < threshold:
+                self.misses += 1
+                return None
+            key = keys[best]
+            entry = self._entries[key]
+
+        try:
+            fingerprint = fingerprint_chunks(self.redis, entry["doc_ids"])
+        except RedisError:
+            fingerprint = None
+        with self._lock:
+            if fingerprint != entry["fingerprint"]:
+                # Re-ingested or deleted since the answer was given
+                self._entries.pop(key, None)
+                self.stale += 1
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        return {
+            "question": entry["question"],
+            "answer": entry["answer"],
+            "results": entry["results"],
+            "similarity": float(similarities[best]),
+            "age": time.time() - entry["created"],
+        }
+
+    def store(self, scope, question, query_blob, results, answer):
+        """
+        :param results: the retrieved chunks the answer is based on, as returned by
+            the query requests
+        :return: whether the answer was stored
+        """
+        doc_ids = [result["doc_id"] for result in results]
+        try:
+            fingerprint = fingerprint_chunks(self.redis, doc_ids)
+        except RedisError:
+            return False
+        if fingerprint is None:
+            return False
+
+        with self._lock:
+            self._counter += 1
+            self._entries[(scope, self._counter)] = {
+                "question": question,
+                "vector": _unit(query_blob),
+                "doc_ids": doc_ids,
+                "fingerprint": fingerprint,
+                "results": results,
+                "answer": answer,
+                "created": time.time(),
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "entries": len(self._entries),
+            }
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        cutoff = time.time() - self.ttl
+        for key in [
+            k for k, entry in self._entries.items() if entry["created"] < cutoff
+        ]:
+            del self._entries[key]
+
+
+def _unit(blob):
+    vector = np.frombuffer(blob, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
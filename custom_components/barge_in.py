@@ -0,0 +1,106 @@
+"""
+Barge-in: stop the robot's speech as soon as the user starts talking.
+
+BargeInController listens to a VoiceDetection service while the application speaks.
+When the user has been speaking for min_speech_ms, it calls on_barge_in once, which
+should stop playback, drop the queued sentences and cancel synthesis that is still
+running (e.g. GPTElevenLabsStreamingDemo.cancel_speech). The barged_in event then
+tells the application to hand the turn to speech recognition right away instead of
+waiting for the reply to finish.
+
+    voice_detection = VoiceDetection(
+        input_source=desktop.mic, conf=VoiceDetectionConf(message_frequency=10)
+    )
+    barge_in = BargeInController(voice_detection, on_barge_in=cancel_speech)
+
+    barge_in.arm()        # the application starts speaking
+    ...
+    barge_in.disarm()     # finished speaking
+    if barge_in.barged_in.is_set():
+        listen()
+
+VoiceDetection only reports state changes by default; set message_frequency so the
+controller also hears that speech continues. The microphone should not pick up the
+speakers (use headphones, a robot, or an echo gate in "aec" mode, see
+custom_components.echo_gate), otherwise the application interrupts itself.
+"""
+
+import threading
+import time
+
+
+class BargeInController(object):
+    """
+    Calls on_barge_in when sustained user speech is detected while armed.
+
+    :param voice_detection: VoiceDetection connector, with message_frequency > 0
+    :param on_barge_in: called (without arguments) on the VoiceDetection callback
+        thread when the user barges in
+    :param min_speech_ms: how long speech must last before it counts, so coughs and
+        short noises do not interrupt the application
+    :type min_speech_ms: float
+    :param min_speech_proportion: fraction of the detection window that must be
+        speech for a message to count as speaking
+    :type min_speech_proportion: float
+    """
+
+    def __init__(
+        self,
+        voice_detection,
+        on_barge_in,
+        min_speech_ms=300,
+        min_speech_proportion=0.2,
+    ):
+        self.on_barge_in = on_barge_in
+        self.min_speech_ms = min_speech_ms
+        self.min_speech_proportion = min_speech_proportion
+        # Set when the user barged in, cleared by arm()
+        self.barged_in = threading.Event()
+        self.barge_ins = 0
+
+        self._lock = threading.Lock()
+        self._armed = False
+        self._speech_start = None
+
+        voice_detection.register_callback(self._on_voice)
+
+    def arm(self):
+        """Watch for barge-in, call when the application starts speaking."""
+        with self._lock:
+            self._armed = True
+            self._speech_start = None
+            self.barged_in.clear()
+
+    def disarm(self):
+        """Stop watching, call when the application has finished speaking."""
+        with self._lock:
+            self._armed = False
+            self._speech_start = None
+
+    def _on_voice(self, message):
+        # Compared by name, importing VoiceDetectionMessage would require torch
+        if message.__class__.__name__ != "VoiceDetectionMessage":
+            return
+
+        now = time.time()
+        with self._lock:
+            if not self._armed:
+                return
+            speaking = (
+                message.is_speaking
+                and message.speech_proportion >= self.min_speech_proportion
+            )
+            if not speaking:
+                self._speech_start = None
+                return
+            if self._speech_start is None:
+                self._speech_start = now
+            if (now - self._speech_start) * 1000.0 < self.min_speech_ms:
+                return
+            # Only the first detection of a turn interrupts
+            self._armed = False
+            self._speech_start = None
+            self.barge_ins += 1
+            self.barged_in.set()
+
+        self.on_barge_in()
@@ -0,0 +1,211 @@
+"""
+Batched, concurrency-limited embedding of many texts, with adaptive backoff on rate
+limits.
+
+Embedding a corpus one document per request leaves most of the time waiting on round
+trips. BatchEmbedder sends the texts in large batches, keeps up to max_concurrency
+requests in flight, and when the provider answers with a rate limit (HTTP 429) all
+workers pause together. The pause honors Retry-After and doubles while rate limits keep
+coming. Until it has halved back to zero with successful requests, requests are also
+spaced out by the pause divided over the workers, so the embedder settles just under
+the limit of the account:
+
+    embedder = BatchEmbedder(openai_embed_batch(model, api_key), batch_size=256)
+    blobs = embedder.embed(texts, on_batch=lambda done, total: print(done, total))
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+def openai_embed_batch(model, api_key, max_retries=0):
+    """
+    :param max_retries: retries of the OpenAI client after a transient error, 0 to
+        leave them to the BatchEmbedder, None for the default of the client
+    :return: function embedding a list of texts with the OpenAI embeddings API
+    """
+    try:
+        from openai import OpenAI
+    except ImportError as e:
+        raise RuntimeError(
+            "Missing dependency: openai.\n"
+            "Install it with: pip install openai\n"
+            "Original import error: {}".format(e)
+        ) from e
+    if not api_key:
+        raise RuntimeError("openai_api_key parameter is required")
+    if max_retries is None:
+        client = OpenAI(api_key=api_key)
+    else:
+        client = OpenAI(api_key=api_key, max_retries=max_retries)
+
+    def embed_batch(texts):
+        response = client.embeddings.create(model=model, input=texts)
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+    return embed_batch
+
+
+def is_rate_limit(exception):
+    return (
+        getattr(exception, "status_code", None) == 429
+        or exception.__class__.__name__ == "RateLimitError"
+    )
+
+
+def is_transient(exception):
+    """Errors worth retrying: rate limits, timeouts, dropped connections and 5xx."""
+    if is_rate_limit(exception):
+        return True
+    if exception.__class__.__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    status = getattr(exception, "status_code", None)
+    return status is not None and status >= 500
+
+
+def retry_after(exception):
+    """:return: seconds the provider asks to wait, None if it does not say"""
+    headers = getattr(getattr(exception, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class BatchEmbedder(object):
+    """
+    Embeds lists of texts in batches, with at most max_concurrency requests at a time.
+
+    :param embed_batch: function embedding a list of texts, returns a list of vectors
+    :param batch_size: texts per request
+    :type batch_size: int
+    :param max_concurrency: requests in flight at the same time
+    :type max_concurrency: int
+    :param max_retries: attempts per batch after a transient error
+    :type max_retries: int
+    :param initial_backoff: seconds of the first pause after a rate limit
+    :param max_backoff: longest pause, in seconds
+    """
+
+    def __init__(
+        self,
+        embed_batch,
+        batch_size=DEFAULT_BATCH_SIZE,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        max_retries=6,
+        initial_backoff=1.0,
+        max_backoff=60.0,
+    ):
+        self.embed_batch = embed_batch
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self.requests = 0
+        self.rate_limits = 0
+        self.retries = 0
+
+        self._lock = threading.Lock()
+        self._backoff = 0.0
+        self._resume_at = 0.0
+        self._next_slot = 0.0
+
+    @property
+    def backoff(self):
+        """Current pause after a rate limit, 0 when requests go through."""
+        return self._backoff
+
+    def embed(self, texts, on_batch=None):
+        """
+        :param texts: texts to embed
+        :param on_batch: called with (texts done, total) after every batch, from a
+            worker thread
+        :return: the embeddings as float32 bytes, in the order of texts
+        :rtype: list[bytes]
+        """
+        batches = [
+            texts[start : start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        results = [None] * len(batches)
+        progress = {"done": 0}
+
+        def work(i):
+            vectors = self._embed_with_retry(batches[i])
+            results[i] = [
+                np.asarray(v, dtype=np.float32).tobytes(order="C") for v in vectors
+            ]
+            if on_batch is not None:
+                with self._lock:
+                    progress["done"] += len(batches[i])
+                    done = progress["done"]
+                on_batch(done, len(texts))
+
+        if len(batches) <= 1:
+            for i in range(len(batches)):
+                work(i)
+        else:
+            workers = min(self.max_concurrency, len(batches))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # list() raises the first error of a batch that gave up
+                list(executor.map(work, range(len(batches))))
+
+        return [blob for batch in results for blob in batch]
+
+    def _embed_with_retry(self, batch):
+        attempt = 0
+        while True:
+            self._wait_for_backoff()
+            try:
+                with self._lock:
+                    self.requests += 1
+                vectors = self.embed_batch(batch)
+            except Exception as e:
+                if not is_transient(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self._on_error(e)
+                continue
+            self._on_success()
+            return vectors
+
+    def _wait_for_backoff(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                delay = max(self._resume_at, self._next_slot) - now
+                if delay <= 0:
+                    if self._backoff > 0:
+                        self._next_slot = now + self._backoff / self.max_concurrency
+                    return
+            time.sleep(delay)
+
+    def _on_error(self, exception):
+        with self._lock:
+            self.retries += 1
+            if is_rate_limit(exception):
+                self.rate_limits += 1
+                self._backoff = min(
+                    self.max_backoff, max(self.initial_backoff, self._backoff * 2)
+                )
+                delay = retry_after(exception) or self._backoff
+            else:
+                delay = self.initial_backoff
+            # Jitter, so the workers do not retry in lockstep
+            delay *= 1 + 0.25 * random.random()
+            self._resume_at = max(self._resume_at, time.time() + delay)
+
+    def _on_success(self):
+        with self._lock:
+            self._backoff /= 2
+            if self._backoff < self.initial_backoff / 4:
+                self._backoff = 0.0
@@ -0,0 +1,185 @@
+"""
+Conversation history for LLM chats, trimmed to a token budget.
+
+Keeping the last n messages lets the prompt grow with long messages, and in RAG chats
+the history fills up with the retrieved context of earlier questions, which the model
+no longer needs. ConversationMemory keeps only the questions as the user asked them and
+the answers. The context of the current question goes in the prompt and is never
+stored:
+
+    memory = ConversationMemory(max_tokens=1500)
+    reply = gpt.request(GPTRequest(prompt=context_and_question,
+                                   role_messages=memory.messages()))
+    memory.add_turn(question, reply.response)
+
+When the history exceeds max_tokens the oldest turns are dropped, or, with a summarize
+function, folded into a running summary that is sent as a system message. Summarizing
+runs on a background thread; until it is done the turns being summarized stay in the
+history as they were. It only does not delay the next answer if summarize uses its own
+LLM client: a SIC GPT service handles one request at a time, so an answer requested
+from the same service waits for the summary.
+
+Tokens are counted with tiktoken when it is installed (pip install tiktoken), and
+estimated at 4 characters per token otherwise.
+"""
+
+import threading
+
+DEFAULT_MAX_TOKENS = 1500
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Tokens the chat format adds to every message
+MESSAGE_OVERHEAD = 4
+
+_encodings = {}
+
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    """:return: number of tokens of text for model, estimated without tiktoken"""
+    if model not in _encodings:
+        try:
+            import tiktoken
+
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except ImportError:
+            _encodings[model] = None
+    encoding = _encodings[model]
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def summary_prompt(summary, turns, max_words=150):
+    """
+    :param summary: summary of the conversation so far, "" if none
+    :param turns: (question, answer) tuples to add to it
+    :return: prompt asking an LLM for the updated summary
+    """
+    conversation = "\n".join(
+        "User: {}\nAssistant: {}".format(question, answer) for question, answer in turns
+    )
+    return (
+        "Summary of the conversation so far:\n{}\n\n"
+        "Later messages:\n{}\n\n"
+        "Write an updated summary of the whole conversation in at most {} words. Keep "
+        "the topics, names and facts the user may refer back to.".format(
+            summary or "(none)", conversation, max_words
+        )
+    )
+
+
+class ConversationMemory(object):
+    """
+    Questions and answers of a chat, within a token budget.
+
+    :param max_tokens: tokens of the summary and the kept turns
+    :type max_tokens: int
+    :param summarize: called with (summary, turns) to fold dropped turns into the
+        summary, returns the new summary; None to forget them. Use another LLM client
+        than the one that answers, see the module docstring
+    :param model: model the tokens are counted for
+    :param logger: logger for summarizing errors
+    """
+
+    def __init__(
+        self,
+        max_tokens=DEFAULT_MAX_TOKENS,
+        summarize=None,
+        model=DEFAULT_MODEL,
+        logger=None,
+    ):
+        self.max_tokens = max_tokens
+        self.summarize = summarize
+        self.model = model
+        self.logger = logger
+
+        self.summary = ""
+        # (question, answer, tokens), oldest first
+        self._turns = []
+        # Dropped turns waiting to be summarized
+        self._pending = []
+        self._summarizer = None
+        self._lock = threading.Lock()
+
+    def add_turn(self, question, answer):
+        """Remember a question and its answer, and trim the history to the budget."""
+        tokens = (
+            count_tokens(question, self.model)
+            + count_tokens(answer, self.model)
+            + 2 * MESSAGE_OVERHEAD
+        )
+        with self._lock:
+            self._turns.append((question, answer, tokens))
+            # The last turn is always kept
+            while len(self._turns) > 1 and self._tokens() > self.max_tokens:
+                dropped = self._turns.pop(0)
+                if self.summarize is not None:
+                    self._pending.append(dropped)
+            if self._pending and self._summarizer is None:
+                self._summarizer = threading.Thread(
+                    target=self._summarize_pending, daemon=True
+                )
+                self._summarizer.start()
+
+    def messages(self):
+        """:return: the history as chat messages, for role_messages of a GPTRequest"""
+        with self._lock:
+            messages = []
+            if self.summary:
+                messages.append(
+                    {
+                        "role": "system",
+                        "content": "Summary of the earlier conversation: {}".format(
+                            self.summary
+                        ),
+                    }
+                )
+            for question, answer, _ in self._pending + self._turns:
+                messages.append({"role": "user", "content": question})
+                messages.append({"role": "assistant", "content": answer})
+            return messages
+
+    def tokens(self):
+        """:return: tokens of the history as returned by messages()"""
+        with self._lock:
+            return self._tokens() + sum(turn[2] for turn in self._pending)
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self._turns = []
+            self._pending = []
+
+    def _tokens(self):
+        summary_tokens = (
+            count_tokens(self.summary, self.model) + MESSAGE_OVERHEAD
+            if self.summary
+            else 0
+        )
+        return summary_tokens + sum(turn[2] for turn in self._turns)
+
+    def _summarize_pending(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._summarizer = None
+                    return
+                turns = list(self._pending)
+                summary = self.summary
+            try:
+                summary = self.summarize(
+                    summary, [(question, answer) for question, answer, _ in turns]
+                )
+            except Exception as e:
+                # The turns are forgotten rather than retried forever
+                if self.logger is not None:
+                    self.logger.warning(
+                        "Summarizing the conversation failed: {}".format(e)
+                    )
+            with self._lock:
+                if self._pending[: len(turns)] == turns:
+                    self.summary = summary
+                    del self._pending[: len(turns)]
@@ -0,0 +1,183 @@
+"""
+Incremental timeline of who spoke when, built from streaming diarization results.
+
+Every DiarizationResult of the Sortformer service contains all segments since the
+start of the stream, but only the most recent ones still change. DiarizationTimeline
+keeps the merged segments per speaker and, on each update, only looks at the segments
+that end after its settle horizon, so the cost of an update does not grow with the
+length of the conversation. Subscribers are called with the segments that were added
+or removed by an update.
+
+    timeline = DiarizationTimeline()
+    timeline.subscribe(lambda added, removed: print(added))
+    while True:
+        result = sortformer.request(GetDiarizationRequest())
+        timeline.update(result.speaker_timestamps)
+        print(timeline.who_spoke(time.time() - 10, time.time()))
+"""
+
+import bisect
+from collections import namedtuple
+
+Segment = namedtuple("Segment", ["speaker", "start", "end"])
+
+
+class DiarizationTimeline(object):
+    """
+    Per-speaker interval index of diarization segments.
+
+    Segments of one speaker are merged when the gap between them is at most
+    gap_threshold, so they never overlap and are stored as lists sorted by start and
+    end. Overlap queries are a binary search plus a walk over the matching segments.
+
+    :param gap_threshold: segments of the same speaker this close (seconds) are merged,
+        0.75 like STMSortformerUtils.show_diar_df
+    :type gap_threshold: float
+    :param settle_seconds: segments ending more than this long before the latest
+        segment end are considered final and are not compared anymore
+    :type settle_seconds: float
+    """
+
+    def __init__(self, gap_threshold=0.75, settle_seconds=5.0):
+        self.gap_threshold = gap_threshold
+        self.settle_seconds = settle_seconds
+        # speaker index -> sorted segment starts / ends
+        self._starts = {}
+        self._ends = {}
+        self._horizon = float("-inf")
+        self._latest_end = float("-inf")
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """
+        Call callback(added, removed) after every update that changed the timeline.
+
+        :param callback: receives two lists of Segments
+        """
+        self._subscribers.append(callback)
+
+    def update(self, speaker_timestamps):
+        """
+        Merge a diarization result into the timeline.
+
+        :param speaker_timestamps: DiarizationResult.speaker_timestamps, a list with
+            for every speaker a list of [start, end] pairs sorted by start
+        :type speaker_timestamps: list[list[list[float]]]
+        :return: the added and the removed segments
+        :rtype: tuple[list[Segment], list[Segment]]
+        """
+        added = []
+        removed = []
+
+        for speaker, segments in enumerate(speaker_timestamps):
+            if segments:
+                self._latest_end = max(self._latest_end, segments[-1][1])
+
+            starts = self._starts.setdefault(speaker, [])
+            ends = self._ends.setdefault(speaker, [])
+
+            # Only the segments that end after the horizon may have changed. A stored
+            # segment that crosses the horizon is rebuilt from all its parts.
+            first_old = bisect.bisect_left(ends, self._horizon)
+            cut = self._horizon
+            if first_old < len(starts):
+                cut = min(cut, starts[first_old])
+            first_new = len(segments)
+            while first_new > 0 and segments[first_new - 1][1] >= cut:
+                first_new -= 1
+
+            new = [(s, e) for s, e in segments[first_new:]]
+            # A new segment may extend the last final segment across a short gap
+            if (
+                new
+                and first_old > 0
+                and new[0][0] - ends[first_old - 1] <= self.gap_threshold
+            ):
+                first_old -= 1
+                new.insert(0, (starts[first_old], ends[first_old]))
+            new = self._merge(new)
+            old = list(zip(starts[first_old:], ends[first_old:]))
+
+            if new == old:
+                continue
+            old_set = set(old)
+            new_set = set(new)
+            removed.extend(
+                Segment(speaker, s, e) for s, e in old if (s, e) not in new_set
+            )
+            added.extend(
+                Segment(speaker, s, e) for s, e in new if (s, e) not in old_set
+            )
+
+            del starts[first_old:]
+            del ends[first_old:]
+            starts.extend(s for s, _ in new)
+            ends.extend(e for _, e in new)
+
+        self._horizon = max(self._horizon, self._latest_end - self.settle_seconds)
+
+        if added or removed:
+            added.sort(key=lambda segment: segment.start)
+            removed.sort(key=lambda segment: segment.start)
+            for callback in self._subscribers:
+                callback(added, removed)
+        return added, removed
+
+    def _merge(self, segments):
+        merged = []
+        for start, end in segments:
+            if merged and start - merged[-1][1] <= self.gap_threshold:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def segments(self, t0=None, t1=None):
+        """
+        Segments that overlap [t0, t1], ordered by start time.
+
+        :param t0: start of the window, None for the start of the stream
+        :param t1: end of the window, None for the end of the stream
+        :rtype: list[Segment]
+        """
+        t0 = float("-inf") if t0 is None else t0
+        t1 = float("inf") if t1 is None else t1
+        result = []
+        for speaker in self._starts:
+            starts = self._starts[speaker]
+            ends = self._ends[speaker]
+            i = bisect.bisect_right(ends, t0)
+            while i < len(starts) and starts[i] < t1:
+                result.append(Segment(speaker, starts[i], ends[i]))
+                i += 1
+        result.sort(key=lambda segment: segment.start)
+        return result
+
+    def who_spoke(self, t0, t1):
+        """
+        Speaking time per speaker between t0 and t1.
+
+        :return: speaker index -> seconds spoken within the window, for every
+            speaker who spoke, ordered from most to least
+        :rtype: dict[int, float]
+        """
+        totals = {}
+        for segment in self.segments(t0, t1):
+            overlap = min(segment.end, t1) - max(segment.start, t0)
+            if overlap > 0:
+                totals[segment.speaker] = totals.get(segment.speaker, 0.0) + overlap
+        return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+    def speakers_at(self, t):
+        """
+        :return: the indices of the speakers who were speaking at time t
+        :rtype: list[int]
+        """
+        return sorted({segment.speaker for segment in self.segments(t, t)})
+
+    def clear(self):
+        """Forget all segments, e.g. when a new stream starts."""
+        self._starts.clear()
+        self._ends.clear()
+        self._horizon = float("-inf")
+        self._latest_end = float("-inf")
@@ -0,0 +1,295 @@
+"""
+Half-duplex echo gate between the speakers and the microphone.
+
+Without it, the robot's own voice is picked up by the microphone and sent to speech
+recognition, which wastes requests and can trigger false intents. The application
+tells the gate when playback starts and ends; microphone audio recorded during
+playback and the following tail_ms is then handled according to the mode:
+
+- "silence": replaced by silence, so the audio stream stays continuous (default)
+- "drop": not forwarded at all
+- "tag": forwarded unchanged, with during_playback=True on the AudioMessage
+- "aec": the played audio is subtracted from the microphone signal with a simple
+  delay-and-gain echo canceller, so the user can still be heard while the robot
+  talks. Falls back to silence when no reference audio is known.
+
+Put the gate in front of the speech recognition service and wrap playback in it:
+
+    echo_gate = EchoGate(input_source=desktop.mic)
+    dialogflow = Dialogflow(conf=dialogflow_conf, input_source=echo_gate)
+
+    echo_gate.play(desktop.speakers, AudioRequest(waveform, sample_rate))
+    with echo_gate.playing():
+        nao.tts.request(NaoqiTextToSpeechRequest("Hello"))
+
+Run the component with (from the repository root):
+    python -m custom_components.echo_gate
+"""
+
+import contextlib
+import threading
+
+import numpy as np
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import (
+    AudioMessage,
+    SICConfMessage,
+    SICMessage,
+    SICRequest,
+)
+from sic_framework.core.service_python2 import SICService
+
+MODES = ("silence", "drop", "tag", "aec")
+
+
+class EchoGateConf(SICConfMessage):
+    """
+    Configuration for the echo gate.
+
+    :param mode: "silence", "drop", "tag" or "aec", see the module documentation
+    :type mode: str
+    :param tail_ms: how long after playback the microphone is still gated, covers the
+        speaker buffer and room reverberation
+    :type tail_ms: float
+    :param max_echo_delay_ms: ("aec" mode) longest delay between playback and its echo
+    :type max_echo_delay_ms: float
+    """
+
+    def __init__(self, mode="silence", tail_ms=400, max_echo_delay_ms=300):
+        super(EchoGateConf, self).__init__()
+        if mode not in MODES:
+            raise ValueError(
+                "Unknown echo gate mode {}, use one of {}".format(mode, MODES)
+            )
+        self.mode = mode
+        self.tail_ms = tail_ms
+        self.max_echo_delay_ms = max_echo_delay_ms
+
+
+class EchoGatePlaybackRequest(SICRequest):
+    """
+    Tell the echo gate that playback started or ended.
+
+    :param is_playing: True when playback starts, False when it has ended
+    :param waveform: ("aec" mode) the 16-bit mono PCM audio that is being played
+    :param sample_rate: sample rate of the waveform
+    """
+
+    def __init__(self, is_playing, waveform=None, sample_rate=None):
+        super(EchoGatePlaybackRequest, self).__init__()
+        self.is_playing = is_playing
+        self.waveform = waveform
+        self.sample_rate = sample_rate
+
+
+def _timestamp_seconds(message):
+    timestamp = message._timestamp
+    if isinstance(timestamp, (tuple, list)):
+        return timestamp[0] + timestamp[1] / 1e6
+    return float(timestamp)
+
+
+class EchoGateComponent(SICService):
+    """
+    Gates microphone audio that was recorded while the application played audio.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(EchoGateComponent, self).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._playing = False
+        self._playback_start = None
+        self._gate_until = float("-inf")
+        # Played audio as float32 at its own sample rate, for echo cancellation
+        self._reference = None
+        self._reference_rate = None
+        # Resampled reference per microphone sample rate
+        self._resampled = {}
+        self._echo_lag = None
+        self.gated_chunks = 0
+
+    @staticmethod
+    def get_inputs():
+        return [AudioMessage, EchoGatePlaybackRequest]
+
+    @staticmethod
+    def get_output():
+        return AudioMessage
+
+    @staticmethod
+    def get_conf():
+        return EchoGateConf()
+
+    def on_request(self, request):
+        if request.__class__.__name__ != "EchoGatePlaybackRequest":
+            self.logger.error("Invalid request type: {}".format(type(request)))
+            return SICMessage()
+
+        # The connector timestamps requests with the same clock as microphone chunks
+        now = _timestamp_seconds(request)
+        with self._lock:
+            if request.is_playing:
+                self._playing = True
+                self._playback_start = now
+                self._echo_lag = None
+                self._resampled = {}
+                if request.waveform and request.sample_rate:
+                    samples = np.frombuffer(request.waveform, dtype=np.int16)
+                    self._reference = samples.astype(np.float32)
+                    self._reference_rate = request.sample_rate
+                else:
+                    self._reference = None
+            else:
+                self._playing = False
+                self._gate_until = now + self.params.tail_ms / 1000.0
+        return SICMessage()
+
+    def on_message(self, message):
+        """
+        Forward microphone audio, gating the chunks that overlap playback.
+
+        Processed directly instead of through the SICService input buffers, so no
+        audio chunk is skipped.
+        """
+        if not isinstance(message, AudioMessage):
+            return
+
+        waveform = bytes(message.waveform)
+        sample_rate = message.sample_rate
+        end = _timestamp_seconds(message)
+        start = end - len(waveform) / 2.0 / sample_rate
+
+        with self._lock:
+            during_playback = (
+                self._playing and end > self._playback_start
+            ) or start < self._gate_until
+            playback_start = self._playback_start
+
+        mode = self.params.mode
+        if during_playback:
+            self.gated_chunks += 1
+            if mode == "drop":
+                return
+            if mode == "aec":
+                waveform = self._cancel_echo(
+                    waveform, sample_rate, start - playback_start
+                )
+            elif mode == "silence":
+                waveform = b"\x00" * len(waveform)
+
+        self._forward(waveform, sample_rate, message._timestamp, during_playback)
+
+    def _forward(self, waveform, sample_rate, timestamp, during_playback):
+        message = AudioMessage(waveform, sample_rate=sample_rate)
+        if self.params.mode == "tag":
+            message.during_playback = during_playback
+        # Keep the capture time of the microphone chunk for downstream alignment
+        message._timestamp = timestamp
+        self.output_message(message)
+
+    def _cancel_echo(self, waveform, sample_rate, offset):
+        """
+        Subtract the best matching delayed and scaled part of the played audio.
+
+        :param offset: seconds between the start of playback and the start of the chunk
+        :return: the cleaned audio, or silence if there is no usable reference
+        """
+        reference = self._reference_at(sample_rate)
+        mic = np.frombuffer(waveform, dtype=np.int16).astype(np.float32)
+        if reference is None or len(mic) == 0:
+            return b"\x00" * len(waveform)
+
+        max_lag = int(sample_rate * self.params.max_echo_delay_ms / 1000.0)
+        first = int(round(offset * sample_rate)) - max_lag
+        window = self._slice(reference, first, len(mic) + max_lag)
+
+        # Cross-correlation for every delay 0..max_lag, computed with an FFT
+        size = 1 << int(np.ceil(np.log2(len(window) + len(mic))))
+        correlation = np.fft.irfft(
+            np.fft.rfft(window, size) * np.conj(np.fft.rfft(mic, size)), size
+        )[: max_lag + 1]
+        if self._echo_lag is None:
+            self._echo_lag = max_lag - int(np.argmax(correlation))
+
+        echo = window[max_lag - self._echo_lag :][: len(mic)]
+        energy = float(np.dot(echo, echo))
+        if energy < len(mic):
+            # Playback is (nearly) silent here, e.g. in the tail: nothing to cancel
+            return waveform
+        gain = max(0.0, float(np.dot(mic, echo)) / energy)
+        cleaned = np.clip(mic - gain * echo, -32768, 32767).astype(np.int16)
+        return cleaned.tobytes()
+
+    def _reference_at(self, sample_rate):
+        with self._lock:
+            reference = self._reference
+            reference_rate = self._reference_rate
+            if reference is None or sample_rate == reference_rate:
+                return reference
+            if sample_rate not in self._resampled:
+                n_out = int(round(len(reference) * sample_rate / float(reference_rate)))
+                positions = np.linspace(0, len(reference) - 1, n_out)
+                self._resampled[sample_rate] = np.interp(
+                    positions, np.arange(len(reference)), reference
+                ).astype(np.float32)
+            return self._resampled[sample_rate]
+
+    @staticmethod
+    def _slice(samples, start, length):
+        """samples[start:start + length], padded with zeros outside the signal."""
+        out = np.zeros(length, dtype=np.float32)
+        src_start = max(start, 0)
+        src_end = min(start + length, len(samples))
+        if src_end > src_start:
+            out[src_start - start : src_end - start] = samples[src_start:src_end]
+        return out
+
+
+class EchoGate(SICConnector):
+    """
+    Connector for the echo gate component.
+    """
+
+    component_class = EchoGateComponent
+    component_group = "EchoGate"
+
+    def playback_started(self, waveform=None, sample_rate=None):
+        """
+        :param waveform: the audio that is played, only sent along in "aec" mode
+        :param sample_rate: its sample rate
+        """
+        if getattr(self._conf, "mode", None) != "aec":
+            waveform = None
+        self.request(EchoGatePlaybackRequest(True, waveform, sample_rate))
+
+    def playback_finished(self):
+        self.request(EchoGatePlaybackRequest(False))
+
+    @contextlib.contextmanager
+    def playing(self, waveform=None, sample_rate=None):
+        """Gate the microphone while the with-block plays audio, e.g. robot TTS."""
+        self.playback_started(waveform, sample_rate)
+        try:
+            yield
+        finally:
+            self.playback_finished()
+
+    def play(self, speakers, request):
+        """
+        Play an AudioRequest on the speakers with the microphone gated.
+
+        :param speakers: speakers connector, e.g. desktop.speakers or nao.speaker
+        :param request: the AudioRequest to play
+        :return: the reply of the speakers
+        """
+        with self.playing(request.waveform, request.sample_rate):
+            return speakers.request(request)
+
+
+def main():
+    SICComponentManager([EchoGateComponent], component_group="EchoGate")
+
+
+if __name__ == "__main__":
+    main()
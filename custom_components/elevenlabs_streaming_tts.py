@@ -0,0 +1,395 @@
+"""
+ElevenLabs Text-to-Speech with chunk-by-chunk audio streaming.
+
+The stock ElevenLabsTTS service collects every websocket chunk before it replies, so
+playback can only start once the whole utterance is synthesized. This component
+outputs every PCM chunk as an ElevenLabsSpeechChunk as soon as ElevenLabs sends it.
+On the application side, ElevenLabsStreamingTTS.stream() yields those chunks and
+ElevenLabsStreamingTTS.play() writes them straight to (desktop or robot) speakers,
+so the time to first audio is the time to the first chunk.
+
+Synthesis of an utterance that is no longer needed (e.g. when the user interrupts) is
+stopped with ElevenLabsStreamingTTS.cancel(), or by stopping the iteration of stream().
+
+Plain GetElevenLabsSpeechRequests are still handled like the stock service does.
+
+Run the component with (from the repository root):
+    python -m custom_components.elevenlabs_streaming_tts
+"""
+
+import asyncio
+import base64
+import queue
+import threading
+import time
+import uuid
+from json import dumps, loads
+
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import AudioMessage, AudioRequest, SICMessage
+from sic_framework.services.elevenlabs_tts.elevenlabs_tts import (
+    ElevenLabsTTSService,
+    ElevenLabsWSClient,
+    GetElevenLabsSpeechRequest,
+    run_coro_sync,
+)
+
+
+class GetElevenLabsSpeechStreamRequest(GetElevenLabsSpeechRequest):
+    """
+    Request to synthesize speech over the websocket endpoint and stream the audio.
+
+    The reply is an ElevenLabsSpeechStreamDone; the audio itself is output as
+    ElevenLabsSpeechChunk messages carrying the same utterance_id.
+
+    :param text: text to synthesize
+    :param utterance_id: id to match chunks to this request, generated if None
+    :param voice_id/model_id/speaking_rate/stability: optional overrides
+    """
+
+    def __init__(
+        self,
+        text,
+        utterance_id=None,
+        voice_id=None,
+        model_id=None,
+        speaking_rate=None,
+        stability=None,
+    ):
+        super(GetElevenLabsSpeechStreamRequest, self).__init__(
+            text=text,
+            mode="ws",
+            voice_id=voice_id,
+            model_id=model_id,
+            speaking_rate=speaking_rate,
+            stability=stability,
+        )
+        self.utterance_id = utterance_id or uuid.uuid4().hex
+
+
+class ElevenLabsSpeechChunk(AudioMessage):
+    """
+    A piece of synthesized audio (raw 16-bit mono PCM) for one utterance.
+
+    The last chunk of an utterance has is_final=True and may have an empty waveform.
+    If synthesis failed, the last chunk carries the error message.
+    """
+
+    def __init__(
+        self, pcm_audio, sample_rate, utterance_id, index, is_final=False, error=None
+    ):
+        super(ElevenLabsSpeechChunk, self).__init__(
+            waveform=pcm_audio,
+            sample_rate=sample_rate,
+            is_stream=True,
+        )
+        self.utterance_id = utterance_id
+        self.index = index
+        self.is_final = is_final
+        self.error = error
+
+
+class ElevenLabsSpeechStreamDone(SICMessage):
+    """
+    Reply to a GetElevenLabsSpeechStreamRequest, sent after the final chunk.
+
+    :param first_chunk_latency: seconds between the request and the first audio chunk
+    """
+
+    def __init__(self, utterance_id, num_chunks, num_bytes, first_chunk_latency):
+        super(ElevenLabsSpeechStreamDone, self).__init__()
+        self.utterance_id = utterance_id
+        self.num_chunks = num_chunks
+        self.num_bytes = num_bytes
+        self.first_chunk_latency = first_chunk_latency
+
+
+class CancelElevenLabsSpeechStream(SICMessage):
+    """
+    Stop synthesizing an utterance; its stream ends with a final chunk right away.
+
+    Sent as a message rather than a request, because the service handles one request
+    at a time and is busy with the stream that has to be cancelled.
+
+    :param utterance_id: the utterance to cancel, None for all utterances in progress
+    """
+
+    def __init__(self, utterance_id=None):
+        super(CancelElevenLabsSpeechStream, self).__init__()
+        self.utterance_id = utterance_id
+
+
+class _StreamCancelled(Exception):
+    pass
+
+
+class ElevenLabsWSStreamClient(ElevenLabsWSClient):
+    """
+    WebSocket client that hands every audio chunk to a callback instead of collecting them.
+    """
+
+    async def stream_pcm(self, text, on_chunk, recv_timeout_s=20.0):
+        if not self.websocket or self.websocket.closed:
+            await self.connect()
+
+        await self.websocket.send(dumps({"text": text}))
+        await self.websocket.send(dumps({"text": ""}))
+        ws = self.websocket
+        self.websocket = None  # stream is closed, force reconnect next call
+
+        # Chunks are not guaranteed to end on a sample boundary; keep a dangling byte
+        remainder = b""
+        while True:
+            msg = await asyncio.wait_for(ws.recv(), timeout=recv_timeout_s)
+            data = loads(msg)
+
+            if data.get("audio"):
+                pcm = remainder + base64.b64decode(data["audio"])
+                cut = len(pcm) - len(pcm) % 2
+                remainder = pcm[cut:]
+                if cut:
+                    on_chunk(pcm[:cut])
+
+            if data.get("isFinal"):
+                break
+
+
+class ElevenLabsStreamingTTSService(ElevenLabsTTSService):
+    """
+    ElevenLabs TTS service that streams websocket audio chunks as they arrive.
+    """
+
+    STREAM_TIMEOUT = 60.0
+
+    def __init__(self, *args, **kwargs):
+        super(ElevenLabsStreamingTTSService, self).__init__(*args, **kwargs)
+        self._streams_lock = threading.Lock()
+        self._active = set()
+        self._cancelled = set()
+
+    @staticmethod
+    def get_inputs():
+        return [
+            GetElevenLabsSpeechRequest,
+            GetElevenLabsSpeechStreamRequest,
+            CancelElevenLabsSpeechStream,
+        ]
+
+    @staticmethod
+    def get_output():
+        return ElevenLabsSpeechChunk
+
+    def on_request(self, request):
+        if request.__class__.__name__ == "GetElevenLabsSpeechStreamRequest":
+            return self.stream(request)
+        return super(ElevenLabsStreamingTTSService, self).on_request(request)
+
+    def on_message(self, message):
+        if message.__class__.__name__ != "CancelElevenLabsSpeechStream":
+            return
+        with self._streams_lock:
+            if message.utterance_id is None:
+                self._cancelled.update(self._active)
+            elif message.utterance_id in self._active:
+                self._cancelled.add(message.utterance_id)
+
+    def stream(self, request):
+        """
+        Synthesize the request text and output each chunk as soon as it arrives.
+
+        Always outputs a final chunk, also when synthesis fails, so that clients
+        waiting for the stream to end are never left hanging.
+        """
+        start_time = time.time()
+        sample_rate = int(self.params.sample_rate)
+        stats = {"chunks": 0, "bytes": 0, "first_chunk_latency": None}
+
+        def on_chunk(pcm_audio):
+            with self._streams_lock:
+                if request.utterance_id in self._cancelled:
+                    raise _StreamCancelled()
+            if stats["first_chunk_latency"] is None:
+                stats["first_chunk_latency"] = time.time() - start_time
+            self.output_message(
+                ElevenLabsSpeechChunk(
+                    pcm_audio, sample_rate, request.utterance_id, stats["chunks"]
+                )
+            )
+            stats["chunks"] += 1
+            stats["bytes"] += len(pcm_audio)
+
+        with self._streams_lock:
+            self._active.add(request.utterance_id)
+
+        error = None
+        try:
+            if not self.params.api_key:
+                raise ValueError("No ElevenLabs API key configured.")
+            if not request.text or not request.text.strip():
+                raise ValueError("Request text must be non-empty.")
+
+            speaking_rate = (
+                request.speaking_rate
+                if request.speaking_rate is not None
+                else self.params.speaking_rate
+            )
+            if speaking_rate is not None:
+                speaking_rate = max(0.7, min(float(speaking_rate), 1.2))
+            stability = (
+                request.stability
+                if request.stability is not None
+                else self.params.stability
+            )
+
+            ws_client = ElevenLabsWSStreamClient(
+                api_key=self.params.api_key,
+                voice_id=request.voice_id or self.params.voice_id,
+                model_id=request.model_id or self.params.model_id,
+                sample_rate=sample_rate,
+                speaking_rate=speaking_rate,
+                stability=float(stability),
+            )
+
+            async def _do():
+                try:
+                    await ws_client.stream_pcm(request.text, on_chunk)
+                finally:
+                    await ws_client.close()
+
+            run_coro_sync(_do(), timeout=self.STREAM_TIMEOUT)
+        except _StreamCancelled:
+            self.logger.info("Cancelled utterance {}".format(request.utterance_id))
+        except Exception as e:
+            self.logger.error("Streaming synthesis failed: {}".format(e))
+            error = str(e)
+        finally:
+            with self._streams_lock:
+                self._active.discard(request.utterance_id)
+                self._cancelled.discard(request.utterance_id)
+
+        self.output_message(
+            ElevenLabsSpeechChunk(
+                b"",
+                sample_rate,
+                request.utterance_id,
+                stats["chunks"],
+                is_final=True,
+                error=error,
+            )
+        )
+        self.logger.info(
+            "Streamed {} chunks ({} bytes), first chunk after {}s".format(
+                stats["chunks"], stats["bytes"], stats["first_chunk_latency"]
+            )
+        )
+        return ElevenLabsSpeechStreamDone(
+            request.utterance_id,
+            stats["chunks"],
+            stats["bytes"],
+            stats["first_chunk_latency"],
+        )
+
+
+class ElevenLabsStreamingTTS(SICConnector):
+    """
+    Connector for the streaming ElevenLabs TTS component.
+
+    Besides the regular request() interface, stream() and play() consume the audio
+    chunks of an utterance while it is still being synthesized.
+    """
+
+    component_class = ElevenLabsStreamingTTSService
+    component_group = "ElevenLabsStreamingTTS"
+
+    def __init__(self, *args, **kwargs):
+        super(ElevenLabsStreamingTTS, self).__init__(*args, **kwargs)
+        # utterance_id -> queue of chunks for stream() calls that are in progress
+        self._streams = {}
+        self._streams_lock = threading.Lock()
+        self.register_callback(self._on_chunk)
+
+    def _on_chunk(self, message):
+        utterance_id = getattr(message, "utterance_id", None)
+        with self._streams_lock:
+            chunks = self._streams.get(utterance_id)
+        if chunks is not None:
+            chunks.put(message)
+
+    def stream(self, text, chunk_timeout=20.0, **overrides):
+        """
+        Synthesize text and yield its audio chunks as they arrive.
+
+        Stopping the iteration early (e.g. to cancel speech) cancels the synthesis
+        of the rest of the utterance.
+
+        :param text: text to synthesize
+        :param chunk_timeout: seconds to wait for the next chunk before giving up
+        :param overrides: voice_id, model_id, speaking_rate or stability
+        :return: generator of non-empty ElevenLabsSpeechChunk messages
+        :raises RuntimeError: if synthesis failed or timed out
+        """
+        request = GetElevenLabsSpeechStreamRequest(text, **overrides)
+        chunks = queue.Queue()
+        with self._streams_lock:
+            self._streams[request.utterance_id] = chunks
+
+        finished = False
+        try:
+            self.request(request, block=False)
+            while True:
+                try:
+                    chunk = chunks.get(timeout=chunk_timeout)
+                except queue.Empty:
+                    raise RuntimeError(
+                        "No audio received for {}s from ElevenLabs".format(
+                            chunk_timeout
+                        )
+                    )
+                if chunk.waveform:
+                    yield chunk
+                if chunk.is_final:
+                    finished = True
+                    if chunk.error:
+                        raise RuntimeError(chunk.error)
+                    return
+        finally:
+            with self._streams_lock:
+                self._streams.pop(request.utterance_id, None)
+            if not finished:
+                self.cancel(request.utterance_id)
+
+    def cancel(self, utterance_id=None):
+        """
+        Stop the synthesis of an utterance, or of all utterances in progress.
+
+        :param utterance_id: utterance_id of the GetElevenLabsSpeechStreamRequest
+        """
+        self.send_message(CancelElevenLabsSpeechStream(utterance_id))
+
+    def play(self, text, speakers, **overrides):
+        """
+        Synthesize text and play each chunk on the speakers as soon as it arrives.
+
+        :param speakers: speakers connector, e.g. desktop.speakers or nao.speaker
+        :return: seconds between the call and the start of playback, None if no audio
+        """
+        start_time = time.time()
+        first_audio = None
+        for chunk in self.stream(text, **overrides):
+            if first_audio is None:
+                first_audio = time.time() - start_time
+            speakers.request(
+                AudioRequest(chunk.waveform, chunk.sample_rate, is_stream=True)
+            )
+        return first_audio
+
+
+def main():
+    SICComponentManager(
+        [ElevenLabsStreamingTTSService], component_group="ElevenLabsStreamingTTS"
+    )
+
+
+if __name__ == "__main__":
+    main()
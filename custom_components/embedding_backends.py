@@ -0,0 +1,102 @@
+"""
+Embedding backends of the RAG datastore, selected by the embedding_model name of a
+request.
+
+- "local:<model>" runs a sentence-transformers model on the CPU of the datastore
+  service, e.g. "local:all-MiniLM-L6-v2" or "local:BAAI/bge-small-en-v1.5". No API key
+  or network access is needed once the model is downloaded.
+- "local-int8:<model>" is the same model with its linear layers quantized to int8,
+  which is about twice as fast on most CPUs at a small loss in retrieval quality.
+- Any other name is an OpenAI embedding model, e.g. "text-embedding-3-large".
+
+Local models are loaded once and kept for the lifetime of the service. They need
+sentence-transformers where the datastore service runs:
+    pip install sentence-transformers
+
+The same model name has to be used for ingestion and queries, and an index only holds
+vectors of one dimension, so switching an existing index to another model needs
+force_recreate_index=True.
+"""
+
+import threading
+
+from custom_components.batch_embedder import openai_embed_batch
+
+LOCAL_PREFIX = "local:"
+LOCAL_INT8_PREFIX = "local-int8:"
+
+# Texts per forward pass of a local model
+LOCAL_BATCH_SIZE = 64
+
+_local_models = {}
+_local_models_lock = threading.Lock()
+
+
+def is_local_model(model):
+    return model.startswith(LOCAL_PREFIX) or model.startswith(LOCAL_INT8_PREFIX)
+
+
+class LocalEmbeddingModel(object):
+    """
+    A sentence-transformers model on the CPU.
+
+    :param name: Hugging Face model name or local path
+    :param int8: quantize the linear layers to int8
+    """
+
+    def __init__(self, name, int8=False):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                "Missing dependency: sentence-transformers.\n"
+                "Install it with: pip install sentence-transformers\n"
+                "Original import error: {}".format(e)
+            ) from e
+
+        self.name = name
+        self.int8 = int8
+        self.model = SentenceTransformer(name, device="cpu")
+        if int8:
+            self.model = torch.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        # One forward pass at a time, torch already uses all cores for one
+        self._lock = threading.Lock()
+
+    def embed(self, texts):
+        with self._lock:
+            vectors = self.model.encode(
+                list(texts),
+                batch_size=LOCAL_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+        return list(vectors)
+
+
+def local_model(model):
+    """:return: the LocalEmbeddingModel for a "local:" or "local-int8:" model name"""
+    with _local_models_lock:
+        if model not in _local_models:
+            if model.startswith(LOCAL_INT8_PREFIX):
+                name, int8 = model[len(LOCAL_INT8_PREFIX) :], True
+            else:
+                name, int8 = model[len(LOCAL_PREFIX) :], False
+            _local_models[model] = LocalEmbeddingModel(name, int8=int8)
+        return _local_models[model]
+
+
+def embed_batch_function(model, api_key=None, max_retries=0):
+    """
+    :param model: embedding_model of the request
+    :param api_key: OpenAI API key, not needed for local models
+    :param max_retries: retries of the OpenAI client, 0 when a BatchEmbedder retries,
+        None for the default of the client (for single queries)
+    :return: function embedding a list of texts, returns a list of vectors
+    """
+    if is_local_model(model):
+        return local_model(model).embed
+    return openai_embed_batch(model, api_key, max_retries=max_retries)
@@ -0,0 +1,173 @@
+"""
+Cache of text embeddings, kept in Redis next to the vector index with a bounded
+in-process LRU in front of it.
+
+Embedding a query is a network round trip to the embedding API (typically 100-300 ms)
+and costs tokens, while the same questions come back all the time. Entries are keyed
+on the SHA-256 digest of (model, normalized text), so a repeated question skips the
+API, and the vectors are stored as float32 bytes that can go straight into a KNN query:
+
+    cache = EmbeddingCache(redis_binary)
+    blob = cache.embed(model, query_text, lambda text: embed(text, model=model))
+
+Entries expire from Redis after ttl seconds, so a model update on the provider's side
+is picked up eventually. If Redis is unavailable the cache falls back to the LRU.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from redis.exceptions import RedisError
+
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_KEY_PREFIX = "embcache:"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Normalize text so trivially different spellings of a query share an entry.
+
+    Unicode is NFKC-normalized and whitespace collapsed; case is kept, because the
+    embedding of a text depends on it.
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def make_embedding_key(model, text):
+    """:return: hex digest identifying the embedding of text by model"""
+    key = json.dumps([model, normalize_text(text)], ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def to_float32_blob(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes(order="C")
+
+
+class EmbeddingCache(object):
+    """
+    Two-level cache mapping (model, text) to an embedding.
+
+    Safe to share between threads.
+
+    :param redis_conn: Redis connection with decode_responses=False, None to only use
+        the in-process LRU
+    :param ttl: seconds an entry is kept in Redis, None to keep it forever
+    :type ttl: int
+    :param max_entries: size of the in-process LRU
+    :type max_entries: int
+    :param key_prefix: prefix of the Redis keys, must not overlap with index prefixes
+    :type key_prefix: str
+    """
+
+    def __init__(
+        self,
+        redis_conn=None,
+        ttl=DEFAULT_TTL,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        key_prefix=DEFAULT_KEY_PREFIX,
+    ):
+        self.redis = redis_conn
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.key_prefix = key_prefix
+
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+
+        self._lock = threading.Lock()
+        # digest -> float32 bytes, least recently used first
+        self._lru = OrderedDict()
+
+    def get(self, model, text):
+        """
+        :return: the embedding as float32 bytes, None if it is not cached
+        :rtype: bytes | None
+        """
+        digest = make_embedding_key(model, text)
+        with self._lock:
+            blob = self._lru.get(digest)
+            if blob is not None:
+                self._lru.move_to_end(digest)
+                self.memory_hits += 1
+                return blob
+
+        blob = None
+        if self.redis is not None:
+            try:
+                blob = self.redis.get(self._redis_key(model, digest))
+            except RedisError:
+                self.redis_errors += 1
+
+        with self._lock:
+            if blob is None:
+                self.misses += 1
+                return None
+            self.redis_hits += 1
+            self._remember(digest, blob)
+        return blob
+
+    def put(self, model, text, embedding):
+        """
+        :param embedding: vector of floats, or float32 bytes
+        :return: the embedding as float32 bytes
+        :rtype: bytes
+        """
+        blob = embedding if isinstance(embedding, bytes) else to_float32_blob(embedding)
+        digest = make_embedding_key(model, text)
+        with self._lock:
+            self._remember(digest, blob)
+
+        if self.redis is not None:
+            try:
+                self.redis.set(self._redis_key(model, digest), blob, ex=self.ttl)
+            except RedisError:
+                self.redis_errors += 1
+        return blob
+
+    def embed(self, model, text, embed_fn):
+        """
+        Get the embedding from the cache, or compute and cache it.
+
+        :param embed_fn: called with the normalized text on a miss, returns a vector
+            of floats
+        :return: the embedding as float32 bytes
+        :rtype: bytes
+        """
+        blob = self.get(model, text)
+        if blob is None:
+            blob = self.put(model, text, embed_fn(normalize_text(text)))
+        return blob
+
+    def clear(self):
+        """Empty the in-process LRU, Redis entries are left to expire."""
+        with self._lock:
+            self._lru.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "redis_errors": self.redis_errors,
+                "entries": len(self._lru),
+            }
+
+    def _redis_key(self, model, digest):
+        return "{}{}:{}".format(self.key_prefix, model, digest)
+
+    def _remember(self, digest, blob):
+        self._lru[digest] = blob
+        self._lru.move_to_end(digest)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
@@ -0,0 +1,142 @@
+"""
+Fake microphone that plays back recorded audio, for testing without a live mic.
+
+The FakeMicrophone component outputs the AudioMessages the application sends to it,
+so services connected to it receive them exactly as they would receive the chunks of
+Desktop().mic. FakeMicrophone.stream() cuts audio into mic-sized chunks and sends
+them at real-time speed, or faster or slower with the speed parameter:
+
+    mic = FakeMicrophone()
+    vad = VoiceDetection(input_source=mic)
+    waveform, sample_rate = load_wav("example_media/audio/demo_audio.wav", 16000)
+    mic.stream(waveform, sample_rate)
+
+Run the component with (from the repository root):
+    python -m custom_components.fake_microphone
+"""
+
+import time
+import wave
+
+import numpy as np
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import AudioMessage
+from sic_framework.core.service_python2 import SICService
+
+
+def load_wav(path, sample_rate=None):
+    """
+    Read a 16-bit PCM WAV file as mono audio.
+
+    :param path: path to the WAV file
+    :param sample_rate: resample to this rate, None to keep the rate of the file
+    :return: (waveform, sample_rate) with the waveform as 16-bit mono PCM bytes
+    :rtype: tuple[bytes, int]
+    """
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError("{} is not a 16-bit PCM WAV file".format(path))
+        channels = wav.getnchannels()
+        file_rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    samples = np.frombuffer(frames, dtype=np.int16).astype(np.float32)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+
+    if sample_rate is not None and sample_rate != file_rate and len(samples):
+        n_out = int(round(len(samples) * sample_rate / float(file_rate)))
+        positions = np.linspace(0, len(samples) - 1, n_out)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+        file_rate = sample_rate
+
+    samples = np.clip(np.round(samples), -32768, 32767).astype(np.int16)
+    return samples.tobytes(), file_rate
+
+
+class FakeMicrophoneComponent(SICService):
+    """
+    Outputs every AudioMessage it receives, unchanged, like a microphone would.
+    """
+
+    @staticmethod
+    def get_inputs():
+        return [AudioMessage]
+
+    @staticmethod
+    def get_output():
+        return AudioMessage
+
+    def on_message(self, message):
+        # Forwarded directly instead of through the SICService input buffers, so no
+        # chunk is skipped. The timestamp set by the sender is kept.
+        if isinstance(message, AudioMessage):
+            self.output_message(message)
+
+    def execute(self, inputs):
+        return None
+
+
+class FakeMicrophone(SICConnector):
+    """
+    Connector for the fake microphone component.
+    """
+
+    component_class = FakeMicrophoneComponent
+    component_group = "FakeMicrophone"
+
+    def stream(
+        self,
+        waveform,
+        sample_rate,
+        speed=1.0,
+        chunk_ms=250,
+        start_time=None,
+        stop_event=None,
+        on_chunk=None,
+    ):
+        """
+        Send audio in chunks, each at the moment a real microphone would deliver it.
+
+        Like Desktop().mic, a chunk is sent once its last sample has been "recorded".
+
+        :param waveform: 16-bit mono PCM audio
+        :type waveform: bytes
+        :param sample_rate: sample rate of the audio
+        :param speed: playback speed, e.g. 4.0 for four times real-time, 0 for no pacing
+        :param chunk_ms: length of each chunk, Desktop().mic uses 250 ms
+        :param start_time: time.time() at which recording of the first sample starts,
+            None for now. Sample s is due at start_time + s / sample_rate / speed.
+        :param stop_event: threading.Event to stop streaming early
+        :param on_chunk: called with every AudioMessage after it is sent
+        :return: the start time, to relate positions in the audio to wall-clock time
+        :rtype: float
+        """
+        chunk_bytes = 2 * int(sample_rate * chunk_ms / 1000.0)
+        if start_time is None:
+            start_time = time.time()
+
+        for offset in range(0, len(waveform), chunk_bytes):
+            if stop_event is not None and stop_event.is_set():
+                break
+            chunk = waveform[offset : offset + chunk_bytes]
+            if speed > 0:
+                due = start_time + (offset + len(chunk)) / 2.0 / sample_rate / speed
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            message = AudioMessage(chunk, sample_rate=sample_rate)
+            self.send_message(message)
+            if on_chunk is not None:
+                on_chunk(message)
+
+        return start_time
+
+
+def main():
+    SICComponentManager([FakeMicrophoneComponent], component_group="FakeMicrophone")
+
+
+if __name__ == "__main__":
+    main()
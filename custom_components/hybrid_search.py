@@ -0,0 +1,102 @@
+"""
+Helpers for hybrid retrieval: full-text (BM25) queries on the content of the chunks,
+merged with the vector results by reciprocal rank fusion.
+
+Embeddings are good at paraphrases but weak at names, codes and rare terms, which a
+keyword search finds exactly. Reciprocal rank fusion (Cormack et al., 2009) merges the
+two rankings without having to calibrate BM25 scores against cosine distances: every
+result scores sum(1 / (rrf_k + rank)) over the lists it appears in.
+
+    fused = reciprocal_rank_fusion({"vector": vector_results, "text": text_results}, k=5)
+
+Short keyword-like queries ("HNSW", "error E1234", '"redis stack"') do not need an
+embedding at all, looks_like_keywords picks them out for the text-only path.
+"""
+
+import re
+
+DEFAULT_RRF_K = 60
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+_QUESTION_WORDS = frozenset(
+    [
+        "who",
+        "what",
+        "when",
+        "where",
+        "which",
+        "why",
+        "how",
+        "is",
+        "are",
+        "can",
+        "do",
+        "does",
+        "explain",
+        "describe",
+    ]
+)
+
+
+def query_terms(text):
+    """:return: the words of a query, lowercased"""
+    return [term.lower() for term in _TERM.findall(text)]
+
+
+def text_query(text, partition=None):
+    """
+    Build a RediSearch query matching chunks whose content has any term of text, so
+    BM25 ranks chunks with more and rarer terms first.
+
+    :return: the query, None if text has no terms
+    """
+    terms = query_terms(text)
+    if not terms:
+        return None
+    query = "@content:({})".format("|".join(terms))
+    if partition:
+        query = "@partition:{{{}}} {}".format(partition, query)
+    return query
+
+
+def looks_like_keywords(text, max_terms=3):
+    """
+    :return: whether a query is a few keywords or a quoted phrase rather than a
+        question, so a full-text search suffices
+    """
+    stripped = text.strip()
+    if len(stripped) > 1 and stripped[0] == stripped[-1] == '"':
+        return True
+    terms = query_terms(stripped)
+    return (
+        0 < len(terms) <= max_terms
+        and not stripped.endswith("?")
+        and terms[0] not in _QUESTION_WORDS
+    )
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=DEFAULT_RRF_K):
+    """
+    Merge ranked result lists by reciprocal rank fusion.
+
+    :param rankings: dict of name -> results, best first, as returned by knn_search
+        and text_search
+    :param k: number of results to return
+    :param rrf_k: rank offset, larger values flatten the difference between ranks
+    :return: the best k results, with score the fused score (higher is better) and,
+        per list, <name>_rank (1-based, None if absent) and <name>_score
+    """
+    fused = {}
+    for name, results in rankings.items():
+        for rank, result in enumerate(results, 1):
+            doc_id = result["doc_id"]
+            if doc_id not in fused:
+                fused[doc_id] = dict(result, score=0.0)
+                for other in rankings:
+                    fused[doc_id]["{}_rank".format(other)] = None
+                    fused[doc_id]["{}_score".format(other)] = None
+            entry = fused[doc_id]
+            entry["score"] += 1.0 / (rrf_k + rank)
+            entry["{}_rank".format(name)] = rank
+            entry["{}_score".format(name)] = result["score"]
+    return sorted(fused.values(), key=lambda entry: -entry["score"])[:k]
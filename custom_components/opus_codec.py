@@ -0,0 +1,543 @@
+"""
+Opus compression for microphone and speaker audio streams.
+
+Robot microphone and speaker audio normally travels as raw 16-bit PCM through Redis,
+256 kbit/s for 16 kHz mono. Encoded with Opus at 16 kbit/s the same audio is 10 to 20
+times smaller, which leaves more room on a shared Wi-Fi network and makes dropouts less
+likely. Every message carries one or more Opus packets of frame_ms each, numbered with a
+sequence number, so the decoder can conceal lost packets (with in-band forward error
+correction when the next packet arrived) instead of leaving a gap.
+
+The compression has to happen in the process that produces the audio, so the robot
+runs an Opus variant of its microphone and speaker components, see
+custom_components.opus_naoqi_audio and custom_components.opus_mini_audio. The rest of
+the pipeline is negotiated:
+
+- microphone: put an OpusDecoder between the microphone and the services. It decodes
+  OpusAudioMessages and passes plain AudioMessages through unchanged, so it also works
+  when the robot runs the stock microphone.
+- speakers: play audio through an OpusSpeakerStream. It sends Opus when the speaker
+  component accepts OpusAudioRequests and the original AudioRequests otherwise.
+
+    mic = OpusNaoqiMicrophone(ip=nao_ip)
+    decoder = OpusDecoder(input_source=mic)
+    dialogflow = Dialogflow(conf=dialogflow_conf, input_source=decoder)
+
+    speaker = OpusSpeakerStream(OpusNaoqiSpeaker(ip=nao_ip))
+    speaker.play(AudioRequest(reply.waveform, reply.sample_rate))
+
+Install the codec before running (needs the libopus system library):
+    pip install opuslib
+
+Run the decoder with (from the repository root):
+    python -m custom_components.opus_codec
+"""
+
+import threading
+
+import numpy as np
+import opuslib
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import (
+    AudioMessage,
+    AudioRequest,
+    SICConfMessage,
+    SICMessage,
+    SICRequest,
+)
+from sic_framework.core.service_python2 import SICService
+from sic_framework.core.utils import is_sic_instance
+
+from custom_components.resampling import StreamResampler
+
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_FRAME_MS = (2.5, 5, 10, 20, 40, 60)
+OPUS_APPLICATIONS = ("voip", "audio", "restricted_lowdelay")
+
+
+class OpusConf(SICConfMessage):
+    """
+    Opus encoder and decoder settings.
+
+    :param bitrate: target bit rate in bit/s, 16000 is good quality speech
+    :type bitrate: int
+    :param frame_ms: duration of one Opus packet, one of OPUS_FRAME_MS
+    :type frame_ms: float
+    :param application: "voip" for speech, "audio" for music, "restricted_lowdelay"
+    :type application: str
+    :param complexity: encoder complexity 0-10, lower uses less CPU on the robot
+    :type complexity: int
+    :param fec: add in-band forward error correction, so a lost packet can be
+        recovered from the next one
+    :type fec: bool
+    :param expected_loss_percent: expected packet loss, tunes the amount of FEC
+    :type expected_loss_percent: int
+    :param max_conceal_ms: longest gap the decoder fills with concealed audio, longer
+        gaps restart the decoder
+    :type max_conceal_ms: float
+    """
+
+    def __init__(
+        self,
+        bitrate=16000,
+        frame_ms=20,
+        application="voip",
+        complexity=5,
+        fec=True,
+        expected_loss_percent=5,
+        max_conceal_ms=200,
+    ):
+        super(OpusConf, self).__init__()
+        if frame_ms not in OPUS_FRAME_MS:
+            raise ValueError(
+                "Opus frames must be one of {} ms, not {}".format(
+                    OPUS_FRAME_MS, frame_ms
+                )
+            )
+        if application not in OPUS_APPLICATIONS:
+            raise ValueError(
+                "Unknown Opus application {}, use one of {}".format(
+                    application, OPUS_APPLICATIONS
+                )
+            )
+        self.bitrate = bitrate
+        self.frame_ms = frame_ms
+        self.application = application
+        self.complexity = complexity
+        self.fec = fec
+        self.expected_loss_percent = expected_loss_percent
+        self.max_conceal_ms = max_conceal_ms
+
+
+class OpusAudio(object):
+    """
+    Opus encoded 16-bit mono audio, the compressed counterpart of Audio.
+
+    :param packets: Opus packets, each frame_size samples long
+    :type packets: list[bytes]
+    :param sample_rate: sample rate of the decoded audio, one of OPUS_SAMPLE_RATES
+    :param frame_size: samples per packet
+    :param sequence: number of the first packet in the stream of the encoder
+    :param is_stream: whether this is a chunk of a longer stream, as in Audio
+    :param source_rate: sample rate of the audio before encoding, the decoder
+        resamples back to it. None if it equals sample_rate.
+    """
+
+    def __init__(
+        self,
+        packets,
+        sample_rate,
+        frame_size,
+        sequence=0,
+        is_stream=False,
+        source_rate=None,
+    ):
+        self.packets = packets
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+        self.sequence = sequence
+        self.is_stream = is_stream
+        self.source_rate = source_rate or sample_rate
+
+
+class OpusAudioMessage(OpusAudio, SICMessage):
+    """
+    Message class to send Opus encoded audio.
+    """
+
+    def __init__(self, *args, **kwargs):
+        OpusAudio.__init__(self, *args, **kwargs)
+        SICMessage.__init__(self)
+
+
+class OpusAudioRequest(OpusAudio, SICRequest):
+    """
+    Request class to send Opus encoded audio, e.g. to play it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        OpusAudio.__init__(self, *args, **kwargs)
+        SICRequest.__init__(self)
+
+
+def opus_sample_rate(sample_rate):
+    """
+    :return: the lowest Opus sample rate that is at least sample_rate, audio at other
+        rates is resampled to it before encoding
+    """
+    for rate in OPUS_SAMPLE_RATES:
+        if rate >= sample_rate:
+            return rate
+    return OPUS_SAMPLE_RATES[-1]
+
+
+class OpusStreamEncoder(object):
+    """
+    Cuts 16-bit mono PCM chunks of any length into Opus packets.
+
+    Samples that do not fill a whole frame are kept for the next chunk.
+
+    :param sample_rate: sample rate of the input audio
+    :param conf: OpusConf, None for the defaults
+    """
+
+    def __init__(self, sample_rate, conf=None):
+        conf = conf or OpusConf()
+        self.input_rate = sample_rate
+        self.sample_rate = opus_sample_rate(sample_rate)
+        self.frame_size = int(self.sample_rate * conf.frame_ms / 1000.0)
+
+        self._resampler = None
+        if self.sample_rate != sample_rate:
+            self._resampler = StreamResampler(sample_rate, self.sample_rate)
+
+        self._encoder = opuslib.Encoder(self.sample_rate, 1, conf.application)
+        self._encoder.bitrate = conf.bitrate
+        self._encoder.complexity = conf.complexity
+        if conf.fec:
+            self._encoder.inband_fec = 1
+            self._encoder.packet_loss_perc = conf.expected_loss_percent
+
+        self._pending = b""
+        self.sequence = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def encode(self, waveform, flush=False):
+        """
+        :param waveform: the next chunk of 16-bit mono PCM audio
+        :type waveform: bytes
+        :param flush: pad the remaining samples with silence into a last packet, at the
+            end of a stream
+        :return: the sequence number of the first packet and the packets
+        :rtype: tuple[int, list[bytes]]
+        """
+        self.bytes_in += len(waveform)
+        if self._resampler is not None:
+            waveform = self._resampler.process(bytes(waveform))
+        pending = self._pending + bytes(waveform)
+
+        frame_bytes = 2 * self.frame_size
+        if flush and len(pending) % frame_bytes:
+            pending += b"\x00" * (frame_bytes - len(pending) % frame_bytes)
+
+        packets = []
+        end = len(pending) - len(pending) % frame_bytes
+        for offset in range(0, end, frame_bytes):
+            packets.append(
+                self._encoder.encode(
+                    pending[offset : offset + frame_bytes], self.frame_size
+                )
+            )
+        self._pending = pending[end:]
+        if flush and self._resampler is not None:
+            self._resampler.reset()
+
+        sequence = self.sequence
+        self.sequence += len(packets)
+        self.bytes_out += sum(len(packet) for packet in packets)
+        return sequence, packets
+
+    def encode_audio(self, audio, flush=False, message_class=OpusAudioMessage):
+        """
+        Encode an AudioMessage or AudioRequest.
+
+        :return: an OpusAudioMessage (or message_class) with the packets, None when
+            the audio did not fill a whole frame yet
+        """
+        sequence, packets = self.encode(audio.waveform, flush=flush)
+        if not packets:
+            return None
+        return message_class(
+            packets,
+            self.sample_rate,
+            self.frame_size,
+            sequence=sequence,
+            is_stream=getattr(audio, "is_stream", False),
+            source_rate=self.input_rate,
+        )
+
+
+class OpusStreamDecoder(object):
+    """
+    Decodes the packets of one encoder, concealing lost packets.
+
+    The audio is returned at the source rate, the rate it had before encoding.
+
+    :param conf: OpusConf, None for the defaults
+    """
+
+    def __init__(self, conf=None):
+        self.conf = conf or OpusConf()
+        self._decoder = None
+        self._sample_rate = None
+        self._source_rate = None
+        self._resampler = None
+        self._expected = None
+        self.lost_packets = 0
+
+    def decode(self, audio):
+        """
+        :param audio: OpusAudioMessage or OpusAudioRequest
+        :return: 16-bit mono PCM at audio.source_rate
+        :rtype: bytes
+        """
+        if (
+            self._decoder is None
+            or audio.sample_rate != self._sample_rate
+            or audio.source_rate != self._source_rate
+        ):
+            self._reset(audio.sample_rate, audio.source_rate)
+
+        frames = []
+        if self._expected is not None and audio.sequence != self._expected:
+            missing = audio.sequence - self._expected
+            max_missing = self.conf.max_conceal_ms * audio.sample_rate / 1000.0
+            if 0 < missing and missing * audio.frame_size <= max_missing:
+                self.lost_packets += missing
+                # Packet loss concealment for all but the last lost packet, which is
+                # recovered from the FEC data in the first packet that did arrive
+                for _ in range(missing - 1):
+                    frames.append(self._decoder.decode(b"", audio.frame_size))
+                frames.append(
+                    self._decoder.decode(
+                        audio.packets[0], audio.frame_size, decode_fec=True
+                    )
+                )
+            else:
+                # A new stream (e.g. the encoder restarted) or a gap too long to fill
+                self._reset(audio.sample_rate, audio.source_rate)
+
+        for packet in audio.packets:
+            frames.append(self._decoder.decode(packet, audio.frame_size))
+        self._expected = audio.sequence + len(audio.packets)
+
+        waveform = b"".join(frames)
+        if self._resampler is not None:
+            waveform = self._resampler.process(waveform)
+        return waveform
+
+    def _reset(self, sample_rate, source_rate):
+        self._decoder = opuslib.Decoder(sample_rate, 1)
+        self._sample_rate = sample_rate
+        self._source_rate = source_rate
+        self._resampler = None
+        if source_rate != sample_rate:
+            self._resampler = StreamResampler(sample_rate, source_rate)
+        self._expected = None
+
+
+def is_opus(audio):
+    # Compared by class name, see is_sic_instance
+    return is_sic_instance(audio, OpusAudio)
+
+
+def mono_to_stereo(waveform):
+    """:return: 16-bit mono PCM as 16-bit interleaved stereo, the same on both channels"""
+    samples = np.frombuffer(waveform, dtype="<i2")
+    return np.repeat(samples, 2).tobytes()
+
+
+class OpusMicrophoneMixin(object):
+    """
+    Mixin for microphone SICSensors: outputs OpusAudioMessages instead of the
+    AudioMessages returned by the execute() of the sensor.
+
+    Expects self.params.opus, an OpusConf.
+    """
+
+    _opus_encoder = None
+
+    def execute(self):
+        message = super(OpusMicrophoneMixin, self).execute()
+        if message is None:
+            return None
+
+        # Drop a trailing odd byte, e.g. of the one-byte silence messages of the
+        # Alphamini microphone, so the samples stay aligned
+        waveform = message.waveform[: len(message.waveform) // 2 * 2]
+        encoder = self._opus_encoder
+        if encoder is None or encoder.input_rate != message.sample_rate:
+            encoder = OpusStreamEncoder(message.sample_rate, self.params.opus)
+            self._opus_encoder = encoder
+        return encoder.encode_audio(AudioMessage(waveform, message.sample_rate))
+
+    @staticmethod
+    def get_output():
+        return OpusAudioMessage
+
+
+class OpusSpeakerMixin(object):
+    """
+    Mixin for speaker components: also plays OpusAudioMessages and OpusAudioRequests,
+    by decoding them before handing them to the speaker as plain audio.
+
+    Opus audio is mono. Speakers that expect stream chunks (is_stream=True) as
+    interleaved stereo, like the NAOqi speakers, set stream_channels = 2.
+
+    Expects self.params.opus, an OpusConf.
+    """
+
+    stream_channels = 1
+
+    _opus_decoder = None
+
+    def on_request(self, request):
+        if is_opus(request):
+            waveform = self._decode_opus(request)
+            if request.is_stream and self.stream_channels == 2:
+                waveform = mono_to_stereo(waveform)
+            request = AudioRequest(
+                waveform,
+                request.source_rate,
+                is_stream=request.is_stream,
+            )
+        return super(OpusSpeakerMixin, self).on_request(request)
+
+    def on_message(self, message):
+        if is_opus(message):
+            message = AudioMessage(
+                self._decode_opus(message),
+                message.source_rate,
+                is_stream=message.is_stream,
+            )
+        return super(OpusSpeakerMixin, self).on_message(message)
+
+    def _decode_opus(self, audio):
+        if self._opus_decoder is None:
+            self._opus_decoder = OpusStreamDecoder(self.params.opus)
+        return self._opus_decoder.decode(audio)
+
+    @staticmethod
+    def get_inputs():
+        return [OpusAudioMessage, AudioMessage]
+
+
+class OpusDecoderComponent(SICService):
+    """
+    Decodes OpusAudioMessages into AudioMessages, passing AudioMessages through.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(OpusDecoderComponent, self).__init__(*args, **kwargs)
+        self._decoder = OpusStreamDecoder(self.params)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_inputs():
+        return [OpusAudioMessage, AudioMessage]
+
+    @staticmethod
+    def get_output():
+        return AudioMessage
+
+    @staticmethod
+    def get_conf():
+        return OpusConf()
+
+    def on_message(self, message):
+        """
+        Decode every message in order as it arrives, skipping the SICService input
+        buffers that may drop messages.
+        """
+        if is_opus(message):
+            with self._lock:
+                waveform = self._decoder.decode(message)
+            output = AudioMessage(waveform, sample_rate=message.source_rate)
+        elif isinstance(message, AudioMessage):
+            output = message
+        else:
+            return
+
+        # Keep the capture time of the microphone chunk for downstream alignment
+        output._timestamp = message._timestamp
+        self.output_message(output)
+
+    def on_request(self, request):
+        self.logger.error("Invalid request type: {}".format(type(request)))
+        return SICMessage()
+
+
+class OpusDecoder(SICConnector):
+    """
+    Connector for the Opus decoder component.
+    """
+
+    component_class = OpusDecoderComponent
+    component_group = "OpusDecoder"
+
+
+def accepts_opus(connector):
+    """
+    :return: whether the component behind the connector accepts Opus audio
+    """
+    inputs = connector.component_class.get_inputs()
+    return any(cls.__name__ == OpusAudioMessage.__name__ for cls in inputs)
+
+
+class OpusSpeakerStream(object):
+    """
+    Plays AudioRequests on a speaker, Opus encoded when the speaker accepts it.
+
+    Keeps one encoder per sample rate, so chunks of a stream (is_stream=True) are
+    encoded as one continuous stream. Call finish() after the last chunk.
+
+    :param speaker: speaker connector, e.g. OpusNaoqiSpeaker or NaoqiSpeaker
+    :param conf: OpusConf, None for the defaults
+    """
+
+    def __init__(self, speaker, conf=None):
+        self.speaker = speaker
+        self.conf = conf or OpusConf()
+        self.enabled = accepts_opus(speaker)
+        self._encoders = {}
+
+    def play(self, request):
+        """
+        :param request: AudioRequest with 16-bit mono PCM
+        :return: the reply of the speaker, None while a stream chunk is shorter than
+            one Opus frame
+        """
+        if not self.enabled:
+            return self.speaker.request(request)
+
+        encoder = self._encoders.get(request.sample_rate)
+        if encoder is None:
+            encoder = OpusStreamEncoder(request.sample_rate, self.conf)
+            self._encoders[request.sample_rate] = encoder
+
+        opus_request = encoder.encode_audio(
+            request,
+            flush=not request.is_stream,
+            message_class=OpusAudioRequest,
+        )
+        if opus_request is None:
+            return None
+        return self.speaker.request(opus_request)
+
+    def finish(self):
+        """Play the samples of a stream that are still waiting for a full frame."""
+        for encoder in self._encoders.values():
+            opus_request = encoder.encode_audio(
+                AudioRequest(b"", encoder.input_rate, is_stream=True),
+                flush=True,
+                message_class=OpusAudioRequest,
+            )
+            if opus_request is not None:
+                self.speaker.request(opus_request)
+
+    @property
+    def compression_ratio(self):
+        """Raw PCM bytes per Opus byte sent so far."""
+        bytes_in = sum(encoder.bytes_in for encoder in self._encoders.values())
+        bytes_out = sum(encoder.bytes_out for encoder in self._encoders.values())
+        return bytes_in / float(bytes_out) if bytes_out else None
+
+
+def main():
+    SICComponentManager([OpusDecoderComponent], component_group="OpusDecoder")
+
+
+if __name__ == "__main__":
+    main()
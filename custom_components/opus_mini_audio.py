@@ -0,0 +1,93 @@
+"""
+Alphamini microphone and speakers with Opus compression, see
+custom_components.opus_codec.
+
+These components replace MiniMicrophone and MiniSpeaker and have to run on the robot,
+so that only compressed audio goes over the Wi-Fi. Copy the repository to the robot,
+install opuslib there, and run (from the repository root, on the robot):
+    python -m custom_components.opus_mini_audio
+
+Then connect to them instead of to mini.mic and mini.speaker, the stock microphone
+listens on the same port for the Android audio app and cannot run at the same time:
+
+    mic = OpusMiniMicrophone(ip=mini_ip)
+    decoder = OpusDecoder(input_source=mic)
+    speaker = OpusSpeakerStream(OpusMiniSpeaker(ip=mini_ip))
+
+The 44 kHz microphone audio is resampled to 48 kHz for Opus and back to 44 kHz by the
+decoder.
+"""
+
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import SICConfMessage
+from sic_framework.devices.common_mini.mini_microphone import MiniMicrophoneSensor
+from sic_framework.devices.common_mini.mini_speaker import (
+    MiniSpeakerComponent,
+    MiniSpeakersConf,
+)
+
+from custom_components.opus_codec import OpusConf, OpusMicrophoneMixin, OpusSpeakerMixin
+
+
+class OpusMiniMicrophoneConf(SICConfMessage):
+    """
+    :param opus_conf: OpusConf for the encoder, None for the defaults
+    """
+
+    def __init__(self, opus_conf=None):
+        super(OpusMiniMicrophoneConf, self).__init__()
+        self.opus = opus_conf or OpusConf()
+
+
+class OpusMiniMicrophoneSensor(OpusMicrophoneMixin, MiniMicrophoneSensor):
+    """
+    Alphamini microphone that outputs OpusAudioMessages.
+    """
+
+    @staticmethod
+    def get_conf():
+        return OpusMiniMicrophoneConf()
+
+
+class OpusMiniMicrophone(SICConnector):
+    component_class = OpusMiniMicrophoneSensor
+    component_group = "OpusAlphamini"
+
+
+class OpusMiniSpeakersConf(MiniSpeakersConf):
+    """
+    :param opus_conf: OpusConf for the decoder, None for the defaults
+    """
+
+    def __init__(self, sample_rate=44100, channels=1, opus_conf=None):
+        super(OpusMiniSpeakersConf, self).__init__(
+            sample_rate=sample_rate, channels=channels
+        )
+        self.opus = opus_conf or OpusConf()
+
+
+class OpusMiniSpeakerComponent(OpusSpeakerMixin, MiniSpeakerComponent):
+    """
+    Alphamini speakers that also play Opus encoded audio.
+    """
+
+    @staticmethod
+    def get_conf():
+        return OpusMiniSpeakersConf()
+
+
+class OpusMiniSpeaker(SICConnector):
+    component_class = OpusMiniSpeakerComponent
+    component_group = "OpusAlphamini"
+
+
+def main():
+    SICComponentManager(
+        [OpusMiniMicrophoneSensor, OpusMiniSpeakerComponent],
+        component_group="OpusAlphamini",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+NAO and Pepper microphone and speakers with Opus compression, see
+custom_components.opus_codec.
+
+These components replace NaoqiMicrophone and NaoqiSpeaker and have to run on the robot,
+so that only compressed audio goes over the Wi-Fi. Copy the repository to the robot,
+install opuslib there, and run (from the repository root, on the robot):
+    python -m custom_components.opus_naoqi_audio
+
+Then connect to them instead of to nao.mic and nao.speaker, the stock microphone
+registers the same NAOqi audio service and cannot run at the same time:
+
+    mic = OpusNaoqiMicrophone(ip=nao_ip)
+    decoder = OpusDecoder(input_source=mic)
+    speaker = OpusSpeakerStream(OpusNaoqiSpeaker(ip=nao_ip))
+"""
+
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.devices.common_naoqi.naoqi_microphone import (
+    NaoqiMicrophoneConf,
+    NaoqiMicrophoneSensor,
+)
+from sic_framework.devices.common_naoqi.naoqi_speakers import (
+    NaoqiSpeakerComponent,
+    NaoqiSpeakersConf,
+)
+
+from custom_components.opus_codec import OpusConf, OpusMicrophoneMixin, OpusSpeakerMixin
+
+
+class OpusNaoqiMicrophoneConf(NaoqiMicrophoneConf):
+    """
+    :param opus_conf: OpusConf for the encoder, None for the defaults
+    """
+
+    def __init__(self, opus_conf=None):
+        super(OpusNaoqiMicrophoneConf, self).__init__()
+        self.opus = opus_conf or OpusConf()
+
+
+class OpusNaoqiMicrophoneSensor(OpusMicrophoneMixin, NaoqiMicrophoneSensor):
+    """
+    NAOqi microphone that outputs OpusAudioMessages.
+    """
+
+    @staticmethod
+    def get_conf():
+        return OpusNaoqiMicrophoneConf()
+
+
+class OpusNaoqiMicrophone(SICConnector):
+    component_class = OpusNaoqiMicrophoneSensor
+    component_group = "OpusNaoqi"
+
+
+class OpusNaoqiSpeakersConf(NaoqiSpeakersConf):
+    """
+    :param opus_conf: OpusConf for the decoder, None for the defaults
+    """
+
+    def __init__(self, opus_conf=None):
+        super(OpusNaoqiSpeakersConf, self).__init__()
+        self.opus = opus_conf or OpusConf()
+
+
+class OpusNaoqiSpeakerComponent(OpusSpeakerMixin, NaoqiSpeakerComponent):
+    """
+    NAOqi speakers that also play Opus encoded audio.
+
+    NaoqiSpeakerComponent streams chunks as 16-bit stereo, so decoded stream chunks are
+    upmixed; whole sounds are played as mono.
+    """
+
+    stream_channels = 2
+
+    @staticmethod
+    def get_conf():
+        return OpusNaoqiSpeakersConf()
+
+
+class OpusNaoqiSpeaker(SICConnector):
+    component_class = OpusNaoqiSpeakerComponent
+    component_group = "OpusNaoqi"
+
+
+def main():
+    SICComponentManager(
+        [OpusNaoqiMicrophoneSensor, OpusNaoqiSpeakerComponent],
+        component_group="OpusNaoqi",
+    )
+
+
+if __name__ == "__main__":
+    main()
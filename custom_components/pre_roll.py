@@ -0,0 +1,130 @@
+"""
+Microphone pre-roll for speech recognition services.
+
+The stock Whisper, Google Speech-to-Text and Dialogflow CX services only start to
+consume audio once a recognition request arrives. When the user starts talking right
+after the robot has finished, the first syllables are lost. The pre-roll variants of
+these services (pre_roll_whisper, pre_roll_google_stt, pre_roll_dialogflow_cx) keep
+the last pre_roll_ms of microphone audio in a ring buffer while no request is active
+and hand it to the recognizer first when the next request starts.
+
+Audio that arrives while no request is active only goes into the ring buffer, so
+stale audio (such as the robot's own voice from seconds ago) is not recognized.
+"""
+
+import collections
+import queue
+import threading
+
+# Room for live audio behind the pre-roll in the audio_buffer of the Google services,
+# 2 seconds of 250 ms chunks like the stock Google Speech-to-Text buffer
+LIVE_AUDIO_CHUNKS = 8
+
+
+class PreRollBuffer(object):
+    """
+    Ring buffer with the most recent audio chunks, together at least max_ms long.
+
+    :param max_ms: how much audio to keep, in milliseconds
+    :type max_ms: float
+    """
+
+    def __init__(self, max_ms):
+        self.max_ms = max_ms
+        self._chunks = collections.deque()
+        self._bytes = 0
+        self._sample_rate = None
+
+    def add(self, waveform, sample_rate):
+        """
+        :param waveform: 16-bit mono PCM audio
+        :param sample_rate: its sample rate, the buffer is cleared when it changes
+        """
+        if sample_rate != self._sample_rate:
+            self.clear()
+            self._sample_rate = sample_rate
+        self._chunks.append(bytes(waveform))
+        self._bytes += len(waveform)
+
+        max_bytes = self._max_bytes()
+        while self._chunks and self._bytes - len(self._chunks[0]) >= max_bytes:
+            self._bytes -= len(self._chunks.popleft())
+
+    def take(self):
+        """
+        Return the buffered audio, trimmed to max_ms, and empty the buffer.
+
+        :return: the audio chunks, oldest first; only the first one may be shortened
+        :rtype: list[bytes]
+        """
+        chunks = list(self._chunks)
+        excess = self._bytes - self._max_bytes()
+        if chunks and excess > 0:
+            chunks[0] = chunks[0][excess:]
+        self.clear()
+        return [chunk for chunk in chunks if chunk]
+
+    def clear(self):
+        self._chunks.clear()
+        self._bytes = 0
+
+    def _max_bytes(self):
+        if self._sample_rate is None:
+            return 0
+        return 2 * int(self._sample_rate * self.max_ms / 1000.0)
+
+
+class PreRollMixin(object):
+    """
+    Mixin for SICServices that gates incoming audio and replays the pre-roll.
+
+    The service calls _init_pre_roll() in __init__, passes its audio messages through
+    _on_audio(), and wraps each recognition request in _start_listening() and
+    _stop_listening(). Expects self.params.pre_roll_ms.
+    """
+
+    def _init_pre_roll(self):
+        self._pre_roll = PreRollBuffer(self.params.pre_roll_ms)
+        self._pre_roll_lock = threading.Lock()
+        self._listening = False
+
+    def _on_audio(self, message, forward):
+        """
+        Hand the audio to the recognizer with forward(message) during a request,
+        otherwise keep it as pre-roll.
+        """
+        with self._pre_roll_lock:
+            if self._listening:
+                forward(message)
+            else:
+                self._pre_roll.add(message.waveform, message.sample_rate)
+
+    def _start_listening(self, push):
+        """
+        Start forwarding audio, after push(chunks) has queued the pre-roll.
+
+        Runs under the same lock as _on_audio, so no new audio is queued before the
+        pre-roll.
+        """
+        with self._pre_roll_lock:
+            chunks = self._pre_roll.take()
+            push(chunks)
+            self._listening = True
+        self.logger.debug(
+            "Started listening with {} bytes of pre-roll".format(sum(map(len, chunks)))
+        )
+
+    def _reset_audio_buffer(self, chunks):
+        """
+        For services that stream from self.audio_buffer (Google Speech-to-Text,
+        Dialogflow CX): replace the buffer by one that starts with the pre-roll.
+
+        Use as the push function of _start_listening.
+        """
+        self.audio_buffer = queue.Queue(maxsize=len(chunks) + LIVE_AUDIO_CHUNKS)
+        for chunk in chunks:
+            self.audio_buffer.put_nowait(chunk)
+
+    def _stop_listening(self):
+        with self._pre_roll_lock:
+            self._listening = False
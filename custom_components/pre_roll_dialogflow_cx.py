@@ -0,0 +1,83 @@
+"""
+Dialogflow CX with microphone pre-roll, see custom_components.pre_roll.
+
+Drop-in replacement for DialogflowCX: DetectIntentRequest starts with the last
+pre_roll_ms of audio from before the request, so speech that starts right away is not
+cut off.
+
+    conf = PreRollDialogflowCXConf(keyfile_json=keyfile_json, agent_id=agent_id, pre_roll_ms=500)
+    dialogflow_cx = PreRollDialogflowCX(input_source=nao.mic, conf=conf)
+
+Run the component with (from the repository root):
+    python -m custom_components.pre_roll_dialogflow_cx
+"""
+
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import AudioMessage
+from sic_framework.core.utils import is_sic_instance
+from sic_framework.services.dialogflow_cx.dialogflow_cx import (
+    DialogflowCXComponent,
+    DialogflowCXConf,
+)
+
+from custom_components.pre_roll import PreRollMixin
+
+
+class PreRollDialogflowCXConf(DialogflowCXConf):
+    """
+    Configuration for Dialogflow CX with pre-roll. See DialogflowCXConf for the other
+    parameters.
+
+    :param pre_roll_ms: audio from before the request that is recognized with it
+    :type pre_roll_ms: float
+    """
+
+    def __init__(self, keyfile_json, agent_id, pre_roll_ms=500, **kwargs):
+        super(PreRollDialogflowCXConf, self).__init__(keyfile_json, agent_id, **kwargs)
+        self.pre_roll_ms = pre_roll_ms
+
+
+class PreRollDialogflowCXComponent(PreRollMixin, DialogflowCXComponent):
+    """
+    DialogflowCXComponent that prepends recent microphone audio to every request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PreRollDialogflowCXComponent, self).__init__(*args, **kwargs)
+        self._init_pre_roll()
+
+    @staticmethod
+    def get_conf():
+        return PreRollDialogflowCXConf()
+
+    def on_message(self, message):
+        if not is_sic_instance(message, AudioMessage):
+            return super(PreRollDialogflowCXComponent, self).on_message(message)
+        self._on_audio(message, super(PreRollDialogflowCXComponent, self).on_message)
+
+    def detect_intent(self, request):
+        self._start_listening(self._reset_audio_buffer)
+        try:
+            return super(PreRollDialogflowCXComponent, self).detect_intent(request)
+        finally:
+            self._stop_listening()
+
+
+class PreRollDialogflowCX(SICConnector):
+    """
+    Connector for the Dialogflow CX component with pre-roll.
+    """
+
+    component_class = PreRollDialogflowCXComponent
+    component_group = "PreRollDialogflowCX"
+
+
+def main():
+    SICComponentManager(
+        [PreRollDialogflowCXComponent], component_group="PreRollDialogflowCX"
+    )
+
+
+if __name__ == "__main__":
+    main()
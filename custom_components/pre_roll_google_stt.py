@@ -0,0 +1,86 @@
+"""
+Google Speech-to-Text with microphone pre-roll, see custom_components.pre_roll.
+
+Drop-in replacement for GoogleSpeechToText: GetStatementRequest starts with the last
+pre_roll_ms of audio from before the request, so speech that starts right away is not
+cut off.
+
+    conf = PreRollGoogleSpeechToTextConf(keyfile_json=keyfile_json, pre_roll_ms=500)
+    stt = PreRollGoogleSpeechToText(input_source=desktop.mic, conf=conf)
+
+Run the component with (from the repository root):
+    python -m custom_components.pre_roll_google_stt
+"""
+
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import AudioMessage
+from sic_framework.core.utils import is_sic_instance
+from sic_framework.services.google_stt.google_stt import (
+    GoogleSpeechToTextComponent,
+    GoogleSpeechToTextConf,
+)
+
+from custom_components.pre_roll import PreRollMixin
+
+
+class PreRollGoogleSpeechToTextConf(GoogleSpeechToTextConf):
+    """
+    Configuration for Google Speech-to-Text with pre-roll. See GoogleSpeechToTextConf
+    for the other parameters.
+
+    :param pre_roll_ms: audio from before the request that is recognized with it
+    :type pre_roll_ms: float
+    """
+
+    def __init__(self, keyfile_json, pre_roll_ms=500, **kwargs):
+        super(PreRollGoogleSpeechToTextConf, self).__init__(keyfile_json, **kwargs)
+        self.pre_roll_ms = pre_roll_ms
+
+
+class PreRollGoogleSpeechToTextComponent(PreRollMixin, GoogleSpeechToTextComponent):
+    """
+    GoogleSpeechToTextComponent that prepends recent microphone audio to every request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PreRollGoogleSpeechToTextComponent, self).__init__(*args, **kwargs)
+        self._init_pre_roll()
+
+    @staticmethod
+    def get_conf():
+        return PreRollGoogleSpeechToTextConf()
+
+    def on_message(self, message):
+        if not is_sic_instance(message, AudioMessage):
+            return super(PreRollGoogleSpeechToTextComponent, self).on_message(message)
+        self._on_audio(
+            message, super(PreRollGoogleSpeechToTextComponent, self).on_message
+        )
+
+    def get_statement(self):
+        self._start_listening(self._reset_audio_buffer)
+        try:
+            return super(PreRollGoogleSpeechToTextComponent, self).get_statement()
+        finally:
+            self._stop_listening()
+
+
+class PreRollGoogleSpeechToText(SICConnector):
+    """
+    Connector for the Google Speech-to-Text component with pre-roll.
+    """
+
+    component_class = PreRollGoogleSpeechToTextComponent
+    component_group = "PreRollGoogleSpeechToText"
+
+
+def main():
+    SICComponentManager(
+        [PreRollGoogleSpeechToTextComponent],
+        component_group="PreRollGoogleSpeechToText",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Whisper speech-to-text with microphone pre-roll, see custom_components.pre_roll.
+
+Drop-in replacement for SICWhisper: GetTranscript starts with the last pre_roll_ms of
+audio from before the request, so speech that starts right away is not cut off.
+
+    whisper = PreRollWhisper(input_source=desktop.mic, conf=PreRollWhisperConf(pre_roll_ms=500))
+
+Run the component with (from the repository root):
+    python -m custom_components.pre_roll_whisper
+"""
+
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import AudioMessage
+from sic_framework.services.openai_whisper_stt.whisper_stt import (
+    RemoteAudioDevice,
+    WhisperComponent,
+    WhisperConf,
+)
+
+from custom_components.pre_roll import PreRollMixin
+
+
+class PreRollWhisperConf(WhisperConf):
+    """
+    Configuration for Whisper with pre-roll. See WhisperConf for the other parameters.
+
+    :param pre_roll_ms: audio from before the request that is transcribed with it
+    :type pre_roll_ms: float
+    """
+
+    def __init__(self, pre_roll_ms=500, **kwargs):
+        super(PreRollWhisperConf, self).__init__(**kwargs)
+        self.pre_roll_ms = pre_roll_ms
+
+
+class _PreRollStream(RemoteAudioDevice.Stream):
+    """
+    Audio stream whose next clear() keeps the pre-roll that was just written.
+
+    WhisperComponent.execute clears the stream before listening; the pre-roll is
+    written before that, while no other audio can be queued.
+    """
+
+    def __init__(self, stop_event=None):
+        super(_PreRollStream, self).__init__(stop_event=stop_event)
+        self.keep_on_clear = False
+
+    def clear(self):
+        if self.keep_on_clear:
+            self.keep_on_clear = False
+            return
+        super(_PreRollStream, self).clear()
+
+
+class PreRollWhisperComponent(PreRollMixin, WhisperComponent):
+    """
+    WhisperComponent that prepends recent microphone audio to every request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PreRollWhisperComponent, self).__init__(*args, **kwargs)
+        self.source.stream = _PreRollStream(stop_event=self._stream_stop_event)
+        self._init_pre_roll()
+
+    @staticmethod
+    def get_conf():
+        return PreRollWhisperConf()
+
+    def on_message(self, message):
+        if not isinstance(message, AudioMessage):
+            return super(PreRollWhisperComponent, self).on_message(message)
+        # WhisperComponent infers these from the first audio it is given, which would
+        # be after the first request started; the pre-roll needs them before that
+        if (
+            not self.parameters_are_inferred
+            or message.sample_rate != self.source.SAMPLE_RATE
+        ):
+            self.source.SAMPLE_RATE = message.sample_rate
+            self.source.CHUNK = min(len(message.waveform), self.source.CHUNK)
+            self.parameters_are_inferred = True
+            self.logger.info(
+                "Inferred sample rate: {} and chunk size: {}".format(
+                    self.source.SAMPLE_RATE, self.source.CHUNK
+                )
+            )
+        self._on_audio(message, super(PreRollWhisperComponent, self).on_message)
+
+    def execute(self, request):
+        def push(chunks):
+            self.source.stream.clear()
+            for chunk in chunks:
+                self.source.stream.write(chunk)
+            self.source.stream.keep_on_clear = True
+
+        self._start_listening(push)
+        try:
+            return super(PreRollWhisperComponent, self).execute(request)
+        finally:
+            self._stop_listening()
+
+
+class PreRollWhisper(SICConnector):
+    """
+    Connector for the Whisper component with pre-roll.
+    """
+
+    component_class = PreRollWhisperComponent
+    component_group = "PreRollWhisper"
+
+
+def main():
+    SICComponentManager([PreRollWhisperComponent], component_group="PreRollWhisper")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,683 @@
+"""
+Redis datastore with faster retrieval for the RAG demos.
+
+RAGDatastoreComponent handles the same requests as the stock RedisDatastore service
+and is a drop-in replacement for it. QueryVectorDBRequests embed the query through an
+EmbeddingCache (see custom_components.embedding_cache), so a repeated question skips
+the embedding API round trip. The payload of a query reports whether the embedding
+came from the cache:
+
+    datastore = RAGDatastore(conf=RAGDatastoreConf(password="changemeplease"))
+    reply = datastore.request(QueryVectorDBRequest(index_name=..., query_text=...))
+    reply.payload["embedding_cached"]
+
+SyncVectorDocsRequest ingests documents incrementally: only new and changed chunks are
+embedded and the index is never dropped, see custom_components.vector_ingest. The
+embeddings are requested in concurrent batches, and VectorDBProgressMessages are output
+while it runs, register a callback on the connector to follow the progress:
+
+    datastore.register_callback(lambda message: print(message.progress))
+    datastore.request(SyncVectorDocsRequest(input_path=..., index_name=...), timeout=600)
+
+Both kinds of requests also take local embedding models, e.g.
+embedding_model="local:all-MiniLM-L6-v2", to index and query without an API key or
+network access, see custom_components.embedding_backends. A plain
+IngestVectorDocsRequest with a local model is handled like a SyncVectorDocsRequest.
+
+HybridQueryRequest is a QueryVectorDBRequest with a mode: "vector" (KNN only, like a
+QueryVectorDBRequest), "text" (a BM25 full-text search on the content of the chunks,
+without embedding the query), "hybrid" (both in parallel, merged by reciprocal rank
+fusion, see custom_components.hybrid_search) or "auto" (text for keyword-like queries,
+hybrid otherwise). The payload reports the mode that was used:
+
+    reply = datastore.request(HybridQueryRequest(index_name=..., query_text=..., mode="auto"))
+    reply.payload["mode"]
+
+With a rerank_model, a HybridQueryRequest retrieves rerank_candidates chunks and returns
+the k best by a cross-encoder on the CPU of the service, see custom_components.reranker.
+
+LookupAnswerRequest is a HybridQueryRequest that first looks for the answer to a
+similar earlier question in a SemanticAnswerCache (see custom_components.answer_cache).
+On a hit the payload has the answer and the chunks it was based on; on a miss it has
+the results of the query, and the answer generated from them can be stored with a
+StoreAnswerRequest:
+
+    reply = datastore.request(LookupAnswerRequest(index_name=..., query_text=...))
+    if reply.payload["answer"] is None:
+        answer = ...
+        datastore.request(StoreAnswerRequest(index_name=..., query_text=...,
+                                             results=reply.payload["results"], answer=answer))
+
+To save memory, a SyncVectorDocsRequest can store the vectors with fewer dimensions
+and/or as FLOAT16 (dimensions=256, vector_type="FLOAT16"); queries are converted to
+match the index.
+
+Redis Stack has to be running (e.g. run-redis, or the docker-compose.yml of a demo).
+
+Run the component with (from the repository root):
+    python -m custom_components.rag_datastore
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+from redis.exceptions import DataError, OutOfMemoryError, RedisError
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import SICMessage, SICRequest, SICSuccessMessage
+from sic_framework.core.utils import is_sic_instance, str_if_bytes
+from sic_framework.services.datastore.redis_datastore import (
+    REDIS_STACK_INSTALL_MESSAGE,
+    IngestVectorDocsRequest,
+    QueryVectorDBRequest,
+    RedisDatastoreComponent,
+    RedisDatastoreConf,
+    VectorDBResultsMessage,
+    sanitize_index_name,
+)
+
+from custom_components.answer_cache import (
+    DEFAULT_MAX_ENTRIES as DEFAULT_ANSWER_CACHE_SIZE,
+)
+from custom_components.answer_cache import (
+    DEFAULT_THRESHOLD as DEFAULT_ANSWER_CACHE_THRESHOLD,
+)
+from custom_components.answer_cache import DEFAULT_TTL as DEFAULT_ANSWER_CACHE_TTL
+from custom_components.answer_cache import SemanticAnswerCache
+from custom_components.batch_embedder import DEFAULT_BATCH_SIZE, DEFAULT_MAX_CONCURRENCY
+from custom_components.embedding_backends import embed_batch_function, is_local_model
+from custom_components.embedding_cache import (
+    DEFAULT_MAX_ENTRIES,
+    DEFAULT_TTL,
+    EmbeddingCache,
+)
+from custom_components.hybrid_search import (
+    DEFAULT_RRF_K,
+    looks_like_keywords,
+    reciprocal_rank_fusion,
+    text_query,
+)
+from custom_components.reranker import DEFAULT_RERANK_CANDIDATES, local_reranker
+from custom_components.vector_ingest import (
+    load_index_meta,
+    sync_vector_docs,
+    vector_blob,
+)
+
+
+class RAGDatastoreConf(RedisDatastoreConf):
+    """
+    RedisDatastoreConf with the settings of the retrieval optimizations.
+
+    :param embedding_cache_ttl: seconds a query embedding is kept in Redis
+    :param embedding_cache_size: query embeddings kept in the service's memory
+    :param answer_cache_threshold: minimum cosine similarity of a question to a
+        cached one to reuse its answer
+    :param answer_cache_ttl: seconds an answer is kept
+    :param answer_cache_size: answers kept in the service's memory
+    :param kwargs: RedisDatastoreConf parameters, e.g. host, port and password
+    """
+
+    def __init__(
+        self,
+        embedding_cache_ttl=DEFAULT_TTL,
+        embedding_cache_size=DEFAULT_MAX_ENTRIES,
+        answer_cache_threshold=DEFAULT_ANSWER_CACHE_THRESHOLD,
+        answer_cache_ttl=DEFAULT_ANSWER_CACHE_TTL,
+        answer_cache_size=DEFAULT_ANSWER_CACHE_SIZE,
+        **kwargs
+    ):
+        super(RAGDatastoreConf, self).__init__(**kwargs)
+        self.embedding_cache_ttl = embedding_cache_ttl
+        self.embedding_cache_size = embedding_cache_size
+        self.answer_cache_threshold = answer_cache_threshold
+        self.answer_cache_ttl = answer_cache_ttl
+        self.answer_cache_size = answer_cache_size
+
+
+class SyncVectorDocsRequest(IngestVectorDocsRequest):
+    """
+    IngestVectorDocsRequest that brings the index in line with the documents, embedding
+    only new and changed chunks and deleting chunks of removed content, while the index
+    stays live. Takes the same parameters; override_existing is implied and
+    force_recreate_index=True starts over from an empty index.
+
+    The reply is a VectorDBResultsMessage with, per index, the number of files and
+    chunks and how many were unchanged, embedded or deleted.
+
+    :param embedding_batch_size: texts per embedding request
+    :param max_concurrent_requests: embedding requests in flight at the same time
+    :param dimensions: store the first dimensions of the embeddings, normalized again,
+        None for all. Only for models trained for it, e.g. text-embedding-3-*
+    :param vector_type: "FLOAT32" or "FLOAT16", which halves the index memory
+    :param kwargs: IngestVectorDocsRequest parameters
+    """
+
+    def __init__(
+        self,
+        embedding_batch_size=DEFAULT_BATCH_SIZE,
+        max_concurrent_requests=DEFAULT_MAX_CONCURRENCY,
+        dimensions=None,
+        vector_type="FLOAT32",
+        **kwargs
+    ):
+        super(SyncVectorDocsRequest, self).__init__(**kwargs)
+        self.embedding_batch_size = embedding_batch_size
+        self.max_concurrent_requests = max_concurrent_requests
+        self.dimensions = dimensions
+        self.vector_type = vector_type
+
+
+class HybridQueryRequest(QueryVectorDBRequest):
+    """
+    QueryVectorDBRequest that can also search the text of the chunks.
+
+    With mode "text" (or "auto" on a keyword-like query) the score of a result is its
+    BM25 score, otherwise of the fused ranking; both are higher for better results.
+    Mode "vector" returns cosine distances, like a QueryVectorDBRequest.
+
+    :param mode: "vector", "text", "hybrid" or "auto"
+    :param candidates: results taken from each search before fusion, default
+        max(20, 2 * k)
+    :param rrf_k: rank offset of the reciprocal rank fusion
+    :param rerank_model: cross-encoder to rerank the results with, e.g.
+        "cross-encoder/ms-marco-MiniLM-L-6-v2", None to not rerank. The score of a
+        result is then its relevance, and its search score is in retrieval_score
+    :param rerank_candidates: results retrieved for the reranker, of which the k most
+        relevant are returned
+    :param kwargs: QueryVectorDBRequest parameters, openai_api_key is not needed for
+        mode "text"
+    """
+
+    MODES = ("vector", "text", "hybrid", "auto")
+
+    def __init__(
+        self,
+        mode="hybrid",
+        candidates=None,
+        rrf_k=DEFAULT_RRF_K,
+        rerank_model=None,
+        rerank_candidates=DEFAULT_RERANK_CANDIDATES,
+        **kwargs
+    ):
+        kwargs.setdefault("openai_api_key", None)
+        super(HybridQueryRequest, self).__init__(**kwargs)
+        if mode not in self.MODES:
+            raise ValueError(
+                "mode must be one of {}, not {}".format(", ".join(self.MODES), mode)
+            )
+        self.mode = mode
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.rerank_model = rerank_model
+        self.rerank_candidates = rerank_candidates
+
+
+class LookupAnswerRequest(HybridQueryRequest):
+    """
+    HybridQueryRequest that returns the cached answer of a similar earlier question if
+    there is one. The payload has, besides the query payload, answer (None on a miss),
+    answer_cached and, on a hit, similarity and cached_question.
+
+    :param similarity_threshold: overrides answer_cache_threshold of the conf
+    :param kwargs: HybridQueryRequest parameters
+    """
+
+    def __init__(self, similarity_threshold=None, **kwargs):
+        super(LookupAnswerRequest, self).__init__(**kwargs)
+        self.similarity_threshold = similarity_threshold
+
+
+class StoreAnswerRequest(SICRequest):
+    """
+    Cache the answer to a question for LookupAnswerRequests. The answer is reused only
+    while the chunks in results keep their content.
+
+    :param index_name: index the results came from
+    :param query_text: the question
+    :param results: results of the LookupAnswerRequest the answer is based on
+    :param answer: the answer
+    :param openai_api_key: OpenAI API key, only needed if the question embedding is no
+        longer cached
+    :param partition: partition of the LookupAnswerRequest
+    :param embedding_model: embedding model of the LookupAnswerRequest
+    """
+
+    def __init__(
+        self,
+        *,
+        index_name,
+        query_text,
+        results,
+        answer,
+        openai_api_key=None,
+        partition=None,
+        embedding_model="text-embedding-3-large"
+    ):
+        super(StoreAnswerRequest, self).__init__()
+        self.index_name = index_name
+        self.query_text = query_text
+        self.results = results
+        self.answer = answer
+        self.openai_api_key = openai_api_key
+        self.partition = partition
+        self.embedding_model = embedding_model
+
+
+class VectorDBProgressMessage(SICMessage):
+    """
+    Progress of a SyncVectorDocsRequest, output after scanning the files and after
+    every embedding batch.
+
+    :param progress: dict with index, partition, stage ("scanned", "embedding" or
+        "done"), files, changed_files, chunks_to_embed, chunks_embedded, elapsed
+        (seconds) and backoff (seconds of rate limit backoff, 0 if none)
+    """
+
+    def __init__(self, progress):
+        super(VectorDBProgressMessage, self).__init__()
+        self.progress = progress
+
+
+def knn_search(redis_conn, index, query_blob, k, partition=None):
+    """
+    Find the k chunks closest to a query embedding.
+
+    :param redis_conn: Redis connection with decode_responses=False
+    :param index: sanitized index name
+    :param query_blob: query embedding in the vector type of the index
+    :return: (total, results), results in order of increasing cosine distance
+    """
+    filter_base = "@partition:{{{}}}".format(partition) if partition else "*"
+    query = "{}=>[KNN {} @embedding $vec AS score]".format(filter_base, k)
+    try:
+        res = redis_conn.execute_command(
+            "FT.SEARCH",
+            index,
+            query,
+            "PARAMS",
+            2,
+            "vec",
+            query_blob,
+            "SORTBY",
+            "score",
+            "RETURN",
+            4,
+            "score",
+            "doc_path",
+            "chunk_id",
+            "content",
+            "DIALECT",
+            2,
+        )
+    except redis.ResponseError as e:
+        _raise_search_error(index, e)
+
+    if not res:
+        return 0, []
+    return int(res[0]), parse_search_results(res)
+
+
+def text_search(redis_conn, index, query_text, k, partition=None):
+    """
+    Find the k chunks whose content best matches the words of a query, by BM25.
+
+    :param redis_conn: Redis connection with decode_responses=False
+    :param index: sanitized index name
+    :return: (total, results), results in order of decreasing BM25 score
+    """
+    query = text_query(query_text, partition)
+    if query is None:
+        return 0, []
+    try:
+        res = redis_conn.execute_command(
+            "FT.SEARCH",
+            index,
+            query,
+            "WITHSCORES",
+            "SCORER",
+            "BM25",
+            "LIMIT",
+            0,
+            k,
+            "RETURN",
+            3,
+            "doc_path",
+            "chunk_id",
+            "content",
+            "DIALECT",
+            2,
+        )
+    except redis.ResponseError as e:
+        if "syntax error" in str(e).lower():
+            # e.g. a query of stopwords only
+            return 0, []
+        _raise_search_error(index, e)
+
+    if not res:
+        return 0, []
+    # WITHSCORES replies id, score, fields; move the score into the fields
+    reshaped = [res[0]]
+    for i in range(1, len(res), 3):
+        fields = res[i + 2] if isinstance(res[i + 2], list) else []
+        reshaped.extend([res[i], fields + [b"score", res[i + 1]]])
+    return int(res[0]), parse_search_results(reshaped)
+
+
+def _raise_search_error(index, e):
+    error_msg = str(e).lower()
+    if "unknown command" in error_msg or "ft.search" in error_msg:
+        raise RuntimeError(
+            "{}\nOriginal error: {}".format(REDIS_STACK_INSTALL_MESSAGE, e)
+        ) from e
+    if "no such index" in error_msg or "unknown index" in error_msg:
+        raise RuntimeError(
+            "Index '{}' does not exist. Ingest documents first using "
+            "IngestVectorDocsRequest.\nOriginal error: {}".format(index, e)
+        ) from e
+    raise e
+
+
+def parse_search_results(res):
+    """Turn an FT.SEARCH reply into result dicts like the stock service returns."""
+    results = []
+    for i in range(1, len(res), 2):
+        fields = res[i + 1]
+        parsed = {}
+        if isinstance(fields, list):
+            for j in range(0, len(fields), 2):
+                parsed[str_if_bytes(fields[j], errors="ignore")] = fields[j + 1]
+
+        score = str_if_bytes(parsed.get("score", b""), errors="ignore")
+        try:
+            score = float(score)
+        except ValueError:
+            pass
+
+        results.append(
+            {
+                "doc_id": str_if_bytes(res[i], errors="ignore"),
+                "score": score,
+                "doc_path": str_if_bytes(parsed.get("doc_path", b""), errors="ignore"),
+                "chunk_id": str_if_bytes(parsed.get("chunk_id", b""), errors="ignore"),
+                "content": str_if_bytes(
+                    parsed.get("content", b""), errors="ignore"
+                ).strip(),
+            }
+        )
+    return results
+
+
+class RAGDatastoreComponent(RedisDatastoreComponent):
+    """
+    RedisDatastoreComponent that caches query embeddings.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RAGDatastoreComponent, self).__init__(*args, **kwargs)
+        self.embedding_cache = EmbeddingCache(
+            self.redis_binary,
+            ttl=self.params.embedding_cache_ttl,
+            max_entries=self.params.embedding_cache_size,
+        )
+        self.answer_cache = SemanticAnswerCache(
+            self.redis_binary,
+            threshold=self.params.answer_cache_threshold,
+            ttl=self.params.answer_cache_ttl,
+            max_entries=self.params.answer_cache_size,
+        )
+        # Runs the text search of hybrid queries next to the embedding and KNN search
+        self.search_pool = ThreadPoolExecutor(max_workers=4)
+
+    @staticmethod
+    def get_inputs():
+        return RedisDatastoreComponent.get_inputs() + [
+            SyncVectorDocsRequest,
+            HybridQueryRequest,
+            LookupAnswerRequest,
+            StoreAnswerRequest,
+        ]
+
+    @staticmethod
+    def get_output():
+        return RedisDatastoreComponent.get_output() + [VectorDBProgressMessage]
+
+    @staticmethod
+    def get_conf():
+        return RAGDatastoreConf()
+
+    def handle_datastore_actions(self, request):
+        # A SyncVectorDocsRequest is also an IngestVectorDocsRequest, so check it first
+        if is_sic_instance(request, SyncVectorDocsRequest):
+            handler = self.sync_vector_docs
+        elif is_sic_instance(request, IngestVectorDocsRequest) and is_local_model(
+            request.embedding_model
+        ):
+            # The stock ingestion only knows OpenAI models
+            handler = self.sync_vector_docs
+        elif is_sic_instance(request, LookupAnswerRequest):
+            handler = self.lookup_answer
+        elif is_sic_instance(request, StoreAnswerRequest):
+            try:
+                self.store_answer(request)
+            except RedisError as e:
+                self.logger.error("Redis error occurred: {}".format(e))
+            return SICSuccessMessage()
+        elif is_sic_instance(request, HybridQueryRequest):
+            handler = self.hybrid_query
+        elif is_sic_instance(request, QueryVectorDBRequest):
+            handler = self.query_vector_db
+        else:
+            return super(RAGDatastoreComponent, self).handle_datastore_actions(request)
+
+        try:
+            return VectorDBResultsMessage(payload=handler(request))
+        except OutOfMemoryError as e:
+            self.logger.error("Redis store is out of memory: {}".format(e))
+        except DataError as e:
+            self.logger.error("Invalid data for Redis operation: {}".format(e))
+        except RedisError as e:
+            self.logger.error("Redis error occurred: {}".format(e))
+
+    def sync_vector_docs(self, request):
+        start = time.time()
+        payload = sync_vector_docs(
+            self.redis_binary,
+            request,
+            logger=self.logger,
+            progress=lambda progress: self.output_message(
+                VectorDBProgressMessage(progress)
+            ),
+        )
+        for result in payload["results"]:
+            self.logger.info(
+                "Synced {index}: {files} files, {unchanged_files} unchanged, "
+                "{embedded_chunks} chunks embedded, {deleted_chunks} deleted".format(
+                    **result
+                )
+            )
+        self.logger.info("Sync took {:.1f} s".format(time.time() - start))
+        return payload
+
+    def embed_query(self, request):
+        """
+        :return: (query embedding as float32 bytes, whether it was cached)
+        """
+        misses = self.embedding_cache.misses
+        blob = self.embedding_cache.embed(
+            request.embedding_model,
+            request.query_text,
+            # Not embedded by a BatchEmbedder, so the client retries itself
+            lambda text: embed_batch_function(
+                request.embedding_model, request.openai_api_key, max_retries=None
+            )([text])[0],
+        )
+        return blob, self.embedding_cache.misses == misses
+
+    def vector_search(self, request, index, k):
+        """
+        :return: (total, results, whether the query embedding was cached)
+        """
+        start = time.time()
+        blob, cached = self.embed_query(request)
+        meta = load_index_meta(self.redis_binary, index)
+        if meta is not None:
+            blob = vector_blob(blob, meta["dimensions"], meta["vector_type"])
+        embedded = time.time()
+        total, results = knn_search(
+            self.redis_binary, index, blob, k, request.partition
+        )
+        self.logger.debug(
+            "Query embedding {:.0f} ms ({}), search {:.0f} ms".format(
+                (embedded - start) * 1000,
+                "cached" if cached else "API",
+                (time.time() - embedded) * 1000,
+            )
+        )
+        return total, results, cached
+
+    def query_vector_db(self, request):
+        if request.k <= 0:
+            raise ValueError("k must be > 0")
+        index = sanitize_index_name(request.index_name)
+        total, results, cached = self.vector_search(request, index, request.k)
+        return {
+            "index": index,
+            "total": total,
+            "results": results,
+            "embedding_cached": cached,
+        }
+
+    def hybrid_query(self, request):
+        if request.k <= 0:
+            raise ValueError("k must be > 0")
+        index = sanitize_index_name(request.index_name)
+        if not request.rerank_model:
+            return self.search(request, index, request.k)
+
+        payload = self.search(request, index, max(request.k, request.rerank_candidates))
+        start = time.time()
+        payload["results"] = local_reranker(request.rerank_model).rerank(
+            request.query_text, payload["results"], request.k
+        )
+        payload["rerank_ms"] = (time.time() - start) * 1000
+        self.logger.debug(
+            "Reranked {} results in {:.0f} ms".format(
+                max(request.k, request.rerank_candidates), payload["rerank_ms"]
+            )
+        )
+        return payload
+
+    def search(self, request, index, k):
+        """
+        :return: payload with the k best results of a HybridQueryRequest, in its mode
+        """
+        mode = request.mode
+        if mode == "auto":
+            mode = "text" if looks_like_keywords(request.query_text) else "hybrid"
+        if mode == "vector":
+            total, results, cached = self.vector_search(request, index, k)
+            return {
+                "index": index,
+                "total": total,
+                "results": results,
+                "embedding_cached": cached,
+                "mode": mode,
+            }
+        if mode == "text":
+            total, results = text_search(
+                self.redis_binary,
+                index,
+                request.query_text,
+                k,
+                request.partition,
+            )
+            return {
+                "index": index,
+                "total": total,
+                "results": results,
+                "embedding_cached": False,
+                "mode": mode,
+            }
+
+        candidates = request.candidates or max(20, 2 * k)
+        text_future = self.search_pool.submit(
+            text_search,
+            self.redis_binary,
+            index,
+            request.query_text,
+            candidates,
+            request.partition,
+        )
+        vector_total, vector_results, cached = self.vector_search(
+            request, index, candidates
+        )
+        text_total, text_results = text_future.result()
+        results = reciprocal_rank_fusion(
+            {"vector": vector_results, "text": text_results},
+            k,
+            rrf_k=request.rrf_k,
+        )
+        return {
+            "index": index,
+            "total": len(
+                set(result["doc_id"] for result in vector_results + text_results)
+            ),
+            "vector_total": vector_total,
+            "text_total": text_total,
+            "results": results,
+            "embedding_cached": cached,
+            "mode": mode,
+        }
+
+    def lookup_answer(self, request):
+        index = sanitize_index_name(request.index_name)
+        scope = (index, request.partition, request.embedding_model)
+        # Cached for the vector search of a miss
+        blob, cached = self.embed_query(request)
+        entry = self.answer_cache.lookup(
+            scope, blob, threshold=request.similarity_threshold
+        )
+        if entry is not None:
+            self.logger.debug(
+                "Answer cache hit ({:.3f}): {}".format(
+                    entry["similarity"], entry["question"]
+                )
+            )
+            return {
+                "index": index,
+                "total": len(entry["results"]),
+                "results": entry["results"],
+                "embedding_cached": cached,
+                "mode": request.mode,
+                "answer": entry["answer"],
+                "answer_cached": True,
+                "similarity": entry["similarity"],
+                "cached_question": entry["question"],
+            }
+        payload = self.hybrid_query(request)
+        payload.update(answer=None, answer_cached=False)
+        return payload
+
+    def store_answer(self, request):
+        index = sanitize_index_name(request.index_name)
+        scope = (index, request.partition, request.embedding_model)
+        blob, _ = self.embed_query(request)
+        if not self.answer_cache.store(
+            scope, request.query_text, blob, request.results, request.answer
+        ):
+            self.logger.warning("Answer not cached, its chunks are no longer indexed")
+
+
+class RAGDatastore(SICConnector):
+    component_class = RAGDatastoreComponent
+    component_group = "RAGDatastore"
+
+
+def main():
+    SICComponentManager([RAGDatastoreComponent], component_group="RAGDatastore")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Benchmark cross-encoder reranking (see custom_components.reranker) on an existing index.
+
+For every number of candidates, the queries are searched with KNN, the candidates are
+reranked in one batch, and the top_n results are compared before and after reranking:
+
+- rerank p50/p95 ms: latency of the reranking forward pass
+- hit@n knn / reranked: fraction of queries with the relevant chunk in the top_n
+- hit@candidates: the same for all candidates, the best reranking can do
+- prompt tokens: tokens of the top_n chunks, what the LLM prompt grows by
+
+Without --queries, the queries are made from sampled chunks (a sentence from the
+middle of the chunk), and that chunk is the relevant one. With --queries, a file with
+one question per line, only the latency and prompt size are measured.
+
+The queries are embedded like the datastore does, OpenAI models need OPENAI_API_KEY in
+the environment. Run the benchmark with (from the repository root):
+    python -m custom_components.rerank_benchmark my_index --candidates 10,20,30,50
+"""
+
+import argparse
+import os
+import random
+import re
+import time
+
+import numpy as np
+import redis
+from sic_framework.core.utils import str_if_bytes
+from sic_framework.services.datastore.redis_datastore import sanitize_index_name
+
+from custom_components.conversation_memory import count_tokens
+from custom_components.embedding_backends import embed_batch_function
+from custom_components.rag_datastore import knn_search
+from custom_components.reranker import DEFAULT_RERANK_MODEL, CrossEncoderReranker
+from custom_components.vector_index_benchmark import ft_info
+from custom_components.vector_ingest import load_index_meta, vector_blob
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def sample_queries(redis_conn, index_name, count, seed=0):
+    """
+    :return: (query, key of the chunk it was taken from) tuples
+    """
+    definition = ft_info(redis_conn, index_name)["index_definition"]
+    definition = {
+        str_if_bytes(definition[i], errors="ignore"): definition[i + 1]
+        for i in range(0, len(definition), 2)
+    }
+    keys = []
+    for prefix in definition["prefixes"]:
+        keys.extend(
+            str_if_bytes(key, errors="ignore")
+            for key in redis_conn.scan_iter(
+                match="{}*".format(str_if_bytes(prefix, errors="ignore")), count=1000
+            )
+        )
+    rng = random.Random(seed)
+    rng.shuffle(keys)
+
+    queries = []
+    for key in keys:
+        content = str_if_bytes(redis_conn.hget(key, "content") or b"", errors="ignore")
+        sentences = [s for s in _SENTENCE_END.split(content) if len(s.split()) >= 6]
+        if sentences:
+            queries.append((sentences[len(sentences) // 2], key))
+        if len(queries) >= count:
+            break
+    return queries
+
+
+def benchmark(redis_conn, index, queries, reranker, embed, candidate_counts, top_n):
+    """
+    :param queries: (query, key of the relevant chunk or None) tuples
+    :param embed: function embedding a query, returns the query vector for the index
+    :return: list of (candidates, stats dict)
+    """
+    rows = []
+    blobs = [embed(query) for query, _ in queries]
+    for candidates in candidate_counts:
+        rerank_ms, tokens = [], []
+        hits = {"knn": 0, "reranked": 0, "candidates": 0}
+        for (query, relevant), blob in zip(queries, blobs):
+            _, results = knn_search(redis_conn, index, blob, candidates)
+            start = time.time()
+            reranked = reranker.rerank(query, results, top_n)
+            rerank_ms.append((time.time() - start) * 1000)
+            tokens.append(sum(count_tokens(result["content"]) for result in reranked))
+            if relevant is not None:
+                ids = [result["doc_id"] for result in results]
+                hits["knn"] += relevant in ids[:top_n]
+                hits["candidates"] += relevant in ids
+                hits["reranked"] += relevant in [r["doc_id"] for r in reranked]
+        labelled = sum(1 for _, relevant in queries if relevant is not None)
+        rows.append(
+            (
+                candidates,
+                {
+                    "p50_ms": float(np.percentile(rerank_ms, 50)),
+                    "p95_ms": float(np.percentile(rerank_ms, 95)),
+                    "hit_knn": hits["knn"] / float(labelled) if labelled else None,
+                    "hit_reranked": (
+                        hits["reranked"] / float(labelled) if labelled else None
+                    ),
+                    "hit_candidates": (
+                        hits["candidates"] / float(labelled) if labelled else None
+                    ),
+                    "prompt_tokens": float(np.mean(tokens)),
+                },
+            )
+        )
+    return rows
+
+
+def format_header(top_n):
+    return "{:>10} {:>8} {:>8} {:>10} {:>15} {:>15} {:>14}".format(
+        "candidates",
+        "p50 ms",
+        "p95 ms",
+        "hit@{} knn".format(top_n),
+        "hit@{} reranked".format(top_n),
+        "hit@candidates",
+        "prompt tokens",
+    )
+
+
+def format_row(candidates, stats):
+    def fraction(value):
+        return "-" if value is None else "{:.3f}".format(value)
+
+    return "{:>10} {:>8.1f} {:>8.1f} {:>10} {:>15} {:>15} {:>14.0f}".format(
+        candidates,
+        stats["p50_ms"],
+        stats["p95_ms"],
+        fraction(stats["hit_knn"]),
+        fraction(stats["hit_reranked"]),
+        fraction(stats["hit_candidates"]),
+        stats["prompt_tokens"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark cross-encoder reranking of retrieved chunks."
+    )
+    parser.add_argument("index", help="index to search")
+    parser.add_argument(
+        "--candidates",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[10, 20, 30, 50],
+        help="comma separated numbers of candidates (default 10,20,30,50)",
+    )
+    parser.add_argument("--top-n", type=int, default=3, help="results for the prompt")
+    parser.add_argument("--queries", help="file with one query per line")
+    parser.add_argument(
+        "--samples", type=int, default=100, help="queries sampled from the chunks"
+    )
+    parser.add_argument("--rerank-model", default=DEFAULT_RERANK_MODEL)
+    parser.add_argument("--embedding-model", default="text-embedding-3-large")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--password", default="changemeplease")
+    args = parser.parse_args()
+
+    redis_conn = redis.Redis(
+        host=args.host, port=args.port, password=args.password, decode_responses=False
+    )
+    index = sanitize_index_name(args.index)
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [(line.strip(), None) for line in f if line.strip()]
+    else:
+        queries = sample_queries(redis_conn, index, args.samples)
+    print("{} queries on '{}'".format(len(queries), index))
+
+    embed_batch = embed_batch_function(
+        args.embedding_model, os.environ.get("OPENAI_API_KEY"), max_retries=None
+    )
+    meta = load_index_meta(redis_conn, index)
+
+    def embed(query):
+        blob = np.asarray(embed_batch([query])[0], dtype=np.float32).tobytes()
+        if meta is None:
+            return blob
+        return vector_blob(blob, meta["dimensions"], meta["vector_type"])
+
+    reranker = CrossEncoderReranker(args.rerank_model)
+    # The first forward pass is slower, warm the model up
+    reranker.score("warm up", ["warm up"])
+
+    print(format_header(args.top_n))
+    for candidates, stats in benchmark(
+        redis_conn, index, queries, reranker, embed, args.candidates, args.top_n
+    ):
+        print(format_row(candidates, stats))
+
+
+if __name__ == "__main__":
+    main()
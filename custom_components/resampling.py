@@ -0,0 +1,63 @@
+"""
+Streaming sample-rate conversion for 16-bit mono PCM audio.
+
+Used by the resampling speakers and the Opus codec, which both get audio in chunks
+and need the output of consecutive chunks to line up without clicks.
+"""
+
+import numpy as np
+
+
+class StreamResampler(object):
+    """
+    Linear interpolation resampler for 16-bit mono PCM that can be fed in chunks.
+
+    The fractional read position and the last sample of the previous chunk are kept,
+    so consecutive chunks give the same output as one long waveform.
+
+    :param source_rate: sample rate of the input
+    :param target_rate: sample rate of the output
+    """
+
+    def __init__(self, source_rate, target_rate):
+        self.source_rate = source_rate
+        self.target_rate = target_rate
+        self._step = float(source_rate) / target_rate
+        self.reset()
+
+    def reset(self):
+        """Start a new waveform, forgetting the previous chunks."""
+        # Position of the next output sample, relative to the first sample of the next
+        # chunk. Between -1 and 0 it interpolates with the last sample of the previous chunk.
+        self._position = 0.0
+        self._last = None
+
+    def process(self, waveform):
+        """
+        :param waveform: the next chunk of 16-bit mono PCM audio
+        :type waveform: bytes
+        :return: the resampled chunk
+        :rtype: bytes
+        """
+        samples = np.frombuffer(waveform, dtype=np.int16).astype(np.float32)
+        if len(samples) == 0:
+            return b""
+
+        if self._last is None:
+            signal = samples
+            offset = 0
+        else:
+            signal = np.concatenate(([self._last], samples))
+            offset = 1
+
+        last_index = len(samples) - 1
+        if self._position > last_index:
+            count = 0
+        else:
+            count = int((last_index - self._position) // self._step) + 1
+        positions = self._position + self._step * np.arange(count)
+        resampled = np.interp(positions + offset, np.arange(len(signal)), signal)
+
+        self._position += self._step * count - len(samples)
+        self._last = samples[-1]
+        return np.round(resampled).astype(np.int16).tobytes()
@@ -0,0 +1,185 @@
+"""
+Speakers that stay open and play audio of any sample rate.
+
+The stock desktop speakers open their output stream at the sample rate of their
+SpeakersConf, so demos create the Desktop only after the first TTS reply has arrived
+(or hardcode the rate of their TTS service) and audio with another rate plays at the
+wrong speed. The resampling speakers open the output device once, at its native rate,
+and convert every AudioRequest or AudioMessage to that rate. Replies from Google,
+ElevenLabs or OpenAI TTS can be played one after the other without reopening the device.
+
+Resampling is linear interpolation. The state of each source rate is kept between
+chunks of a stream (AudioMessage or AudioRequest with is_stream=True), so streamed TTS
+plays without clicks at the chunk boundaries.
+
+    desktop = ResamplingDesktop()
+    desktop.speakers.request(AudioRequest(reply.waveform, reply.sample_rate))
+
+ResamplingDesktop serves the speakers inside the application, like Desktop. To run the
+component on its own instead (from the repository root):
+    python -m custom_components.resampling_speakers
+"""
+
+import threading
+
+import pyaudio
+from sic_framework import SICActuator, utils
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import SICMessage
+from sic_framework.devices.common_desktop.desktop_speakers import (
+    DesktopSpeakersActuator,
+    SpeakersConf,
+)
+from sic_framework.devices.desktop import Desktop
+
+from custom_components.resampling import StreamResampler
+
+resampling_speakers_active = False
+
+
+class ResamplingSpeakersConf(SpeakersConf):
+    """
+    :param sample_rate: output rate of the device, None for the default rate of the
+        output device. Audio of other rates is resampled to it.
+    :param device_index: pyaudio output device index, None for the default device
+    """
+
+    def __init__(self, sample_rate=None, device_index=None):
+        super(ResamplingSpeakersConf, self).__init__(
+            sample_rate=sample_rate, channels=1, device_index=device_index
+        )
+
+
+class ResamplingSpeakersActuator(DesktopSpeakersActuator):
+    """
+    Desktop speakers that resample incoming audio to the rate of the output device.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # The output stream is opened here, at the device rate instead of the rate of
+        # the audio, so the DesktopSpeakersActuator constructor is skipped
+        SICActuator.__init__(self, *args, **kwargs)
+
+        self.device = pyaudio.PyAudio()
+        self.sample_rate = self.params.sample_rate or self._default_sample_rate()
+        self.stream = self.device.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=self.sample_rate,
+            input=False,
+            output=True,
+            output_device_index=self.params.device_index,
+        )
+        self.logger.info("Opened speakers at {} Hz".format(self.sample_rate))
+
+        self._resamplers = {}
+        self._lock = threading.Lock()
+
+    def _default_sample_rate(self):
+        if self.params.device_index is None:
+            info = self.device.get_default_output_device_info()
+        else:
+            info = self.device.get_device_info_by_index(self.params.device_index)
+        return int(info["defaultSampleRate"])
+
+    @staticmethod
+    def get_conf():
+        return ResamplingSpeakersConf()
+
+    def on_request(self, request):
+        self._play(request)
+        return SICMessage()
+
+    def on_message(self, message):
+        if hasattr(message, "waveform"):
+            self._play(message)
+        else:
+            self.logger.warning(
+                "Expecting a message with a waveform attribute but received none"
+            )
+
+    def _play(self, audio):
+        # Requests and messages may arrive on different threads, keep chunks in order
+        with self._lock:
+            self.stream.write(self._resample(audio))
+
+    def _resample(self, audio):
+        source_rate = getattr(audio, "sample_rate", None) or self.sample_rate
+        if source_rate == self.sample_rate:
+            return audio.waveform
+
+        resampler = self._resamplers.get(source_rate)
+        if resampler is None:
+            resampler = StreamResampler(source_rate, self.sample_rate)
+            self._resamplers[source_rate] = resampler
+        if not getattr(audio, "is_stream", False):
+            resampler.reset()
+        return resampler.process(bytes(audio.waveform))
+
+
+class ResamplingSpeakers(SICConnector):
+    """
+    Connector for the resampling speakers.
+    """
+
+    component_class = ResamplingSpeakersActuator
+    component_group = "ResamplingSpeakers"
+
+
+class ResamplingDesktop(Desktop):
+    """
+    Desktop whose speakers property returns the resampling speakers.
+
+    :param speakers_conf: ResamplingSpeakersConf, None for the default output device
+        at its native rate
+    """
+
+    def __init__(
+        self, camera_conf=None, mic_conf=None, speakers_conf=None, tts_conf=None
+    ):
+        super(ResamplingDesktop, self).__init__(
+            camera_conf=camera_conf, mic_conf=mic_conf, tts_conf=tts_conf
+        )
+        self.configs[ResamplingSpeakers] = speakers_conf
+
+        global resampling_speakers_active
+
+        if not resampling_speakers_active:
+            # Served in this process like the other desktop components, see Desktop
+            self.speakers_manager = SICComponentManager(
+                [ResamplingSpeakersActuator],
+                client_id=utils.get_ip_adress(),
+                auto_serve=False,
+                component_group="ResamplingSpeakers",
+            )
+            self.speakers_manager.is_main_thread = False
+
+            def managed_serve():
+                try:
+                    self.speakers_manager.serve()
+                finally:
+                    self.speakers_manager.stop_component_manager()
+
+            self.speakers_thread = threading.Thread(
+                target=managed_serve,
+                name="ResamplingSpeakersComponentManager-singleton",
+                daemon=True,
+            )
+            self.speakers_thread.start()
+
+            resampling_speakers_active = True
+
+    @property
+    def speakers(self):
+        return self._get_connector(ResamplingSpeakers)
+
+
+def main():
+    SICComponentManager(
+        [ResamplingSpeakersActuator], component_group="ResamplingSpeakers"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Incremental sentence and clause segmentation for streamed LLM text.
+
+Feed the text chunks of an LLM stream into a SentenceSegmenter as they arrive and
+send every returned segment to TTS. Only characters that were not seen before are
+scanned, so the cost per chunk does not grow with the length of the sentence.
+
+Abbreviations ("e.g.", "Dr."), initials ("J. Smith") and decimals ("3.5") do not end
+a sentence. The first segment of a response may end at a clause boundary (",", ";",
+":") once it is first_clause_chars long, so the first audio can start early. Later
+sentences shorter than min_chars are merged with the next one, and text without a
+sentence boundary is cut at a clause boundary or space after max_chars.
+
+    segmenter = SentenceSegmenter()
+    for chunk in stream:
+        for segment in segmenter.feed(chunk):
+            speak(segment)
+    for segment in segmenter.flush():
+        speak(segment)
+"""
+
+DEFAULT_ABBREVIATIONS = frozenset(
+    [
+        "e.g",
+        "i.e",
+        "vs",
+        "cf",
+        "approx",
+        "mr",
+        "mrs",
+        "ms",
+        "dr",
+        "prof",
+        "sr",
+        "jr",
+        "st",
+        "fig",
+        "inc",
+        "ltd",
+    ]
+)
+
+_TERMINALS = ".!?"
+_CLAUSE_MARKS = ",;:"
+_CLOSERS = "\"')]}”’"
+_OPENERS = "\"'([{“‘"
+
+
+class SentenceSegmenter(object):
+    """
+    Splits streamed text into sentences, scanning each character only once.
+
+    :param min_chars: sentences shorter than this (except the first) are merged with the next
+    :type min_chars: int
+    :param max_chars: segments are cut at a clause boundary or space when they grow longer
+    :type max_chars: int
+    :param first_clause_chars: the first segment may end at a clause boundary after this
+        many characters, None to only split the first segment on sentence boundaries
+    :type first_clause_chars: int
+    :param abbreviations: lowercase words (without trailing dot) that do not end a sentence
+    :type abbreviations: set[str]
+    """
+
+    def __init__(
+        self,
+        min_chars=20,
+        max_chars=250,
+        first_clause_chars=30,
+        abbreviations=DEFAULT_ABBREVIATIONS,
+    ):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.first_clause_chars = first_clause_chars
+        self.abbreviations = abbreviations
+        self.reset()
+
+    def reset(self):
+        """Forget all buffered text, e.g. at the start of a new response."""
+        self._buffer = ""
+        # Index of the next character to scan
+        self._pos = 0
+        # End of the last clause boundary / position of the last space, 0 if none
+        self._last_clause = 0
+        self._last_space = 0
+        self._emitted = False
+
+    def feed(self, text):
+        """
+        Add a chunk of streamed text.
+
+        :param text: the new text
+        :type text: str
+        :return: the segments that were completed by this chunk
+        :rtype: list[str]
+        """
+        self._buffer += text
+        segments = []
+        i = self._pos
+        buf = self._buffer
+
+        while i < len(buf):
+            ch = buf[i]
+            cut = None
+
+            if ch in _TERMINALS:
+                end = i + 1
+                while end < len(buf) and buf[end] in _TERMINALS + _CLOSERS:
+                    end += 1
+                if end == len(buf):
+                    # Cannot tell yet whether whitespace follows; wait for more text
+                    break
+                if buf[end].isspace() and not self._is_abbreviation(i):
+                    if not self._emitted or end >= self.min_chars:
+                        cut = end
+                    else:
+                        self._last_clause = end
+                if cut is None:
+                    i = end
+                    continue
+            elif ch in _CLAUSE_MARKS:
+                if i + 1 == len(buf):
+                    break
+                if buf[i + 1].isspace():
+                    self._last_clause = i + 1
+                    if (
+                        not self._emitted
+                        and self.first_clause_chars is not None
+                        and i + 1 >= self.first_clause_chars
+                    ):
+                        cut = i + 1
+            elif ch.isspace():
+                self._last_space = i
+
+            if cut is None and i + 1 > self.max_chars:
+                cut = self._last_clause or self._last_space or i + 1
+
+            if cut is None:
+                i += 1
+                continue
+
+            segment = buf[:cut].strip()
+            if segment:
+                segments.append(segment)
+                self._emitted = True
+            buf = buf[cut:].lstrip()
+            self._buffer = buf
+            self._last_clause = 0
+            self._last_space = 0
+            i = 0
+
+        self._pos = i
+        return segments
+
+    def flush(self):
+        """
+        End the stream and return the remaining text as a final segment.
+
+        :return: the last segment, if there is any text left
+        :rtype: list[str]
+        """
+        remainder = self._buffer.strip()
+        self.reset()
+        return [remainder] if remainder else []
+
+    def _is_abbreviation(self, i):
+        """Whether the dot at index i belongs to an abbreviation or initial."""
+        if self._buffer[i] != ".":
+            return False
+        start = i
+        while start > 0 and not self._buffer[start - 1].isspace():
+            start -= 1
+        word = self._buffer[start:i].lstrip(_OPENERS)
+        if len(word) == 1 and word.isalpha() and word.isupper():
+            return True
+        return word.lower() in self.abbreviations
+
+
+def split_sentences(text, **kwargs):
+    """
+    Segment a complete text with the same rules as SentenceSegmenter.
+
+    :param text: the text to split
+    :type text: str
+    :param kwargs: passed on to SentenceSegmenter
+    :return: the segments
+    :rtype: list[str]
+    """
+    segmenter = SentenceSegmenter(**kwargs)
+    return segmenter.feed(text) + segmenter.flush()
@@ -0,0 +1,380 @@
+"""
+Asyncio session engine that serves the conversational turns of many users with a
+small pool of Dialogflow CX agents.
+
+A Dialogflow CX component streams the audio of one request at a time, but the
+conversation state lives in the Dialogflow session, so any agent can serve the next
+turn of any user. The engine keeps one session per user and multiplexes their turns
+over at most max_concurrent_turns agents:
+
+- a turn that starts while all agents are busy waits in a queue of at most
+  max_queued_turns, and its audio is buffered (up to max_buffered_seconds)
+- when an agent becomes free, the buffered audio is replayed to it faster than real
+  time, after which the live audio goes straight to the agent. The agent keeps only the
+  latest audio message until it streams it, so the replay merges the buffered chunks
+  into messages of replay_chunk_seconds and sends them no faster than live audio
+- a turn that arrives while the queue is full is refused right away (on_busy), so
+  the load on the host and on Dialogflow stays bounded
+- after a failed turn (an error or turn_timeout) the agent is stopped and replaced,
+  so the next user does not share a stream the agent may still have open
+
+All methods can be called from any thread, e.g. from SIC callbacks:
+
+    engine = AsyncSessionEngine(create_agent, on_reply=publish_reply, on_busy=publish_busy)
+    engine.start()
+    engine.add_user(socket_id, session_id)
+    engine.start_turn(socket_id)
+    engine.audio(socket_id, waveform, sample_rate)
+    engine.stop_turn(socket_id)
+"""
+
+import asyncio
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sic_framework.core.message_python2 import AudioMessage
+from sic_framework.services.dialogflow_cx.dialogflow_cx import (
+    DetectIntentRequest,
+    StopListeningMessage,
+)
+
+IDLE = "idle"
+QUEUED = "queued"
+ACTIVE = "active"
+
+
+class _UserSession(object):
+    def __init__(self, socket_id, session_id):
+        self.socket_id = socket_id
+        self.session_id = session_id
+        self.state = IDLE
+        self.agent = None
+        # Audio that arrived before the agent could take it, replayed when the turn starts
+        self.pending = collections.deque()
+        self.pending_seconds = 0.0
+        self.replaying = False
+        self.stop_requested = False
+        self.removed = False
+
+
+class AsyncSessionEngine(object):
+    """
+    Schedules the turns of many user sessions over a bounded pool of agents.
+
+    :param agent_factory: creates an agent connector, e.g. a DialogflowCX, called once
+        per worker and again after a turn of its agent failed
+    :param on_reply: called with (socket_id, reply) when a turn is done
+    :param on_busy: called with (socket_id) when a turn is refused
+    :param on_error: called with (socket_id, exception) when a turn failed
+    :param max_concurrent_turns: number of agents, i.e. turns served at the same time
+    :param max_queued_turns: turns that may wait for an agent, more are refused
+    :param max_buffered_seconds: audio kept per waiting turn, later audio is dropped
+    :param catch_up_speed: how much faster than real time buffered audio is replayed
+    :param replay_chunk_seconds: audio per replayed message, one message is sent every
+        replay_chunk_seconds / catch_up_speed, which must not be shorter than the
+        interval of the live audio chunks
+    :param agent_ready_delay: seconds between sending the request and the first audio,
+        the agent only takes audio once it handles the request
+    :param turn_timeout: seconds after which a turn is abandoned
+    :param logger: logger for errors of turns and callbacks
+    """
+
+    def __init__(
+        self,
+        agent_factory,
+        on_reply,
+        on_busy=None,
+        on_error=None,
+        max_concurrent_turns=8,
+        max_queued_turns=32,
+        max_buffered_seconds=10.0,
+        catch_up_speed=2.0,
+        replay_chunk_seconds=0.5,
+        agent_ready_delay=0.3,
+        turn_timeout=60.0,
+        logger=None,
+    ):
+        self.agent_factory = agent_factory
+        self.on_reply = on_reply
+        self.on_busy = on_busy
+        self.on_error = on_error
+        self.max_concurrent_turns = max_concurrent_turns
+        self.max_queued_turns = max_queued_turns
+        self.max_buffered_seconds = max_buffered_seconds
+        self.catch_up_speed = catch_up_speed
+        self.replay_chunk_seconds = replay_chunk_seconds
+        self.agent_ready_delay = agent_ready_delay
+        self.turn_timeout = turn_timeout
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._users = {}
+        self._lock = threading.Lock()
+        self._agents = []
+        # Blocking agent requests, one thread per agent
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_turns)
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def start(self):
+        """Start the event loop and the workers in a background thread."""
+        self._thread = threading.Thread(
+            target=self._run, name="AsyncSessionEngine", daemon=True
+        )
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        """Stop the workers and the agents."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        with self._lock:
+            for user in self._users.values():
+                user.removed = True
+            self._users.clear()
+        for agent in self._agents:
+            try:
+                agent.stop_component()
+            except Exception:
+                pass
+        self._executor.shutdown(wait=False)
+
+    def status(self):
+        """:return: number of users, active turns and queued turns"""
+        with self._lock:
+            states = [user.state for user in self._users.values()]
+        return {
+            "users": len(states),
+            "active": states.count(ACTIVE),
+            "queued": states.count(QUEUED),
+        }
+
+    def add_user(self, socket_id, session_id):
+        with self._lock:
+            if socket_id not in self._users:
+                self._users[socket_id] = _UserSession(socket_id, session_id)
+
+    def remove_user(self, socket_id):
+        """Forget the user, ending a turn that is still listening."""
+        with self._lock:
+            user = self._users.pop(socket_id, None)
+            if user is None:
+                return
+            user.removed = True
+            agent = user.agent if user.state == ACTIVE else None
+        if agent is not None:
+            agent.send_message(StopListeningMessage(session_id=user.session_id))
+
+    def start_turn(self, socket_id):
+        """
+        :return: False if the turn was refused because the queue is full
+        """
+        with self._lock:
+            user = self._users.get(socket_id)
+            if user is None or user.state != IDLE:
+                return True
+            user.state = QUEUED
+            user.stop_requested = False
+            user.pending.clear()
+            user.pending_seconds = 0.0
+
+        accepted = asyncio.run_coroutine_threadsafe(
+            self._enqueue(socket_id), self._loop
+        ).result()
+        if accepted:
+            return True
+        with self._lock:
+            user.state = IDLE
+        if self.on_busy is not None:
+            self.on_busy(socket_id)
+        return False
+
+    def audio(self, socket_id, waveform, sample_rate):
+        """Route a chunk of the user's audio to its agent, or buffer it."""
+        with self._lock:
+            user = self._users.get(socket_id)
+            if user is None or user.state == IDLE:
+                return
+            if user.state == QUEUED or user.replaying:
+                seconds = len(waveform) / 2.0 / sample_rate
+                if user.pending_seconds + seconds <= self.max_buffered_seconds:
+                    user.pending.append((waveform, sample_rate))
+                    user.pending_seconds += seconds
+                return
+            agent = user.agent
+        agent.send_message(AudioMessage(waveform, sample_rate=sample_rate))
+
+    def stop_turn(self, socket_id):
+        """The user stopped talking: let the agent finalize the turn."""
+        with self._lock:
+            user = self._users.get(socket_id)
+            if user is None or user.state == IDLE:
+                return
+            if user.state == QUEUED or user.replaying:
+                user.stop_requested = True
+                return
+            agent = user.agent
+        agent.send_message(StopListeningMessage(session_id=user.session_id))
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue(maxsize=self.max_queued_turns)
+        for _ in range(self.max_concurrent_turns):
+            self._loop.create_task(self._worker())
+        self._loop.call_soon(self._started.set)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    async def _enqueue(self, socket_id):
+        try:
+            self._queue.put_nowait(socket_id)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _worker(self):
+        agent = None
+        while True:
+            socket_id = await self._queue.get()
+            with self._lock:
+                user = self._users.get(socket_id)
+            if user is None or user.removed:
+                continue
+
+            if agent is None:
+                try:
+                    agent = await self._loop.run_in_executor(
+                        self._executor, self.agent_factory
+                    )
+                except Exception as e:
+                    await self._fail(user, e)
+                    continue
+                self._agents.append(agent)
+
+            try:
+                reusable = await self._serve_turn(agent, user)
+            except Exception:
+                # A worker must survive any turn, or its agent is lost for good
+                self.logger.exception("Turn of {} failed".format(user.socket_id))
+                with self._lock:
+                    user.state = IDLE
+                    user.agent = None
+                    user.replaying = False
+                reusable = False
+            if not reusable:
+                await self._retire(agent)
+                agent = None
+
+    async def _serve_turn(self, agent, user):
+        """
+        :return: whether the agent can serve the next turn, False after a failed turn
+        """
+        with self._lock:
+            user.agent = agent
+            user.state = ACTIVE
+            user.replaying = True
+
+        reply_future = self._loop.run_in_executor(
+            self._executor,
+            lambda: agent.request(
+                DetectIntentRequest(user.session_id), timeout=self.turn_timeout
+            ),
+        )
+        try:
+            await asyncio.sleep(self.agent_ready_delay)
+            await self._replay(agent, user)
+            reply = await reply_future
+        except Exception as e:
+            # The agent may still be streaming this turn; end it, so the next user's
+            # request and audio do not end up in it
+            try:
+                agent.send_message(StopListeningMessage(session_id=user.session_id))
+            except Exception:
+                pass
+            try:
+                await reply_future
+            except Exception:
+                pass
+            await self._fail(user, e)
+            return False
+        finally:
+            with self._lock:
+                user.state = IDLE
+                user.agent = None
+                user.replaying = False
+
+        if not user.removed:
+            await self._callback("on_reply", self.on_reply, user.socket_id, reply)
+        return True
+
+    async def _retire(self, agent):
+        """
+        Stop an agent after a failed turn, the worker creates a new one for the next.
+
+        After a timeout the agent can still be handling the old request, which would
+        delay the next one.
+        """
+        if agent in self._agents:
+            self._agents.remove(agent)
+        try:
+            await self._loop.run_in_executor(self._executor, agent.stop_component)
+        except Exception:
+            self.logger.exception("Stopping a failed agent failed")
+
+    async def _replay(self, agent, user):
+        """Send the buffered audio at catch_up_speed, then switch to live audio."""
+        while True:
+            with self._lock:
+                if not user.pending:
+                    # From here on audio() sends straight to the agent
+                    user.replaying = False
+                    stop = user.stop_requested or user.removed
+                    break
+                waveform, sample_rate = self._pop_pending(user)
+            agent.send_message(AudioMessage(waveform, sample_rate=sample_rate))
+            # The agent replaces audio it did not stream yet, so wait until it has
+            await asyncio.sleep(len(waveform) / 2.0 / sample_rate / self.catch_up_speed)
+
+        if stop:
+            agent.send_message(StopListeningMessage(session_id=user.session_id))
+
+    def _pop_pending(self, user):
+        """
+        :return: (waveform, sample_rate) of up to replay_chunk_seconds of buffered audio
+        """
+        waveform, sample_rate = user.pending.popleft()
+        chunks = [waveform]
+        seconds = len(waveform) / 2.0 / sample_rate
+        while user.pending:
+            next_waveform, next_sample_rate = user.pending[0]
+            next_seconds = len(next_waveform) / 2.0 / next_sample_rate
+            if (
+                next_sample_rate != sample_rate
+                or seconds + next_seconds > self.replay_chunk_seconds
+            ):
+                break
+            user.pending.popleft()
+            chunks.append(next_waveform)
+            seconds += next_seconds
+        user.pending_seconds = max(0.0, user.pending_seconds - seconds)
+        return b"".join(bytes(chunk) for chunk in chunks), sample_rate
+
+    async def _fail(self, user, exception):
+        with self._lock:
+            user.state = IDLE
+            user.agent = None
+        self.logger.warning("Turn of {} failed: {}".format(user.socket_id, exception))
+        if self.on_error is not None and not user.removed:
+            await self._callback("on_error", self.on_error, user.socket_id, exception)
+
+    async def _callback(self, name, callback, *args):
+        try:
+            await self._loop.run_in_executor(None, callback, *args)
+        except Exception:
+            self.logger.exception("{} callback failed".format(name))
@@ -0,0 +1,189 @@
+"""
+Speculative retrieval on interim speech transcripts.
+
+In a voice RAG turn the retrieval (query embedding and KNN search) normally starts when
+the final transcript arrives, and the LLM waits for it. SpeculativeRetriever starts it
+as soon as the recognizer has a stable hypothesis of the utterance, while the user is
+still speaking, and runs it again when the stable text grows. When the final transcript
+arrives, the retrieval of the same text is usually done already; if the final text
+diverges from the last speculation, that one is discarded and the retrieval is run on
+the final text:
+
+    speculative = SpeculativeRetriever(lambda text: search_documents(text))
+    stt.register_callback(speculative.on_message)
+
+    speculative.reset()
+    transcript = stt.request(GetTranscript(timeout=10, phrase_time_limit=30))
+    results = speculative.result(transcript.transcript)
+
+Texts are compared after lowercasing and removing punctuation, and retrieved as
+recognized. A hypothesis is stable when the recognizer says so: the committed text of a
+StreamingWhisper PartialTranscript, or a Google Speech-to-Text / Dialogflow interim
+result with a stability of at least stability_threshold. An interim result that
+repeats the previous one is stable too. Only one retrieval runs at a time and a newer
+stable text replaces a queued one, so fast-changing hypotheses do not pile up requests.
+
+The speculation pays off when the recognizer settles on the whole utterance before it
+finalizes, e.g. a StreamingWhisper with a partial_interval below its pause_threshold.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from custom_components.hybrid_search import query_terms
+
+DEFAULT_STABILITY_THRESHOLD = 0.8
+
+
+def normalize_transcript(text):
+    return " ".join(query_terms(text or ""))
+
+
+def hypothesis_from_message(message, stability_threshold=DEFAULT_STABILITY_THRESHOLD):
+    """
+    Read a recognition message of StreamingWhisper, Whisper, Google Speech-to-Text or
+    Dialogflow (ES or CX).
+
+    :return: (transcript, stable part of it or None, is_final), None for messages
+        without a transcript
+    """
+    if hasattr(message, "committed"):
+        # StreamingWhisper PartialTranscript
+        return message.transcript, message.committed, False
+    response = getattr(message, "response", None)
+    result = getattr(response, "recognition_result", None)
+    if result is None:
+        transcript = getattr(message, "transcript", None)
+        if transcript is None:
+            return None
+        # Whisper Transcript
+        return transcript, transcript, getattr(message, "is_final", True)
+    transcript = getattr(result, "transcript", "")
+    if not transcript:
+        return None
+    is_final = bool(getattr(result, "is_final", False))
+    stability = getattr(result, "stability", 0.0) or 0.0
+    stable = transcript if is_final or stability >= stability_threshold else None
+    return transcript, stable, is_final
+
+
+class SpeculativeRetriever(object):
+    """
+    Runs a retrieval function on stable interim transcripts of the current utterance.
+
+    :param retrieve: function of the query text, returns the retrieval results
+    :param min_words: words a stable hypothesis needs before it is retrieved
+    :type min_words: int
+    :param stability_threshold: minimum stability of Google / Dialogflow interim results
+    :param logger: logger for the hit or miss of every turn
+    """
+
+    def __init__(
+        self,
+        retrieve,
+        min_words=3,
+        stability_threshold=DEFAULT_STABILITY_THRESHOLD,
+        logger=None,
+    ):
+        self.retrieve = retrieve
+        self.min_words = min_words
+        self.stability_threshold = stability_threshold
+        self.logger = logger
+
+        self.speculations = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        # One retrieval at a time, a newer speculation replaces a queued one
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._previous = None
+        self._text = None
+        self._future = None
+
+    def reset(self):
+        """Forget the speculation of the previous utterance, call before every turn."""
+        with self._lock:
+            if self._future is not None:
+                self._future.cancel()
+            self._previous = None
+            self._text = None
+            self._future = None
+
+    def on_message(self, message):
+        """Callback for the recognition messages of the speech-to-text component."""
+        hypothesis = hypothesis_from_message(message, self.stability_threshold)
+        if hypothesis is not None:
+            transcript, stable, _ = hypothesis
+            self.on_hypothesis(transcript, stable)
+
+    def on_hypothesis(self, transcript, stable=None):
+        """
+        :param transcript: the current hypothesis of the utterance
+        :param stable: the part of it that will not change anymore, None if unknown
+        """
+        normalized = normalize_transcript(transcript)
+        with self._lock:
+            if stable is None and normalized == self._previous:
+                stable = transcript
+            self._previous = normalized
+            if not stable:
+                return
+            # Retrieved as recognized, compared normalized
+            query, stable = stable, normalize_transcript(stable)
+
+            words = len(stable.split())
+            if words < self.min_words or stable == self._text:
+                return
+
+            if self._future is not None:
+                self._future.cancel()
+            self._text = stable
+            self._future = self._executor.submit(self.retrieve, query)
+            self.speculations += 1
+
+    def result(self, final_text):
+        """
+        :return: the retrieval results for the final transcript, from the speculation
+            if it retrieved the same text
+        """
+        final = normalize_transcript(final_text)
+        with self._lock:
+            text, future = self._text, self._future
+            self._previous = None
+            self._text = None
+            self._future = None
+
+        start = time.time()
+        if future is not None and text == final:
+            try:
+                results = future.result()
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.warning("Speculative retrieval failed: {}".format(e))
+            else:
+                self.hits += 1
+                if self.logger is not None:
+                    self.logger.debug(
+                        "Speculative retrieval hit, waited {:.0f} ms".format(
+                            (time.time() - start) * 1000
+                        )
+                    )
+                return results
+
+        if future is not None:
+            future.cancel()
+        self.misses += 1
+        if self.logger is not None:
+            self.logger.debug(
+                "Speculative retrieval miss: '{}' != '{}'".format(text, final)
+            )
+        return self.retrieve(final_text)
+
+    def stats(self):
+        return {
+            "speculations": self.speculations,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
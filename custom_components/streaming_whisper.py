@@ -0,0 +1,289 @@
+"""
+Streaming local Whisper speech-to-text on CPU (faster-whisper / CTranslate2 int8).
+
+Answers the same GetTranscript request with the same Transcript reply as the Whisper
+service, so it can replace SICWhisper in existing demos. While the user is speaking,
+PartialTranscript messages are output every partial_interval seconds. Register a
+callback on the connector to show them.
+
+Partial hypotheses use local agreement: words on which two consecutive decodes agree
+are committed. Once a committed segment has ended, its audio is dropped from the
+buffer and its text becomes the prompt for the next decode, so every decode only
+covers the uncommitted tail of the utterance instead of everything said so far.
+
+Install the backend before running:
+    pip install faster-whisper
+
+Run the component with (from the repository root):
+    python -m custom_components.streaming_whisper
+"""
+
+import queue
+import threading
+import time
+
+import numpy as np
+from faster_whisper import WhisperModel
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import AudioMessage, SICConfMessage
+from sic_framework.core.service_python2 import SICService
+from sic_framework.services.openai_whisper_stt.whisper_stt import (
+    GetTranscript,
+    Transcript,
+)
+
+WHISPER_SAMPLE_RATE = 16000
+
+
+class StreamingWhisperConf(SICConfMessage):
+    """
+    Configuration for the streaming Whisper service.
+
+    :param model_size: faster-whisper model, e.g. "tiny.en", "base.en", "small.en"
+    :param compute_type: CTranslate2 compute type, "int8" for quantised CPU inference
+    :param beam_size: beam width, 1 for greedy decoding (fastest)
+    :param language: language code or None for auto-detect
+    :param cpu_threads: CTranslate2 threads, 0 for the library default
+    :param partial_interval: seconds of new audio between partial hypotheses
+    :param energy_threshold: RMS level (16-bit PCM) above which audio counts as speech
+    :param pause_threshold: seconds of silence that end the utterance
+    """
+
+    def __init__(
+        self,
+        model_size="base.en",
+        compute_type="int8",
+        beam_size=1,
+        language="en",
+        cpu_threads=0,
+        partial_interval=1.0,
+        energy_threshold=300,
+        pause_threshold=0.8,
+    ):
+        super(StreamingWhisperConf, self).__init__()
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.beam_size = beam_size
+        self.language = language
+        self.cpu_threads = cpu_threads
+        self.partial_interval = partial_interval
+        self.energy_threshold = energy_threshold
+        self.pause_threshold = pause_threshold
+
+
+class PartialTranscript(Transcript):
+    """
+    Intermediate hypothesis of the utterance that is being transcribed.
+
+    :param transcript: committed text followed by the current hypothesis
+    :param committed: the part of the transcript that will not change anymore
+    """
+
+    def __init__(self, transcript, committed):
+        super(PartialTranscript, self).__init__(transcript)
+        self.committed = committed
+        self.is_final = False
+
+
+class StreamingWhisperComponent(SICService):
+    """
+    SICService that transcribes speech locally and streams partial hypotheses.
+    """
+
+    COMPONENT_STARTUP_TIMEOUT = 120
+
+    def __init__(self, *args, **kwargs):
+        super(StreamingWhisperComponent, self).__init__(*args, **kwargs)
+
+        self.model = WhisperModel(
+            self.params.model_size,
+            device="cpu",
+            compute_type=self.params.compute_type,
+            cpu_threads=self.params.cpu_threads,
+        )
+        self.audio_queue = queue.Queue()
+        self._stream_stop_event = threading.Event()
+        self.logger.info(
+            "Loaded faster-whisper model {} ({})".format(
+                self.params.model_size, self.params.compute_type
+            )
+        )
+
+    @staticmethod
+    def get_inputs():
+        return [AudioMessage, GetTranscript]
+
+    @staticmethod
+    def get_output():
+        return Transcript
+
+    @staticmethod
+    def get_conf():
+        return StreamingWhisperConf()
+
+    def on_message(self, message):
+        if not isinstance(message, AudioMessage):
+            return
+        self.audio_queue.put((message.waveform, message.sample_rate))
+
+    def on_request(self, request):
+        if request.__class__.__name__ != "GetTranscript":
+            self.logger.error("Invalid request type: {}".format(type(request)))
+            return
+        return self.execute(request)
+
+    def execute(self, request):
+        """
+        Capture one utterance, outputting partial hypotheses while it is spoken.
+
+        :param request: timeout is the wall-clock time to wait for speech to start,
+            phrase_time_limit the maximum length of the utterance in seconds
+        :type request: GetTranscript
+        :return: the final transcript, empty if nothing was said before the timeout
+        :rtype: Transcript
+        """
+        with self.audio_queue.mutex:
+            self.audio_queue.queue.clear()
+        self.logger.info("Listening...")
+
+        # Uncommitted audio of the utterance, 16 kHz float32
+        buffer = np.zeros(0, dtype=np.float32)
+        committed = []
+        previous_hypothesis = []
+        speech_started = False
+        silence = 0.0
+        utterance_seconds = 0.0
+        since_partial = 0.0
+        start_time = time.time()
+
+        while not self._stream_stop_event.is_set():
+            try:
+                waveform, sample_rate = self.audio_queue.get(timeout=0.1)
+            except queue.Empty:
+                waveform = None
+
+            if not speech_started:
+                if waveform is None or not self._is_speech(waveform):
+                    if (
+                        request.timeout is not None
+                        and time.time() - start_time > request.timeout
+                    ):
+                        return Transcript("")
+                    continue
+                speech_started = True
+
+            if waveform is None:
+                continue
+
+            chunk = self._to_float32(waveform, sample_rate)
+            chunk_seconds = len(chunk) / float(WHISPER_SAMPLE_RATE)
+            buffer = np.concatenate([buffer, chunk])
+            utterance_seconds += chunk_seconds
+            since_partial += chunk_seconds
+            silence = 0.0 if self._is_speech(waveform) else silence + chunk_seconds
+
+            if silence >= self.params.pause_threshold:
+                break
+            if (
+                request.phrase_time_limit is not None
+                and utterance_seconds >= request.phrase_time_limit
+            ):
+                break
+
+            if since_partial >= self.params.partial_interval:
+                since_partial = 0.0
+                segments = self._transcribe(buffer, committed)
+                words = [w for s in segments for w in s.text.split()]
+                agreed = self._common_prefix(previous_hypothesis, words)
+                previous_hypothesis = words
+
+                # Drop the audio of finished segments that are fully agreed upon
+                done_words = 0
+                cut_time = 0.0
+                for segment in segments:
+                    segment_words = len(segment.text.split())
+                    if done_words + segment_words > agreed:
+                        break
+                    done_words += segment_words
+                    cut_time = segment.end
+                if done_words:
+                    committed.extend(words[:done_words])
+                    previous_hypothesis = words[done_words:]
+                    agreed -= done_words
+                    cut = int(cut_time * WHISPER_SAMPLE_RATE)
+                    buffer = buffer[cut:]
+
+                self.output_message(
+                    PartialTranscript(
+                        " ".join(committed + previous_hypothesis),
+                        " ".join(committed + previous_hypothesis[:agreed]),
+                    )
+                )
+
+        segments = self._transcribe(buffer, committed)
+        if segments and np.mean([s.no_speech_prob for s in segments]) > 0.5:
+            segments = []
+        transcript = " ".join(committed + [s.text.strip() for s in segments]).strip()
+        self.logger.info(
+            "Transcript ({:.1f}s of speech): {}".format(utterance_seconds, transcript)
+        )
+        return Transcript(transcript)
+
+    def _transcribe(self, audio, committed):
+        if len(audio) == 0:
+            return []
+        segments, _ = self.model.transcribe(
+            audio,
+            beam_size=self.params.beam_size,
+            language=self.params.language,
+            initial_prompt=" ".join(committed[-50:]) or None,
+            condition_on_previous_text=False,
+            vad_filter=False,
+        )
+        return list(segments)
+
+    def _is_speech(self, waveform):
+        samples = np.frombuffer(waveform, dtype=np.int16).astype(np.float32)
+        if len(samples) == 0:
+            return False
+        return np.sqrt(np.mean(samples**2)) > self.params.energy_threshold
+
+    @staticmethod
+    def _to_float32(waveform, sample_rate):
+        samples = np.frombuffer(waveform, dtype=np.int16).astype(np.float32) / 32768.0
+        if sample_rate == WHISPER_SAMPLE_RATE or len(samples) == 0:
+            return samples
+        n_out = int(round(len(samples) * WHISPER_SAMPLE_RATE / float(sample_rate)))
+        positions = np.linspace(0, len(samples) - 1, n_out)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+    @staticmethod
+    def _common_prefix(a, b):
+        n = 0
+        for x, y in zip(a, b):
+            if x.lower().strip(".,!?") != y.lower().strip(".,!?"):
+                break
+            n += 1
+        return n
+
+    def stop(self, *args):
+        self._stream_stop_event.set()
+        super(StreamingWhisperComponent, self).stop(*args)
+
+
+class StreamingWhisper(SICConnector):
+    """
+    Connector for the streaming local Whisper component.
+    """
+
+    component_class = StreamingWhisperComponent
+    component_group = "StreamingWhisper"
+
+
+def main():
+    SICComponentManager([StreamingWhisperComponent], component_group="StreamingWhisper")
+
+
+if __name__ == "__main__":
+    main()
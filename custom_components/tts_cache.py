@@ -0,0 +1,316 @@
+"""
+Content-addressed, size-bounded cache for synthesized speech.
+
+Waveforms are stored on disk as raw PCM files named after the SHA-256 digest of
+(provider, text, voice, rate, sample_rate) and the other settings that change the
+speech, such as the language or model. A small JSON index keeps track of the
+sample rate and size of every entry and the order in which they were last used, so
+the least recently used entries can be evicted once the cache exceeds its size limit.
+
+The cache is independent of any particular TTS service. Wrap a TTS connector with
+CachedTTS to use it as a drop-in replacement inside a SICApplication:
+
+    tts = CachedTTS(Text2Speech(conf=tts_conf), provider="google")
+    reply = tts.request(GetSpeechRequest(text="Hello", voice_name="en-US-Standard-C"))
+    desktop.speakers.request(AudioRequest(reply.waveform, reply.sample_rate))
+
+Custom components are importable after installing this repository: pip install -e .
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from sic_framework.core.message_python2 import AudioMessage
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sic_tts")
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+_INDEX_FILE = "index.json"
+
+
+# Settings of TTS requests and confs that change the speech, besides voice and rate
+SYNTHESIS_SETTINGS = ("language_code", "ssml_gender", "model_id", "stability")
+
+
+def make_cache_key(
+    text, voice=None, rate=None, sample_rate=None, provider=None, settings=None
+):
+    """
+    Compute the content address of an utterance.
+
+    :param text: the text that is synthesized
+    :type text: str
+    :param voice: voice name or id, None for the provider default
+    :type voice: str
+    :param rate: speaking rate, None for the provider default
+    :type rate: float
+    :param sample_rate: requested output sample rate, None if the provider decides
+    :type sample_rate: int
+    :param provider: name of the TTS provider, e.g. "google" or "elevenlabs"
+    :type provider: str
+    :param settings: other settings that change the speech, e.g. the language
+    :type settings: dict
+    :return: hex digest identifying the waveform
+    :rtype: str
+    """
+    key = [provider, text, voice, rate, sample_rate]
+    if settings:
+        key.append(sorted(settings.items()))
+    key = json.dumps(key, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(key).hexdigest()
+
+
+class TTSCache(object):
+    """
+    Disk-backed LRU cache mapping utterances to PCM waveforms.
+
+    Safe to share between threads of one application. Entries written by another
+    process are not picked up until the cache is reopened.
+
+    :param cache_dir: directory that holds the waveforms and the index
+    :type cache_dir: str
+    :param max_bytes: total size of stored waveforms before entries are evicted
+    :type max_bytes: int
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        # digest -> {"sample_rate": int, "size": int}, least recently used first
+        self._index = OrderedDict()
+        self._total_bytes = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def get(
+        self,
+        text,
+        voice=None,
+        rate=None,
+        sample_rate=None,
+        provider=None,
+        settings=None,
+    ):
+        """
+        Look up a cached waveform.
+
+        :return: (waveform, sample_rate) or None if the utterance is not cached
+        :rtype: tuple[bytes, int] | None
+        """
+        digest = make_cache_key(text, voice, rate, sample_rate, provider, settings)
+        with self._lock:
+            entry = self._index.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(digest), "rb") as f:
+                    waveform = f.read()
+            except OSError:
+                # The file was removed behind our back, forget about it.
+                self._drop(digest)
+                self._save_index()
+                self.misses += 1
+                return None
+            self._index.move_to_end(digest)
+            self.hits += 1
+            return waveform, entry["sample_rate"]
+
+    def put(
+        self,
+        text,
+        waveform,
+        sample_rate,
+        voice=None,
+        rate=None,
+        requested_sample_rate=None,
+        provider=None,
+        settings=None,
+    ):
+        """
+        Store a waveform and evict least recently used entries if needed.
+
+        :param waveform: 16-bit PCM audio as returned by the TTS service
+        :type waveform: bytes
+        :param sample_rate: actual sample rate of the waveform
+        :type sample_rate: int
+        :param requested_sample_rate: sample rate that is part of the key, see make_cache_key
+        :type requested_sample_rate: int
+        """
+        size = len(waveform)
+        if size == 0 or size > self.max_bytes:
+            return
+        digest = make_cache_key(
+            text, voice, rate, requested_sample_rate, provider, settings
+        )
+        with self._lock:
+            tmp_path = self._path(digest) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(waveform)
+            os.replace(tmp_path, self._path(digest))
+
+            self._drop(digest, remove_file=False)
+            self._index[digest] = {"sample_rate": int(sample_rate), "size": size}
+            self._total_bytes += size
+            self._evict()
+            self._save_index()
+
+    def clear(self):
+        """Remove all cached waveforms."""
+        with self._lock:
+            for digest in list(self._index):
+                self._drop(digest)
+            self._save_index()
+
+    def flush(self):
+        """Persist the current recency order to disk."""
+        with self._lock:
+            self._save_index()
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._index)
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, digest + ".pcm")
+
+    def _drop(self, digest, remove_file=True):
+        entry = self._index.pop(digest, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry["size"]
+        if remove_file:
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            oldest = next(iter(self._index))
+            self._drop(oldest)
+
+    def _load_index(self):
+        index_path = os.path.join(self.cache_dir, _INDEX_FILE)
+        try:
+            with open(index_path, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+
+        for digest, sample_rate in entries:
+            path = self._path(digest)
+            if not os.path.isfile(path):
+                continue
+            size = os.path.getsize(path)
+            self._index[digest] = {"sample_rate": sample_rate, "size": size}
+            self._total_bytes += size
+        self._evict()
+
+    def _save_index(self):
+        index_path = os.path.join(self.cache_dir, _INDEX_FILE)
+        entries = [[d, e["sample_rate"]] for d, e in self._index.items()]
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, index_path)
+
+
+class CachedTTS(object):
+    """
+    Wraps a TTS connector so repeated utterances are served from a TTSCache.
+
+    Works with any connector whose requests have a ``text`` attribute and whose
+    replies have ``waveform`` and ``sample_rate`` attributes, such as Text2Speech
+    and ElevenLabsTTS. Cached replies are returned as an AudioMessage.
+
+    The key has the settings the service synthesizes with: those of the request, and
+    for the ones it leaves out, those of the service conf (e.g. Text2SpeechConf or
+    ElevenLabsTTSConf). So changing the configured voice, model or language does not
+    return audio of the old settings.
+
+    :param tts: the TTS connector to forward cache misses to
+    :type tts: SICConnector
+    :param provider: provider name that is part of the cache key
+    :type provider: str
+    :param sample_rate: output sample rate configured on the TTS service, by default
+        the sample_rate of the conf, if any
+    :type sample_rate: int
+    :param cache: cache to use, a TTSCache in the default location if None
+    :type cache: TTSCache
+    :param conf: conf the TTS service was started with, by default the conf of the
+        connector
+    :type conf: SICConfMessage
+    """
+
+    def __init__(self, tts, provider, sample_rate=None, cache=None, conf=None):
+        self.tts = tts
+        self.provider = provider
+        self.conf = conf if conf is not None else getattr(tts, "_conf", None)
+        if sample_rate is None:
+            sample_rate = getattr(self.conf, "sample_rate", None)
+        self.sample_rate = sample_rate
+        self.cache = cache if cache is not None else TTSCache()
+
+    def request(self, request, **kwargs):
+        """
+        Return the cached waveform for the request, or synthesize and cache it.
+
+        Extra keyword arguments are passed on to the connector's request method.
+        """
+        key = self._key(request)
+        cached = self.cache.get(**key)
+        if cached is not None:
+            waveform, sample_rate = cached
+            return AudioMessage(waveform, sample_rate=sample_rate)
+
+        reply = self.tts.request(request, **kwargs)
+        self.cache.put(
+            key["text"],
+            reply.waveform,
+            reply.sample_rate,
+            voice=key["voice"],
+            rate=key["rate"],
+            requested_sample_rate=key["sample_rate"],
+            provider=key["provider"],
+            settings=key["settings"],
+        )
+        return reply
+
+    def __getattr__(self, name):
+        # Everything else (register_callback, stop_component, ...) goes to the connector
+        return getattr(self.tts, name)
+
+    def _key(self, request):
+        settings = {}
+        for name in SYNTHESIS_SETTINGS:
+            if hasattr(request, name) or hasattr(self.conf, name):
+                settings[name] = self._setting(request, name)
+        return {
+            "text": request.text,
+            "voice": self._setting(request, "voice_name")
+            or self._setting(request, "voice_id"),
+            "rate": self._setting(request, "speaking_rate"),
+            "sample_rate": self.sample_rate,
+            "provider": self.provider,
+            "settings": settings,
+        }
+
+    def _setting(self, request, name):
+        """The value the service uses: of the request, or else of the conf."""
+        value = getattr(request, name, None)
+        # Like the services: a stability of 0 is set, other empty values are not
+        if value is None or (name != "stability" and not value):
+            value = getattr(self.conf, name, None)
+        return value
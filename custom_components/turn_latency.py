@@ -0,0 +1,254 @@
+"""
+Per-turn latency breakdown for conversational applications.
+
+A slow reply can come from speech recognition, the intent or LLM request, text to
+speech or starting playback. TurnLatencyTracker timestamps each of these steps for
+every turn, writes one JSON line per turn, and summarizes the time spent in each
+stage as percentiles over the session:
+
+    latency = TurnLatencyTracker(session_id=session_id)
+    dialogflow.register_callback(lambda message: latency.mark_recognition(message))
+
+    latency.start_turn()
+    reply = dialogflow.request(GetIntentRequest(session_id))
+    latency.mark("request_start")
+    gpt_reply = gpt.request(GPTRequest(reply.transcript))
+    latency.mark("first_token")
+    ...
+    latency.end_turn(transcript=reply.transcript)
+
+    latency.log_summary(logger)
+
+The events of a turn, in order (events a pipeline does not have are left out):
+
+- end_of_speech: the recognizer detected the end of the utterance
+- stt_final: the final transcript arrived
+- request_start: the intent or LLM request was sent
+- first_token: the first token (or the complete reply, without streaming) arrived
+- tts_first_byte: the first synthesized audio arrived
+- playback_start: the audio was sent to the speakers
+
+Each stage is the time between an event and the event before it in time, and total
+is the time from the first to the last event. Events marked from callbacks can arrive
+out of the order above, e.g. the final transcript of Dialogflow CX after its reply; the
+stages then follow the order in which they happened.
+
+Summarize one or more earlier sessions with (from the repository root):
+    python -m custom_components.turn_latency latency_logs/*.jsonl
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+TURN_EVENTS = (
+    "end_of_speech",
+    "stt_final",
+    "request_start",
+    "first_token",
+    "tts_first_byte",
+    "playback_start",
+)
+PERCENTILES = (50, 90, 95, 99)
+
+
+def recognition_event(message):
+    """
+    Turn event of a Dialogflow, Dialogflow CX or Google Speech-to-Text recognition
+    message, for use in their callbacks.
+
+    The stock Dialogflow CX service only forwards results with a transcript, so it
+    never sends the end of the utterance and gives only stt_final.
+
+    :return: "end_of_speech", "stt_final" or None
+    """
+    response = getattr(message, "response", None)
+    result = getattr(response, "recognition_result", None)
+    if result is None:
+        return None
+    message_type = getattr(result, "message_type", None)
+    if getattr(message_type, "name", message_type) == "END_OF_SINGLE_UTTERANCE":
+        return "end_of_speech"
+    if getattr(result, "is_final", False):
+        return "stt_final"
+    return None
+
+
+def turn_stages(events):
+    """
+    :param events: event name -> time.time() of one turn
+    :return: stage name -> seconds, a stage is named after the event that ends it
+    :rtype: dict[str, float]
+    """
+    # By time, so an event marked late does not give a negative stage; events at the
+    # same time stay in TURN_EVENTS order
+    ordered = sorted(
+        (events[name], i, name) for i, name in enumerate(TURN_EVENTS) if name in events
+    )
+    ordered = [(timestamp, name) for timestamp, _, name in ordered]
+    stages = {}
+    for (previous, _), (current, name) in zip(ordered, ordered[1:]):
+        stages[name] = current - previous
+    if len(ordered) > 1:
+        stages["total"] = ordered[-1][0] - ordered[0][0]
+    return stages
+
+
+def summarize_turns(turns):
+    """
+    :param turns: turn records as written to the JSONL file
+    :return: stage name -> {"count", "mean", "p50", "p90", "p95", "p99", "max"} in
+        seconds, stages in event order with total last
+    :rtype: dict[str, dict]
+    """
+    durations = {}
+    for turn in turns:
+        for name, seconds in turn["stages"].items():
+            durations.setdefault(name, []).append(seconds)
+
+    summary = {}
+    for name in TURN_EVENTS[1:] + ("total",):
+        if name not in durations:
+            continue
+        values = np.array(durations[name])
+        stats = {"count": len(values), "mean": float(values.mean())}
+        for percentile in PERCENTILES:
+            stats["p{}".format(percentile)] = float(np.percentile(values, percentile))
+        stats["max"] = float(values.max())
+        summary[name] = stats
+    return summary
+
+
+def format_summary(summary):
+    """:return: the summary as a table, in milliseconds"""
+    columns = ["count", "mean"] + ["p{}".format(p) for p in PERCENTILES] + ["max"]
+    lines = ["{:<16}".format("stage") + "".join("{:>9}".format(c) for c in columns)]
+    for name, stats in summary.items():
+        cells = ["{:>9}".format(stats["count"])]
+        cells += ["{:>9.0f}".format(stats[c] * 1000) for c in columns[1:]]
+        lines.append("{:<16}".format(name) + "".join(cells))
+    return "\n".join(lines)
+
+
+class TurnLatencyTracker(object):
+    """
+    Records the events of each conversational turn to a JSONL file.
+
+    Events may be marked from callbacks on other threads. Only the first mark of an
+    event in a turn counts, so marking "first_token" for every streamed chunk is fine.
+
+    :param session_id: written with every turn, e.g. the Dialogflow session id
+    :param directory: where the session file is written, created if needed
+    :param path: the JSONL file, instead of a new file in directory
+    """
+
+    def __init__(self, session_id=None, directory="latency_logs", path=None):
+        self.session_id = session_id
+        if path is None:
+            name = "turns_{}_{}.jsonl".format(
+                time.strftime("%Y%m%d-%H%M%S"),
+                session_id if session_id is not None else os.getpid(),
+            )
+            path = os.path.join(directory, name)
+        parent = os.path.dirname(path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        self.path = path
+
+        self.turns = []
+        self._events = None
+        self._lock = threading.Lock()
+
+    def start_turn(self):
+        """Start a new turn, discarding a turn that was not ended."""
+        with self._lock:
+            self._events = {}
+
+    def mark(self, event, timestamp=None):
+        """
+        :param event: one of TURN_EVENTS
+        :param timestamp: time.time() of the event, None for now
+        """
+        if event not in TURN_EVENTS:
+            raise ValueError(
+                "Unknown turn event {}, use one of {}".format(event, TURN_EVENTS)
+            )
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self._events is not None and event not in self._events:
+                self._events[event] = timestamp
+
+    def mark_recognition(self, message):
+        """Mark end_of_speech or stt_final for a recognition message, if it is one."""
+        event = recognition_event(message)
+        if event is not None:
+            self.mark(event)
+
+    def end_turn(self, **fields):
+        """
+        Write the turn to the session file.
+
+        :param fields: extra JSON fields for the turn, e.g. transcript or intent
+        :return: the turn record, None if no turn was started
+        :rtype: dict
+        """
+        with self._lock:
+            events, self._events = self._events, None
+        if events is None:
+            return None
+
+        record = {
+            "session_id": self.session_id,
+            "turn": len(self.turns),
+            "events": events,
+            "stages": turn_stages(events),
+        }
+        record.update(fields)
+        self.turns.append(record)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        return record
+
+    def summary(self):
+        return summarize_turns(self.turns)
+
+    def log_summary(self, logger):
+        """Log the stage percentiles and write them next to the session file."""
+        if not self.turns:
+            return
+        summary = self.summary()
+        with open(os.path.splitext(self.path)[0] + ".summary.json", "w") as f:
+            json.dump(summary, f, indent=2)
+        logger.info(
+            "Turn latency over {} turns (ms), written to {}:\n{}".format(
+                len(self.turns), self.path, format_summary(summary)
+            )
+        )
+
+
+def load_turns(paths):
+    turns = []
+    for path in paths:
+        with open(path) as f:
+            turns.extend(json.loads(line) for line in f if line.strip())
+    return turns
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Summarize the turn latency of one or more sessions."
+    )
+    parser.add_argument("paths", nargs="+", help="JSONL files of TurnLatencyTracker")
+    args = parser.parse_args()
+
+    turns = load_turns(args.paths)
+    print("{} turns".format(len(turns)))
+    print(format_summary(summarize_turns(turns)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Voice activity gate between a microphone and a speech-to-text service.
+
+VADGate runs the Silero voice detection of the VoiceDetection service on the incoming
+microphone audio and only forwards audio while someone is speaking. When speech
+starts, the last pre_roll_ms of audio before the onset is sent along in one message,
+so the first syllable is not lost. When speech ends, end_of_utterance_ms of silence is
+sent, which makes the endpointing of Whisper, Google Speech-to-Text and Dialogflow
+conclude the utterance right away.
+
+Use it as the input source of any service that consumes AudioMessages:
+
+    gate = VADGate(input_source=desktop.mic, conf=VADGateConf(pre_roll_ms=500))
+    whisper = SICWhisper(input_source=gate)
+
+Note that STT request timeouts that count received audio (such as the Whisper
+timeout) only run while speech is forwarded.
+
+Run the component with (from the repository root):
+    python -m custom_components.vad_gate
+"""
+
+import collections
+
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import AudioMessage
+from sic_framework.core.service_python2 import SICMessageDictionary
+from sic_framework.services.voice_detection.voice_detection import (
+    VoiceDetectionComponent,
+    VoiceDetectionConf,
+)
+
+
+class VADGateConf(VoiceDetectionConf):
+    """
+    Configuration for the VAD gate. See VoiceDetectionConf for the detection parameters.
+
+    :param pre_roll_ms: audio before the detected speech onset that is forwarded with it
+    :type pre_roll_ms: float
+    :param end_of_utterance_ms: silence that is forwarded when speech ends, 0 to disable
+    :type end_of_utterance_ms: float
+    """
+
+    def __init__(self, pre_roll_ms=300, end_of_utterance_ms=600, **kwargs):
+        super(VADGateConf, self).__init__(**kwargs)
+        self.pre_roll_ms = pre_roll_ms
+        self.end_of_utterance_ms = end_of_utterance_ms
+        # The gate never outputs VoiceDetectionMessages
+        self.message_frequency = 0
+
+
+class VADGateComponent(VoiceDetectionComponent):
+    """
+    Forwards microphone audio only while voice activity is detected.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(VADGateComponent, self).__init__(*args, **kwargs)
+        # Most recent audio chunks (waveform, sample_rate) received while nobody was
+        # speaking, together at least pre_roll_ms long
+        self.pre_roll = collections.deque()
+        self.pre_roll_seconds = 0.0
+        self.utterances = 0
+
+    @staticmethod
+    def get_inputs():
+        return [AudioMessage]
+
+    @staticmethod
+    def get_output():
+        return AudioMessage
+
+    @staticmethod
+    def get_conf():
+        return VADGateConf()
+
+    def on_message(self, message):
+        """
+        Update the speech state with the new audio and forward it if someone is speaking.
+
+        Processed directly instead of through the SICService input buffers, so no audio
+        chunk is skipped and the forwarded stream stays contiguous.
+        """
+        was_speaking = self.current_speech_state
+
+        inputs = SICMessageDictionary()
+        inputs.add(message)
+        self.execute(inputs)
+
+        is_speaking = self.current_speech_state
+        waveform = bytes(message.waveform)
+        sample_rate = message.sample_rate
+
+        if is_speaking and not was_speaking:
+            self.utterances += 1
+            self.logger.debug("Speech started, forwarding audio")
+            pre_roll = b"".join(chunk for chunk, _ in self.pre_roll)
+            pre_roll_bytes = 2 * int(sample_rate * self.params.pre_roll_ms / 1000.0)
+            pre_roll = pre_roll[len(pre_roll) - min(pre_roll_bytes, len(pre_roll)) :]
+            self._clear_pre_roll()
+            self._forward(pre_roll + waveform, sample_rate, message._timestamp)
+        elif is_speaking:
+            self._forward(waveform, sample_rate, message._timestamp)
+        elif was_speaking:
+            self.logger.debug("Speech ended, sending end of utterance")
+            silence = b"\x00\x00" * int(
+                sample_rate * self.params.end_of_utterance_ms / 1000.0
+            )
+            self._forward(waveform + silence, sample_rate, message._timestamp)
+        else:
+            self._add_pre_roll(waveform, sample_rate)
+
+    def _forward(self, waveform, sample_rate, timestamp):
+        message = AudioMessage(waveform, sample_rate=sample_rate)
+        # Keep the capture time of the microphone chunk for downstream alignment
+        message._timestamp = timestamp
+        self.output_message(message)
+
+    def _add_pre_roll(self, waveform, sample_rate):
+        self.pre_roll.append((waveform, sample_rate))
+        self.pre_roll_seconds += len(waveform) / 2.0 / sample_rate
+
+        max_seconds = self.params.pre_roll_ms / 1000.0
+        while self.pre_roll:
+            oldest, oldest_rate = self.pre_roll[0]
+            oldest_seconds = len(oldest) / 2.0 / oldest_rate
+            if self.pre_roll_seconds - oldest_seconds < max_seconds:
+                break
+            self.pre_roll.popleft()
+            self.pre_roll_seconds -= oldest_seconds
+
+    def _clear_pre_roll(self):
+        self.pre_roll.clear()
+        self.pre_roll_seconds = 0.0
+
+
+class VADGate(SICConnector):
+    """
+    Connector for the VAD gate component.
+    """
+
+    component_class = VADGateComponent
+    component_group = "VADGate"
+
+
+def main():
+    SICComponentManager([VADGateComponent], component_group="VADGate")
+
+
+if __name__ == "__main__":
+    main()
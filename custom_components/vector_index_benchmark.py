@@ -0,0 +1,251 @@
+"""
+Compare the recall, latency and memory of vector index settings on the chunks of an
+existing index.
+
+The vectors of the index are copied into temporary indexes with other dimensions and
+vector types (see custom_components.vector_ingest), and a sample of the chunks is used
+as queries, each excluding itself from its results. Recall@k is measured against an
+exact search over the original vectors, so the FLOAT32 row with all dimensions shows
+what HNSW alone loses and the other rows what truncation and FLOAT16 lose on top of it.
+Every variant prints its recall@k, the p50 and p95 search latency and the size of its
+vector index as reported by FT.INFO.
+
+Truncating only keeps retrieval quality for models trained for it (e.g.
+text-embedding-3-*). The temporary indexes are dropped afterwards.
+
+Redis Stack has to be running, run the benchmark with (from the repository root):
+    python -m custom_components.vector_index_benchmark my_index --dims full,512,256
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+import redis
+from sic_framework.core.utils import str_if_bytes
+from sic_framework.services.datastore.redis_datastore import sanitize_index_name
+
+from custom_components.rag_datastore import knn_search
+from custom_components.vector_ingest import (
+    VECTOR_TYPES,
+    create_index,
+    index_meta_key,
+    load_index_meta,
+    vector_blob,
+)
+
+BENCHMARK_PREFIX = "vecbench"
+
+
+def ft_info(redis_conn, index_name):
+    """:return: FT.INFO of an index as a dict with str keys"""
+    info = redis_conn.execute_command("FT.INFO", index_name)
+    return {
+        str_if_bytes(info[i], errors="ignore"): info[i + 1]
+        for i in range(0, len(info), 2)
+    }
+
+
+def index_memory_mb(redis_conn, index_name):
+    """:return: size of the vector index in MB, None if Redis does not report it"""
+    info = ft_info(redis_conn, index_name)
+    try:
+        return float(str_if_bytes(info["vector_index_sz_mb"], errors="ignore"))
+    except (KeyError, ValueError):
+        return None
+
+
+def load_vectors(redis_conn, index_name):
+    """
+    :return: (keys, vectors as a float32 matrix) of all documents of an index
+    """
+    definition = ft_info(redis_conn, index_name)["index_definition"]
+    definition = {
+        str_if_bytes(definition[i], errors="ignore"): definition[i + 1]
+        for i in range(0, len(definition), 2)
+    }
+    meta = load_index_meta(redis_conn, index_name)
+    dtype = VECTOR_TYPES[meta["vector_type"]] if meta else np.float32
+
+    keys, vectors = [], []
+    for prefix in definition["prefixes"]:
+        batch = list(
+            redis_conn.scan_iter(
+                match="{}*".format(str_if_bytes(prefix, errors="ignore")), count=1000
+            )
+        )
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in batch:
+            pipe.hget(key, "embedding")
+        for key, blob in zip(batch, pipe.execute()):
+            if blob:
+                keys.append(key)
+                vectors.append(np.frombuffer(blob, dtype=dtype).astype(np.float32))
+    if not vectors:
+        raise RuntimeError("Index '{}' has no vectors".format(index_name))
+    return keys, np.vstack(vectors)
+
+
+def exact_neighbours(vectors, queries, k):
+    """:return: per query, the k nearest rows by cosine similarity, itself excluded"""
+    normalized = vectors / np.maximum(
+        np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+    )
+    similarity = normalized[queries] @ normalized.T
+    similarity[np.arange(len(queries)), queries] = -np.inf
+    return [set(np.argsort(-row)[:k]) for row in similarity]
+
+
+def build_variant(redis_conn, name, vectors, dimensions, vector_type):
+    """Copy the vectors into a new index with other dimensions and vector type."""
+    key_prefix = "{}:".format(name)
+    blobs = [
+        vector_blob(vector.tobytes(order="C"), dimensions, vector_type)
+        for vector in vectors
+    ]
+    dim = len(blobs[0]) // np.dtype(VECTOR_TYPES[vector_type]).itemsize
+    create_index(
+        redis_conn,
+        name,
+        dim,
+        key_prefix,
+        vector_type,
+        {"dimensions": dimensions, "model": None},
+    )
+    pipe = redis_conn.pipeline(transaction=False)
+    for row, blob in enumerate(blobs):
+        pipe.hset(
+            "{}{}".format(key_prefix, row),
+            mapping={
+                "partition": "benchmark",
+                "doc_path": "",
+                "chunk_id": row,
+                "content": "",
+                "embedding": blob,
+            },
+        )
+        if row % 1000 == 999:
+            pipe.execute()
+    pipe.execute()
+
+    while str_if_bytes(ft_info(redis_conn, name).get("indexing", 0)) not in ("0", 0):
+        time.sleep(0.1)
+    return dim
+
+
+def drop_variant(redis_conn, name):
+    try:
+        redis_conn.execute_command("FT.DROPINDEX", name, "DD")
+    except redis.ResponseError:
+        pass
+    redis_conn.delete(index_meta_key(name))
+
+
+def benchmark_variant(
+    redis_conn, name, vectors, queries, truth, k, dimensions, vector_type
+):
+    """
+    :return: dict with recall, p50_ms, p95_ms and index_mb of one variant
+    """
+    recalls, latencies = [], []
+    for query, expected in zip(queries, truth):
+        blob = vector_blob(vectors[query].tobytes(order="C"), dimensions, vector_type)
+        start = time.time()
+        _, results = knn_search(redis_conn, name, blob, k + 1)
+        latencies.append((time.time() - start) * 1000)
+        found = [int(result["doc_id"].rsplit(":", 1)[1]) for result in results]
+        found = [row for row in found if row != query][:k]
+        recalls.append(len(expected.intersection(found)) / float(k))
+    return {
+        "recall": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "index_mb": index_memory_mb(redis_conn, name),
+    }
+
+
+def format_header(k):
+    return "{:<18} {:>9} {:>8} {:>8} {:>10}".format(
+        "variant", "recall@{}".format(k), "p50 ms", "p95 ms", "index MB"
+    )
+
+
+def format_row(variant, stats):
+    return "{:<18} {:>9.3f} {:>8.2f} {:>8.2f} {:>10}".format(
+        variant,
+        stats["recall"],
+        stats["p50_ms"],
+        stats["p95_ms"],
+        "-" if stats["index_mb"] is None else "{:.1f}".format(stats["index_mb"]),
+    )
+
+
+def parse_dims(value):
+    return [None if dim == "full" else int(dim) for dim in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare recall and latency of vector index settings."
+    )
+    parser.add_argument("index", help="index to take the vectors from")
+    parser.add_argument(
+        "--dims",
+        type=parse_dims,
+        default=[None, 1024, 512, 256],
+        help="comma separated dimensions, 'full' for all (default full,1024,512,256)",
+    )
+    parser.add_argument(
+        "--types",
+        type=lambda value: value.split(","),
+        default=["FLOAT32", "FLOAT16"],
+        help="comma separated vector types (default FLOAT32,FLOAT16)",
+    )
+    parser.add_argument("-k", type=int, default=10, help="results per query")
+    parser.add_argument("--queries", type=int, default=200, help="number of queries")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--password", default="changemeplease")
+    args = parser.parse_args()
+
+    redis_conn = redis.Redis(
+        host=args.host, port=args.port, password=args.password, decode_responses=False
+    )
+    index = sanitize_index_name(args.index)
+    keys, vectors = load_vectors(redis_conn, index)
+    full_dim = vectors.shape[1]
+    print("{} vectors of {} dimensions in '{}'".format(len(keys), full_dim, index))
+
+    queries = random.Random(0).sample(range(len(keys)), min(args.queries, len(keys)))
+    truth = exact_neighbours(vectors, queries, args.k)
+
+    print(format_header(args.k))
+    for dimensions in args.dims:
+        if dimensions is not None and dimensions >= full_dim:
+            continue
+        for vector_type in args.types:
+            variant = "{} x {}".format(vector_type, dimensions or full_dim)
+            name = "{}:{}:{}:{}".format(
+                BENCHMARK_PREFIX, index, dimensions or full_dim, vector_type
+            )
+            drop_variant(redis_conn, name)
+            try:
+                build_variant(redis_conn, name, vectors, dimensions, vector_type)
+                stats = benchmark_variant(
+                    redis_conn,
+                    name,
+                    vectors,
+                    queries,
+                    truth,
+                    args.k,
+                    dimensions,
+                    vector_type,
+                )
+            finally:
+                drop_variant(redis_conn, name)
+            print(format_row(variant, stats))
+
+
+if __name__ == "__main__":
+    main()
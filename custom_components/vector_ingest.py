@@ -0,0 +1,618 @@
+"""
+Incremental ingestion of documents into a Redis vector index.
+
+IngestVectorDocsRequest(override_existing=True, force_recreate_index=True) drops the
+index and embeds the whole corpus again, every time. sync_index keeps a manifest next
+to the index instead, with for every file its content hash and the hashes of its
+chunks, and only does the work for what changed since the last ingestion:
+
+- unchanged files (same content hash) are not read, chunked or embedded
+- of a changed file, only chunks with new content are embedded; chunks that are gone
+  are deleted, and kept chunks only get their position updated
+- files that disappeared have their chunks deleted
+
+The index stays live while it is synced, queries see the old or the new version of
+each file. Chunks are stored under content-addressed keys:
+    vec:<index>:<partition>:<file id>:<chunk hash>
+and the manifest is a Redis hash per index and partition:
+    vecmanifest:<index>:<partition>  (relative file path -> JSON entry)
+
+The chunks that need an embedding are sent to the embedding API by a BatchEmbedder
+(see custom_components.batch_embedder): in large batches, several requests at a time,
+backing off when rate limited. Local models (see custom_components.embedding_backends)
+embed one batch at a time.
+
+Vectors can be stored with fewer dimensions and as FLOAT16, which shrinks the HNSW
+index 2-12x. The embeddings are truncated to the first dimensions and normalized again
+(Matryoshka truncation, what the dimensions parameter of text-embedding-3 does), which
+only keeps retrieval quality for models trained for it. How an index stores its vectors
+is kept in its metadata, so queries are converted the same way:
+    vecindex:<index>  (JSON with dim, dimensions, vector_type and model)
+Use python -m custom_components.vector_index_benchmark to compare the recall and
+latency of these settings on an existing index.
+
+Changing the chunking settings re-embeds the affected files. Another embedding model
+(whose vectors cannot be compared with the stored ones), a model with another
+dimension, or other dimensions or vector_type settings, need force_recreate_index=True,
+which drops the index, its documents and the manifest and ingests everything again.
+These are checked before anything is written, also for indexes that were not created
+by sync_index, whose dimension is read from FT.INFO.
+"""
+
+import hashlib
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import redis
+from sic_framework.core.utils import str_if_bytes
+from sic_framework.services.datastore.redis_datastore import (
+    REDIS_STACK_INSTALL_MESSAGE,
+    _chunk_text,
+    _iter_files,
+    _read_document,
+    compose_index_name_from_path,
+    sanitize_index_name,
+)
+
+from custom_components.batch_embedder import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_MAX_CONCURRENCY,
+    BatchEmbedder,
+)
+from custom_components.embedding_backends import embed_batch_function, is_local_model
+
+VECTOR_TYPES = {"FLOAT32": np.float32, "FLOAT16": np.float16}
+
+
+def manifest_key(index_name, partition):
+    return "vecmanifest:{}:{}".format(index_name, partition)
+
+
+def chunk_hash(chunk):
+    return hashlib.sha1(chunk.encode("utf-8", errors="ignore")).hexdigest()[:16]
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def index_exists(redis_conn, index_name):
+    try:
+        redis_conn.execute_command("FT.INFO", index_name)
+        return True
+    except redis.ResponseError as e:
+        error_msg = str(e).lower()
+        if "unknown command" in error_msg:
+            raise RuntimeError(
+                "{}\nOriginal error: {}".format(REDIS_STACK_INSTALL_MESSAGE, e)
+            ) from e
+        return False
+
+
+def index_meta_key(index_name):
+    return "vecindex:{}".format(index_name)
+
+
+def load_index_meta(redis_conn, index_name):
+    """
+    :return: how the index stores its vectors, None for an index that was not
+        created by sync_index (FLOAT32, all dimensions)
+    :rtype: dict | None
+    """
+    meta = redis_conn.get(index_meta_key(index_name))
+    return json.loads(meta) if meta is not None else None
+
+
+def index_vector_dim(redis_conn, index_name, field="embedding"):
+    """:return: DIM of the vector field of an index, None if FT.INFO does not list it"""
+    info = redis_conn.execute_command("FT.INFO", index_name)
+    info = {
+        str_if_bytes(info[i], errors="ignore"): info[i + 1]
+        for i in range(0, len(info), 2)
+    }
+    for attribute in info.get("attributes", []):
+        attribute = [str_if_bytes(value, errors="ignore") for value in attribute]
+        options = {
+            str(attribute[i]).lower(): attribute[i + 1]
+            for i in range(0, len(attribute) - 1, 2)
+        }
+        if options.get("identifier") == field and "dim" in options:
+            return int(options["dim"])
+    return None
+
+
+def vector_blob(blob, dimensions=None, vector_type="FLOAT32"):
+    """
+    Convert a float32 embedding to the format of an index.
+
+    :param blob: the embedding as float32 bytes
+    :param dimensions: keep the first dimensions and normalize again, None for all
+    :param vector_type: "FLOAT32" or "FLOAT16"
+    :return: the vector as bytes of vector_type
+    """
+    if vector_type not in VECTOR_TYPES:
+        raise ValueError(
+            "vector_type must be one of {}, not {}".format(
+                sorted(VECTOR_TYPES), vector_type
+            )
+        )
+    if dimensions is None and vector_type == "FLOAT32":
+        return blob
+    vector = np.frombuffer(blob, dtype=np.float32)
+    if dimensions is not None:
+        if dimensions > len(vector):
+            raise ValueError(
+                "dimensions={} but the model has {}".format(dimensions, len(vector))
+            )
+        vector = vector[:dimensions]
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+    return vector.astype(VECTOR_TYPES[vector_type]).tobytes(order="C")
+
+
+def create_index(redis_conn, index_name, dim, key_prefix, vector_type, metadata):
+    """Create a vector index like the stock service does, with a vector type."""
+    try:
+        redis_conn.execute_command(
+            "FT.CREATE",
+            index_name,
+            "ON",
+            "HASH",
+            "PREFIX",
+            1,
+            key_prefix,
+            "SCHEMA",
+            "partition",
+            "TAG",
+            "SEPARATOR",
+            "|",
+            "doc_path",
+            "TEXT",
+            "chunk_id",
+            "NUMERIC",
+            "content",
+            "TEXT",
+            "embedding",
+            "VECTOR",
+            "HNSW",
+            6,
+            "TYPE",
+            vector_type,
+            "DIM",
+            dim,
+            "DISTANCE_METRIC",
+            "COSINE",
+        )
+    except redis.ResponseError as e:
+        error_msg = str(e).lower()
+        if "unknown command" in error_msg:
+            raise RuntimeError(
+                "{}\nOriginal error: {}".format(REDIS_STACK_INSTALL_MESSAGE, e)
+            ) from e
+        raise
+    meta = dict(metadata, dim=dim, vector_type=vector_type)
+    redis_conn.set(index_meta_key(index_name), json.dumps(meta))
+    return meta
+
+
+def _check_index_meta(meta, index_name, dimensions, vector_type, model):
+    stored = (
+        (None, "FLOAT32") if meta is None else (meta["dimensions"], meta["vector_type"])
+    )
+    if stored != (dimensions, vector_type):
+        raise RuntimeError(
+            "Index '{}' stores vectors with dimensions={}, vector_type={}; to use "
+            "dimensions={}, vector_type={} ingest with force_recreate_index=True".format(
+                index_name, stored[0], stored[1], dimensions, vector_type
+            )
+        )
+    stored_model = None if meta is None else meta.get("model")
+    if stored_model is not None and stored_model != model:
+        raise RuntimeError(
+            "Index '{}' stores embeddings of {}; to use {} ingest with "
+            "force_recreate_index=True".format(index_name, stored_model, model)
+        )
+
+
+def _check_index_dim(index_name, stored_dim, dim):
+    if stored_dim is not None and stored_dim != dim:
+        raise RuntimeError(
+            "Index '{}' stores vectors of {} dimensions but the embeddings have {}; "
+            "ingest with force_recreate_index=True to recreate it".format(
+                index_name, stored_dim, dim
+            )
+        )
+
+
+def _settings(request):
+    """Settings that change the chunks or their embeddings when they change."""
+    return {
+        "embedding_model": request.embedding_model,
+        "chunk_chars": request.chunk_chars,
+        "chunk_overlap": request.chunk_overlap,
+    }
+
+
+def _load_manifest(redis_conn, key):
+    manifest = {}
+    for path, entry in redis_conn.hgetall(key).items():
+        manifest[path.decode("utf-8")] = json.loads(entry)
+    return manifest
+
+
+class _FilePlan(object):
+    """What a sync does with one changed file."""
+
+    def __init__(self, relative, path, content_hash, file_id, positions, old_chunks):
+        self.relative = relative
+        self.path = path
+        self.content_hash = content_hash
+        self.file_id = file_id
+        # chunk hash -> (position of its first occurrence, content)
+        self.positions = positions
+        self.old_chunks = old_chunks
+        self.new_hashes = []
+        self.blobs = []
+
+
+def sync_index(
+    redis_conn,
+    request,
+    index_name,
+    partition,
+    input_path,
+    embedder,
+    logger=None,
+    progress=None,
+):
+    """
+    Bring one index and partition in line with the documents under input_path.
+
+    The changed files are read and chunked first, so the total amount of work is
+    known. Their new chunks are then embedded by the BatchEmbedder in windows of a
+    few batches per worker, and every file is written as soon as its chunks are
+    embedded, which keeps the memory use bounded.
+
+    :param redis_conn: Redis connection with decode_responses=False
+    :param request: SyncVectorDocsRequest with the glob, chunking and model settings
+    :param embedder: BatchEmbedder for the embedding model of the request
+    :param progress: called with a progress dict after scanning and every batch
+    :return: the ingestion result, with counts of what was (not) done
+    :rtype: dict
+    """
+    start = time.time()
+    key_prefix = "vec:{}:".format(index_name)
+    manifest_name = manifest_key(index_name, partition)
+
+    # Plain IngestVectorDocsRequests (with a local model) store full float32 vectors
+    dimensions = getattr(request, "dimensions", None)
+    vector_type = getattr(request, "vector_type", "FLOAT32")
+    if vector_type not in VECTOR_TYPES:
+        raise ValueError(
+            "vector_type must be one of {}, not {}".format(
+                sorted(VECTOR_TYPES), vector_type
+            )
+        )
+    if dimensions is not None and dimensions <= 0:
+        raise ValueError("dimensions must be > 0")
+
+    exists = index_exists(redis_conn, index_name)
+    if exists and request.force_recreate_index:
+        # DD also deletes the documents, of all partitions
+        redis_conn.execute_command("FT.DROPINDEX", index_name, "DD")
+        for key in redis_conn.scan_iter(
+            match="vecmanifest:{}:*".format(index_name), count=1000
+        ):
+            redis_conn.delete(key)
+        exists = False
+    stored_dim = None
+    if exists:
+        meta = load_index_meta(redis_conn, index_name)
+        _check_index_meta(
+            meta, index_name, dimensions, vector_type, request.embedding_model
+        )
+        stored_dim = (
+            meta["dim"]
+            if meta is not None
+            else index_vector_dim(redis_conn, index_name)
+        )
+    else:
+        redis_conn.delete(index_meta_key(index_name))
+
+    manifest = _load_manifest(redis_conn, manifest_name) if exists else {}
+
+    files = sorted(_iter_files(input_path, request.glob))
+    if not files:
+        raise RuntimeError(
+            "No files matched under {} with glob {!r}".format(input_path, request.glob)
+        )
+
+    settings = _settings(request)
+    stats = {
+        "files": len(files),
+        "chunks": 0,
+        "unchanged_files": 0,
+        "changed_files": 0,
+        "deleted_files": 0,
+        "embedded_chunks": 0,
+        "deleted_chunks": 0,
+    }
+
+    def report(stage, chunks_to_embed, chunks_embedded):
+        if progress is not None:
+            progress(
+                {
+                    "index": index_name,
+                    "partition": partition,
+                    "stage": stage,
+                    "files": len(files),
+                    "changed_files": len(plans),
+                    "chunks_to_embed": chunks_to_embed,
+                    "chunks_embedded": chunks_embedded,
+                    "elapsed": time.time() - start,
+                    "backoff": embedder.backoff,
+                }
+            )
+
+    # Scan: find the changed files and the chunks that need an embedding
+    plans = []
+    seen = set()
+    for path in files:
+        relative = path.name if input_path.is_file() else path.relative_to(input_path)
+        relative = str(relative)
+        seen.add(relative)
+
+        content_hash = file_hash(path)
+        entry = manifest.get(relative)
+        if (
+            entry is not None
+            and entry["file_hash"] == content_hash
+            and entry["settings"] == settings
+        ):
+            stats["unchanged_files"] += 1
+            stats["chunks"] += len(entry["chunks"])
+            continue
+
+        chunks = _chunk_text(
+            _read_document(path), request.chunk_chars, request.chunk_overlap
+        )
+        positions = {}
+        for i, chunk in enumerate(chunks):
+            positions.setdefault(chunk_hash(chunk), (i, chunk))
+
+        file_id = hashlib.sha1(
+            "{}:{}".format(partition, relative).encode("utf-8")
+        ).hexdigest()[:16]
+        plan = _FilePlan(relative, path, content_hash, file_id, positions, {})
+        if entry is not None:
+            plan.old_chunks = entry["chunks"]
+        # Embeddings of kept content can be reused if the model and chunking are the same
+        reusable = entry is not None and entry["settings"] == settings
+        plan.new_hashes = [
+            h for h in positions if not (reusable and h in plan.old_chunks)
+        ]
+        plans.append(plan)
+
+    chunks_to_embed = sum(len(plan.new_hashes) for plan in plans)
+    report("scanned", chunks_to_embed, 0)
+
+    # Embed and write, a window of files at a time
+    window_chunks = embedder.batch_size * embedder.max_concurrency * 2
+    window = []
+    pending = 0
+    cleaned = False
+    for n, plan in enumerate(plans):
+        window.append(plan)
+        pending += len(plan.new_hashes)
+        if pending < window_chunks and n < len(plans) - 1:
+            continue
+
+        texts = [plan.positions[h][1] for plan in window for h in plan.new_hashes]
+        embedded = stats["embedded_chunks"]
+        blobs = embedder.embed(
+            texts,
+            on_batch=lambda done, _: report(
+                "embedding", chunks_to_embed, embedded + done
+            ),
+        )
+        blobs = [vector_blob(blob, dimensions, vector_type) for blob in blobs]
+        if blobs:
+            dim = len(blobs[0]) // np.dtype(VECTOR_TYPES[vector_type]).itemsize
+            # Before the first write, so a mismatch leaves the index as it was
+            _check_index_dim(index_name, stored_dim, dim)
+            stored_dim = dim
+        if not cleaned:
+            if not manifest:
+                # First sync, or the index was dropped behind our back: remove the
+                # manifest and the chunks of earlier ingestions, which are not
+                # content-addressed
+                redis_conn.delete(manifest_name)
+                _delete_keys(redis_conn, "{}{}:*".format(key_prefix, partition))
+            cleaned = True
+        if blobs and not exists:
+            create_index(
+                redis_conn,
+                index_name,
+                stored_dim,
+                key_prefix,
+                vector_type,
+                {"dimensions": dimensions, "model": request.embedding_model},
+            )
+            exists = True
+
+        offset = 0
+        for plan in window:
+            plan.blobs = blobs[offset : offset + len(plan.new_hashes)]
+            offset += len(plan.new_hashes)
+            _write_file(
+                redis_conn, plan, key_prefix, partition, manifest_name, settings
+            )
+
+            removed = [h for h in plan.old_chunks if h not in plan.positions]
+            stats["changed_files"] += 1
+            stats["chunks"] += len(plan.positions)
+            stats["embedded_chunks"] += len(plan.new_hashes)
+            stats["deleted_chunks"] += len(removed)
+            if logger is not None:
+                logger.info(
+                    "{}: embedded {} chunks, kept {}, deleted {}".format(
+                        plan.relative,
+                        len(plan.new_hashes),
+                        len(plan.positions) - len(plan.new_hashes),
+                        len(removed),
+                    )
+                )
+            # The chunk texts and embeddings are no longer needed
+            plan.positions = {h: (i, None) for h, (i, _) in plan.positions.items()}
+            plan.blobs = []
+        window = []
+        pending = 0
+
+    for relative, entry in manifest.items():
+        if relative in seen:
+            continue
+        pipe = redis_conn.pipeline(transaction=False)
+        for h in entry["chunks"]:
+            pipe.delete("{}{}:{}:{}".format(key_prefix, partition, entry["file_id"], h))
+        pipe.hdel(manifest_name, relative)
+        pipe.execute()
+        stats["deleted_files"] += 1
+        stats["deleted_chunks"] += len(entry["chunks"])
+
+    report("done", chunks_to_embed, stats["embedded_chunks"])
+
+    result = {"ok": True, "index": index_name, "partition": partition}
+    result.update(stats)
+    result["seconds"] = time.time() - start
+    return result
+
+
+def _write_file(redis_conn, plan, key_prefix, partition, manifest_name, settings):
+    """Store the new chunks of a file, update and delete the others, then its entry."""
+
+    def chunk_key(h):
+        return "{}{}:{}:{}".format(key_prefix, partition, plan.file_id, h).encode(
+            "utf-8"
+        )
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for h, blob in zip(plan.new_hashes, plan.blobs):
+        i, chunk = plan.positions[h]
+        pipe.hset(
+            chunk_key(h),
+            mapping={
+                b"partition": partition.encode("utf-8"),
+                b"doc_path": str(plan.path).encode("utf-8"),
+                b"chunk_id": str(i).encode("utf-8"),
+                b"content": chunk.encode("utf-8", errors="ignore"),
+                b"embedding": blob,
+            },
+        )
+    embedded = set(plan.new_hashes)
+    for h, (i, _) in plan.positions.items():
+        if h in plan.old_chunks and plan.old_chunks[h] != i and h not in embedded:
+            pipe.hset(chunk_key(h), b"chunk_id", str(i).encode("utf-8"))
+    for h in plan.old_chunks:
+        if h not in plan.positions:
+            pipe.delete(chunk_key(h))
+    pipe.hset(
+        manifest_name,
+        plan.relative,
+        json.dumps(
+            {
+                "file_hash": plan.content_hash,
+                "file_id": plan.file_id,
+                "settings": settings,
+                "chunks": {h: i for h, (i, _) in plan.positions.items()},
+            }
+        ),
+    )
+    pipe.execute()
+
+
+def sync_vector_docs(redis_conn, request, logger=None, progress=None):
+    """
+    Handle a SyncVectorDocsRequest, in single index or auto-index mode like
+    IngestVectorDocsRequest.
+    """
+    root = Path(request.input_path)
+    if not root.exists():
+        raise FileNotFoundError("Input path not found: {}".format(root))
+
+    # Plain IngestVectorDocsRequests (with a local model) have no batching settings
+    batch_size = getattr(request, "embedding_batch_size", DEFAULT_BATCH_SIZE)
+    concurrency = getattr(request, "max_concurrent_requests", DEFAULT_MAX_CONCURRENCY)
+    if is_local_model(request.embedding_model):
+        # A local model computes one batch at a time anyway
+        concurrency = 1
+    embedder = BatchEmbedder(
+        embed_batch_function(request.embedding_model, request.openai_api_key),
+        batch_size=batch_size,
+        max_concurrency=concurrency,
+    )
+
+    if not request.auto_index_from_folders:
+        if not request.index_name:
+            raise RuntimeError(
+                "index_name is required when auto_index_from_folders=False"
+            )
+        result = sync_index(
+            redis_conn,
+            request,
+            sanitize_index_name(request.index_name),
+            request.partition,
+            root,
+            embedder,
+            logger=logger,
+            progress=progress,
+        )
+        return {"ok": True, "results": [result]}
+
+    if not root.is_dir():
+        raise RuntimeError(
+            "input_path must be a directory when auto_index_from_folders=True"
+        )
+    results = []
+    for doc_dir, folder_names in _document_directories(root, root, request.glob):
+        index_name = compose_index_name_from_path(folder_names, request.index_prefix)
+        results.append(
+            sync_index(
+                redis_conn,
+                request,
+                index_name,
+                "default",
+                doc_dir,
+                embedder,
+                logger=logger,
+                progress=progress,
+            )
+        )
+    if not results:
+        raise RuntimeError(
+            "No directories with matching documents found in {}".format(root)
+        )
+    return {"ok": True, "results": results}
+
+
+def _document_directories(root, base_path, glob):
+    """Leaf directories with matching documents, as in auto-index mode of the stock service."""
+    doc_dirs = []
+    for sub in sorted(p for p in base_path.iterdir() if p.is_dir()):
+        doc_dirs.extend(_document_directories(root, sub, glob))
+    if not doc_dirs and any(_iter_files(base_path, glob)):
+        doc_dirs.append((base_path, list(base_path.relative_to(root).parts)))
+    return doc_dirs
+
+
+def _delete_keys(redis_conn, pattern):
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in redis_conn.scan_iter(match=pattern, count=1000):
+        pipe.delete(key)
+    pipe.execute()
@@ -4,32 +4,46 @@ from sic_framework.core import sic_logging
 
 # import device(s), service(s), and message(s) we will be using
 from sic_framework.services.datastore.redis_datastore import (
-    RedisDatastoreConf,
-    RedisDatastore,
-    IngestVectorDocsRequest,
     QueryVectorDBRequest,
     VectorDBResultsMessage,
     DeleteNamespaceRequest,
     SICSuccessMessage
 )
 
+# Import custom components (pip install -e . from the repository root)
+from custom_components.rag_datastore import (
+    RAGDatastore,
+    RAGDatastoreConf,
+    SyncVectorDocsRequest,
+)
+
 # import demo-specific modules
 from pathlib import Path
 import os
 
 
+# OpenAI embedding model: text-embedding-3-large = 3072 dimensions, high quality.
+# To index and search offline, without an API key, use a local model instead, e.g.
+# "local:all-MiniLM-L6-v2" (pip install sentence-transformers where the datastore runs).
+# Run once with force_recreate_index=True after switching models.
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+
 class RAGDemo(SICApplication):
     """
     Demonstrates vector-based document search using Redis datastore.
     
     This demo shows how to:
-    - Ingest PDF documents with automatic text extraction and chunking
+    - Ingest PDF documents with automatic text extraction and chunking, embedding only
+      new or changed chunks on later runs
     - Generate embeddings using OpenAI
     - Perform semantic similarity search over documents
+    - Skip the embedding API for repeated queries (cached query embeddings)
     
     Prerequisites:
-    1. Start Redis Datastore: run-redis --data-dir <PATH/TO/STORAGE> --redis-conf <PATH/TO/redis.conf>
-    2. Set OPENAI_API_KEY environment variable (in conf/.env or export)
+    1. Start Redis Stack: run-redis --data-dir <PATH/TO/STORAGE> --redis-conf <PATH/TO/redis.conf>
+    2. Start the RAG datastore: python -m custom_components.rag_datastore (from the repository root)
+    3. Set OPENAI_API_KEY environment variable (in conf/.env or export)
     """
 
     def __init__(self):
@@ -53,7 +67,7 @@ class RAGDemo(SICApplication):
 
     def setup(self):
         """Initialize Redis datastore connection."""
-        redis_conf = RedisDatastoreConf(
+        redis_conf = RAGDatastoreConf(
             host="127.0.0.1",
             port=6379,
             password="changemeplease",
@@ -61,8 +75,20 @@ class RAGDemo(SICApplication):
             version="v1",
             developer_id=0
         )
-        self.datastore = RedisDatastore(conf=redis_conf)
+        self.datastore = RAGDatastore(conf=redis_conf)
+        # Ingestion progress is output while the embeddings are generated
+        self.datastore.register_callback(self._on_ingest_progress)
     
+    def _on_ingest_progress(self, message):
+        """Log the progress of the document ingestion."""
+        if not hasattr(message, "progress"):
+            return
+        progress = message.progress
+        if progress["stage"] == "scanned":
+            self.logger.info(f"  {progress['changed_files']} of {progress['files']} files changed, {progress['chunks_to_embed']} chunks to embed")
+        elif progress["stage"] == "embedding":
+            self.logger.info(f"  Embedded {progress['chunks_embedded']}/{progress['chunks_to_embed']} chunks ({progress['elapsed']:.1f} s)")
+
     def ingest_documents(self):
         """
         Ingest PDF documents from the vector_docs directory.
@@ -74,15 +100,16 @@ class RAGDemo(SICApplication):
            - View index info: FT.INFO rag_demo_docs
         
         2. **Document Chunks**: Stored as Redis hashes with keys:
-           - Pattern: vec:rag_demo_docs:demo:<file_hash>:<chunk_number>
-           - Example: vec:rag_demo_docs:demo:a3f5c8d9e1b2:0
+           - Pattern: vec:rag_demo_docs:demo:<file_id>:<chunk_hash>
+           - Example: vec:rag_demo_docs:demo:a3f5c8d9e1b2c4d6:9f86d081884c7d65
         
         3. **Hash Fields** for each chunk:
            - partition: "demo" (for filtering/isolation)
            - doc_path: Full path to original PDF file
            - chunk_id: Chunk number within the document
            - content: Text content of the chunk
-           - embedding: Float32 vector (3072 dimensions for text-embedding-3-large)
+           - embedding: Float32 vector (3072 dimensions for text-embedding-3-large),
+             or as set with the dimensions and vector_type of the ingestion
         
         4. **Index Schema**: RediSearch creates the following searchable fields:
            - partition (TAG): For filtering by partition
@@ -91,6 +118,12 @@ class RAGDemo(SICApplication):
            - content (TEXT): Full-text searchable content
            - embedding (VECTOR): HNSW index for similarity search
         
+        5. **Manifest**: Redis hash "vecmanifest:rag_demo_docs:demo" with, per file,
+           its content hash and chunk hashes, so the next run only embeds what changed
+        
+        6. **Index metadata**: "vecindex:rag_demo_docs" with the dimensions and vector
+           type of the index, used to convert query embeddings
+        
         You can inspect the data using redis-cli:
         ```
         # List all indexes
@@ -103,12 +136,15 @@ class RAGDemo(SICApplication):
         KEYS vec:rag_demo_docs:demo:*
         
         # View a specific chunk
-        HGETALL vec:rag_demo_docs:demo:<hash>:0
+        HGETALL vec:rag_demo_docs:demo:<file_id>:<chunk_hash>
+        
+        # View the manifest
+        HGETALL vecmanifest:rag_demo_docs:demo
         ```
         """
         self.logger.info("\n=== Ingesting PDF Documents ===")
         
-        if not self.openai_api_key:
+        if not self.openai_api_key and not EMBEDDING_MODEL.startswith("local"):
             self.logger.error("[X] OPENAI_API_KEY not set")
             self.logger.info("  Set it in conf/.env or: export OPENAI_API_KEY='your-key-here'")
             return None
@@ -124,7 +160,8 @@ class RAGDemo(SICApplication):
         
         try:
             result = self.datastore.request(
-                IngestVectorDocsRequest(
+                # Only new or changed chunks are embedded, the index is kept between runs
+                SyncVectorDocsRequest(
                     # Path to directory containing PDFs to ingest
                     input_path=str(docs_dir),
                     
@@ -151,18 +188,26 @@ class RAGDemo(SICApplication):
                     # Helps maintain context across chunk boundaries
                     chunk_overlap=150,
                     
-                    # OpenAI embedding model to use
-                    # text-embedding-3-large = 3072 dimensions, high quality
-                    embedding_model="text-embedding-3-large",
+                    # Embedding model to use, see EMBEDDING_MODEL
+                    embedding_model=EMBEDDING_MODEL,
                     
-                    # Delete existing documents in this partition before ingesting
-                    # False = append new docs, True = replace all docs in partition
-                    override_existing=True,
+                    # Chunks per embedding request, and requests sent at the same time
+                    embedding_batch_size=256,
+                    max_concurrent_requests=4,
                     
-                    # Drop and recreate the entire index (destructive!)
-                    # True = delete index and all partitions, False = keep existing index
-                    force_recreate_index=True
-                )
+                    # Vector storage: keep all dimensions as FLOAT32. E.g. dimensions=256
+                    # and vector_type="FLOAT16" make the index ~24x smaller; compare
+                    # recall first with python -m custom_components.vector_index_benchmark
+                    dimensions=None,
+                    vector_type="FLOAT32",
+                    
+                    # Drop and recreate the entire index and embed everything again
+                    # (destructive!), needed when switching to a model with another dimension
+                    # or to other dimensions/vector_type settings
+                    force_recreate_index=False
+                ),
+                # Generous for a first ingestion, progress is logged meanwhile
+                timeout=600.0,
             )
             
             if isinstance(result, VectorDBResultsMessage):
@@ -170,6 +215,7 @@ class RAGDemo(SICApplication):
                 if payload.get('ok'):
                     for res in payload.get('results', []):
                         self.logger.info(f"[OK] Ingested {res.get('files', 0)} files -> {res.get('chunks', 0)} chunks")
+                        self.logger.info(f"  Unchanged files: {res.get('unchanged_files', 0)}, embedded chunks: {res.get('embedded_chunks', 0)}, deleted chunks: {res.get('deleted_chunks', 0)}")
                         self.logger.info(f"  Index: {res.get('index', 'unknown')}")
                 return result
             
@@ -201,7 +247,7 @@ class RAGDemo(SICApplication):
         """Search documents using semantic similarity."""
         self.logger.info(f"\nQuery: '{query}'")
         
-        if not self.openai_api_key:
+        if not self.openai_api_key and not EMBEDDING_MODEL.startswith("local"):
             self.logger.error("  [X] OPENAI_API_KEY not set")
             return
         
@@ -226,7 +272,7 @@ class RAGDemo(SICApplication):
                     
                     # Must match the model used during ingestion
                     # to ensure compatible embedding dimensions
-                    embedding_model="text-embedding-3-large"
+                    embedding_model=EMBEDDING_MODEL
                 )
             )
             
@@ -238,7 +284,8 @@ class RAGDemo(SICApplication):
                     self.logger.info("  No results found")
                     return
                 
-                self.logger.info(f"  Found {total} results:")
+                cached = payload.get('embedding_cached', False)
+                self.logger.info(f"  Found {total} results (query embedding {'cached' if cached else 'from API'}):")
                 for idx, res in enumerate(payload.get('results', []), 1):
                     score = res.get('score', 0)
                     doc_name = os.path.basename(res.get('doc_path', 'unknown'))
@@ -276,7 +323,9 @@ class RAGDemo(SICApplication):
             queries = [
                 "What is natural language processing?",
                 "How do robots detect human faces?",
-                "Explain social robotics and human-robot interaction"
+                "Explain social robotics and human-robot interaction",
+                # Asked again: the query embedding comes from the cache
+                "What is natural language processing?"
             ]
             
             for query in queries:
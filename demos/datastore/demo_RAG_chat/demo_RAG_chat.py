@@ -4,18 +4,29 @@ from sic_framework.core import sic_logging
 
 # import device(s), service(s), and message(s) we will be using
 from sic_framework.services.datastore.redis_datastore import (
-    RedisDatastoreConf,
-    RedisDatastore,
-    IngestVectorDocsRequest,
-    QueryVectorDBRequest,
     VectorDBResultsMessage,
     DeleteNamespaceRequest,
     SICSuccessMessage
 )
 
 from sic_framework.services.llm import GPT, GPTConf, GPTRequest
+from sic_framework.services.openai_whisper_stt.whisper_stt import GetTranscript
+
+# Import custom components (pip install -e . from the repository root)
+from custom_components.answer_cache import looks_like_follow_up
+from custom_components.conversation_memory import ConversationMemory, summary_prompt
+from custom_components.speculative_retrieval import SpeculativeRetriever
+from custom_components.rag_datastore import (
+    HybridQueryRequest,
+    LookupAnswerRequest,
+    RAGDatastore,
+    RAGDatastoreConf,
+    StoreAnswerRequest,
+    SyncVectorDocsRequest,
+)
 
 # import demo-specific modules
+from openai import OpenAI
 from pathlib import Path
 import os
 
@@ -23,6 +34,19 @@ import os
 # Path inside the datastore container (see docker-compose.yml volume mount).
 DOCKER_VECTOR_DOCS_PATH = "/ingest/vector_docs"
 
+# Embedding model of the documents and questions. A local model, e.g.
+# "local:all-MiniLM-L6-v2", embeds on the CPU of the datastore without API calls
+# (needs sentence-transformers in the datastore). Run once with
+# force_recreate_index=True after switching models.
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+# Cross-encoder that reranks RERANK_CANDIDATES retrieved chunks, of which the best 3 go
+# into the prompt, e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2" (runs on the CPU of the
+# datastore, needs sentence-transformers there). None to use the search order.
+# Compare with python -m custom_components.rerank_benchmark rag_chat_demo_docs
+RERANK_MODEL = None
+RERANK_CANDIDATES = 30
+
 
 class RAGChatDemo(SICApplication):
     """
@@ -37,7 +61,15 @@ class RAGChatDemo(SICApplication):
     - Document ingestion with vector embeddings
     - Semantic search to find relevant context
     - Streaming LLM responses using the SIC GPT service
-    - Multi-turn conversation with context
+    - Multi-turn conversation within a token budget: the history holds the questions
+      and answers only (the retrieved context is sent with the current question), and
+      older turns are summarized in the background. The GPT service handles one
+      request at a time, so the summaries are requested with their own OpenAI client
+      and do not hold up the next answer
+    - Semantic answer cache: a question similar to an earlier one (by any visitor) gets
+      the earlier answer without an LLM request, as long as its source chunks did not
+      change. Only the first question of a conversation uses the cache, later ones
+      depend on the conversation before them.
 
     Prerequisites:
     1. Install dependencies: pip install social-interaction-cloud[openai-gpt]
@@ -45,17 +77,37 @@ class RAGChatDemo(SICApplication):
     3. Install Docker Desktop (services start automatically via docker-compose.yml)
 
     Manual alternative (without Docker auto-start):
-    - Start Redis Datastore: run-redis --data-dir <PATH/TO/STORAGE>
+    - Start Redis Stack: run-redis --data-dir <PATH/TO/STORAGE>
+    - Start the RAG datastore: python -m custom_components.rag_datastore (from the repository root)
     - Start the GPT service: run-gpt
+
+    Voice input (voice=True): questions are spoken into the desktop microphone and
+    transcribed by the streaming Whisper component (pip install faster-whisper, and run
+    python -m custom_components.streaming_whisper from the repository root). Retrieval
+    starts on the stable part of the partial transcripts, so the documents are usually
+    found by the time you stop speaking.
     """
 
-    def __init__(self):
+    def __init__(self, use_answer_cache=True, history_tokens=1500, summarize_history=True,
+                 voice=False):
         super(RAGChatDemo, self).__init__(
             services_compose="docker-compose.yml",
         )
+        self.use_answer_cache = use_answer_cache
+        self.voice = voice
         self.datastore = None
         self.gpt = None
-        self.conversation = []
+        # OpenAI client for the history summaries, see _summarize_history
+        self.summary_client = None
+        self.whisper = None
+        # Retrieves on partial transcripts while the user speaks (voice input only)
+        self.speculative = None
+        # Questions and answers of the chat, trimmed to history_tokens
+        self.memory = ConversationMemory(
+            max_tokens=history_tokens,
+            summarize=self._summarize_history if summarize_history else None,
+            logger=self.logger,
+        )
         
         self.set_log_level(sic_logging.DEBUG)
 
@@ -74,15 +126,20 @@ class RAGChatDemo(SICApplication):
     def setup(self):
         """Initialize connections to Redis datastore and OpenAI GPT service."""
         # Initialize Redis datastore for document storage
-        redis_conf = RedisDatastoreConf(
+        redis_conf = RAGDatastoreConf(
             host="127.0.0.1",
             port=6379,
             password="changemeplease",
             namespace="rag_chat_demo",
             version="v1",
-            developer_id=0
+            developer_id=0,
+            # Reuse the answer of a question with an embedding this similar, for a day
+            answer_cache_threshold=0.95,
+            answer_cache_ttl=24 * 3600,
         )
-        self.datastore = RedisDatastore(conf=redis_conf)
+        self.datastore = RAGDatastore(conf=redis_conf)
+        # Ingestion progress is output while the embeddings are generated
+        self.datastore.register_callback(self._on_ingest_progress)
         
         # Initialize SIC GPT service
         gpt_conf = GPTConf(
@@ -98,6 +155,20 @@ class RAGChatDemo(SICApplication):
         # Register callback for streaming responses
         self.gpt.register_callback(self._on_stream_chunk)
         
+        if self.voice:
+            from sic_framework.devices.desktop import Desktop
+            from custom_components.streaming_whisper import StreamingWhisper, StreamingWhisperConf
+            
+            desktop = Desktop()
+            # Partial transcripts more often than the pause that ends an utterance, so
+            # the whole question is usually stable before the final transcript
+            self.whisper = StreamingWhisper(
+                input_source=desktop.mic,
+                conf=StreamingWhisperConf(partial_interval=0.5, pause_threshold=0.8),
+            )
+            self.speculative = SpeculativeRetriever(self.retrieve, logger=self.logger)
+            self.whisper.register_callback(self.speculative.on_message)
+        
         self.logger.info("Services initialized")
 
     def _on_stream_chunk(self, message):
@@ -119,6 +190,16 @@ class RAGChatDemo(SICApplication):
             # Final response - print newline
             print()
 
+    def _on_ingest_progress(self, message):
+        """Log the progress of the document ingestion."""
+        if not hasattr(message, "progress"):
+            return
+        progress = message.progress
+        if progress["stage"] == "scanned":
+            self.logger.info(f"  {progress['changed_files']} of {progress['files']} files changed, {progress['chunks_to_embed']} chunks to embed")
+        elif progress["stage"] == "embedding":
+            self.logger.info(f"  Embedded {progress['chunks_embedded']}/{progress['chunks_to_embed']} chunks ({progress['elapsed']:.1f} s)")
+
     def ingest_documents(self):
         """Ingest PDF documents from the vector_docs directory."""
         docs_dir = Path(__file__).parent / "vector_docs"
@@ -134,7 +215,8 @@ class RAGChatDemo(SICApplication):
                 else str(docs_dir)
             )
             result = self.datastore.request(
-                IngestVectorDocsRequest(
+                # Only new or changed chunks are embedded, so restarts are fast
+                SyncVectorDocsRequest(
                     input_path=ingest_path,
                     openai_api_key=self.openai_api_key,
                     index_name="rag_chat_demo_docs",
@@ -142,16 +224,15 @@ class RAGChatDemo(SICApplication):
                     glob="**/*.pdf",
                     chunk_chars=800,
                     chunk_overlap=100,
-                    embedding_model="text-embedding-3-large",
-                    override_existing=True,
-                    force_recreate_index=True
+                    embedding_model=EMBEDDING_MODEL,
                 ),
-                timeout=60.0,
+                # Generous for a first ingestion, progress is logged meanwhile
+                timeout=600.0,
             )
             
             if isinstance(result, VectorDBResultsMessage) and result.payload.get('ok'):
                 for res in result.payload.get('results', []):
-                    self.logger.info(f"  Ingested {res.get('files', 0)} files -> {res.get('chunks', 0)} chunks")
+                    self.logger.info(f"  Ingested {res.get('files', 0)} files -> {res.get('chunks', 0)} chunks ({res.get('embedded_chunks', 0)} embedded)")
                 return True
             
         except Exception as e:
@@ -159,16 +240,21 @@ class RAGChatDemo(SICApplication):
             return False
 
     def search_documents(self, query: str, k: int = 3) -> list[dict]:
-        """Search for relevant document chunks using semantic similarity."""
+        """Search for relevant document chunks by meaning and by keywords."""
         try:
             result = self.datastore.request(
-                QueryVectorDBRequest(
+                HybridQueryRequest(
                     index_name="rag_chat_demo_docs",
                     query_text=query,
                     openai_api_key=self.openai_api_key,
                     k=k,
                     partition="demo",
-                    embedding_model="text-embedding-3-large"
+                    embedding_model=EMBEDDING_MODEL,
+                    # Vector and BM25 search merged by rank fusion, so names and rare
+                    # terms are found too; keyword-like queries skip the embedding
+                    mode="auto",
+                    rerank_model=RERANK_MODEL,
+                    rerank_candidates=RERANK_CANDIDATES
                 )
             )
             
@@ -180,13 +266,77 @@ class RAGChatDemo(SICApplication):
         
         return []
 
-    def ask_question(self, user_question: str, stream: bool = True) -> str:
+    def lookup_answer(self, query: str, k: int = 3) -> dict:
+        """Search like search_documents, unless a similar question was answered before."""
+        try:
+            result = self.datastore.request(
+                LookupAnswerRequest(
+                    index_name="rag_chat_demo_docs",
+                    query_text=query,
+                    openai_api_key=self.openai_api_key,
+                    k=k,
+                    partition="demo",
+                    embedding_model=EMBEDDING_MODEL,
+                    mode="auto",
+                    rerank_model=RERANK_MODEL,
+                    rerank_candidates=RERANK_CANDIDATES
+                )
+            )
+            
+            if isinstance(result, VectorDBResultsMessage):
+                return result.payload
+        
+        except Exception as e:
+            self.logger.error(f"Search error: {e}")
+        
+        return {}
+
+    def store_answer(self, query: str, results: list[dict], answer: str):
+        """Cache the answer for similar questions."""
+        try:
+            self.datastore.request(
+                StoreAnswerRequest(
+                    index_name="rag_chat_demo_docs",
+                    query_text=query,
+                    results=results,
+                    answer=answer,
+                    openai_api_key=self.openai_api_key,
+                    partition="demo",
+                    embedding_model=EMBEDDING_MODEL
+                )
+            )
+        except Exception as e:
+            self.logger.error(f"Answer cache error: {e}")
+
+    def retrieve(self, question: str) -> dict:
+        """
+        Retrieve relevant document chunks, or a cached answer. Only a question that
+        stands alone uses the cache: once there is history, or when the question is
+        vague ("how does it work?"), its answer depends on the conversation and
+        another conversation's answer to a similar question could be about
+        something else.
+        
+        Returns:
+            dict with use_cache, results and answer (None unless cached)
+        """
+        use_cache = (
+            self.use_answer_cache
+            and not self.memory.messages()
+            and not looks_like_follow_up(question)
+        )
+        if use_cache:
+            payload = self.lookup_answer(question, k=3)
+            return dict(payload, use_cache=True, answer=payload.get('answer'))
+        return {'use_cache': False, 'results': self.search_documents(question, k=3), 'answer': None}
+
+    def ask_question(self, user_question: str, stream: bool = True, retrieved: dict = None) -> str:
         """
         Answer a question using RAG: retrieve relevant docs, then generate response.
         
         Args:
             user_question: The user's question
             stream: Whether to stream the response in real-time
+            retrieved: result of retrieve(user_question) if it was already run
             
         Returns:
             AI assistant's complete response
@@ -194,9 +344,24 @@ class RAGChatDemo(SICApplication):
         self.logger.info(f"\n{'='*70}")
         self.logger.info(f"User: {user_question}")
         
-        # Step 1: Retrieve relevant document chunks
-        self.logger.info("Searching documents...")
-        search_results = self.search_documents(user_question, k=3)
+        # Step 1: Retrieve relevant document chunks, or a cached answer
+        if retrieved is None:
+            self.logger.info("Searching documents...")
+            retrieved = self.retrieve(user_question)
+        payload = retrieved
+        use_cache = retrieved['use_cache']
+        search_results = retrieved.get('results', [])
+        cached_answer = retrieved['answer']
+        
+        if cached_answer is not None:
+            self.logger.info(
+                f"  Answer cache hit (similarity {payload['similarity']:.3f}): "
+                f"{payload['cached_question']}"
+            )
+            self.logger.info("Assistant:")
+            print("  " + cached_answer)
+            self.memory.add_turn(user_question, cached_answer)
+            return cached_answer
         
         if not search_results:
             self.logger.info("  No relevant documents found - using general knowledge")
@@ -226,8 +391,9 @@ Cite your sources when using information from the context."""
         else:
             augmented_prompt = user_question
         
-        # Add to conversation history
-        self.conversation.append({"role": "user", "content": augmented_prompt})
+        # The context is only sent with this question, the history keeps the question
+        history = self.memory.messages()
+        self.logger.debug(f"History: {len(history)} messages, ~{self.memory.tokens()} tokens")
         
         # Step 3: Generate response using SIC GPT service with streaming
         self.logger.info("Assistant:")
@@ -235,7 +401,7 @@ Cite your sources when using information from the context."""
         try:
             request = GPTRequest(
                 prompt=augmented_prompt,
-                role_messages=self.conversation,
+                role_messages=history,
                 stream=stream  # Enable streaming for real-time token display
             )
             
@@ -249,12 +415,12 @@ Cite your sources when using information from the context."""
                 # Non-streaming: print complete response
                 print(response)
             
-            # Add assistant response to conversation history
-            self.conversation.append({"role": "assistant", "content": response})
+            # Add the question and answer to the history, trimmed to its token budget
+            self.memory.add_turn(user_question, response)
             
-            # Keep conversation history manageable (last 8 messages = 4 exchanges)
-            if len(self.conversation) > 8:
-                self.conversation = self.conversation[-8:]
+            # An answer without retrieved context says nothing about the documents
+            if use_cache and search_results:
+                self.store_answer(user_question, search_results, response)
             
             return response
             
@@ -262,6 +428,23 @@ Cite your sources when using information from the context."""
             self.logger.error(f"\nError generating response: {e}")
             return "I'm sorry, I encountered an error generating a response."
 
+    def _summarize_history(self, summary, turns):
+        """
+        Fold turns dropped from the history into its summary (on a background thread).
+
+        Not through the GPT service: it serves one request at a time, so the next
+        question's answer would wait for the summary.
+        """
+        if self.summary_client is None:
+            self.summary_client = OpenAI(api_key=self.openai_api_key)
+        reply = self.summary_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": summary_prompt(summary, turns)}],
+            max_tokens=250,
+            temperature=0.2,
+        )
+        return reply.choices[0].message.content.strip()
+
     def run_interactive_chat(self):
         """Run an interactive chat session where users ask questions."""
         self.logger.info("\n" + "="*70)
@@ -275,6 +458,10 @@ Cite your sources when using information from the context."""
         
         try:
             while not self.shutdown_event.is_set():
+                if self.voice:
+                    self.voice_turn()
+                    continue
+                
                 user_input = input("You: ").strip()
                 
                 if user_input.lower() in {"exit", "quit", "q"}:
@@ -292,6 +479,20 @@ Cite your sources when using information from the context."""
         except EOFError:
             self.logger.info("\nChat session ended")
 
+    def voice_turn(self):
+        """Answer one spoken question, retrieving while it is being spoken."""
+        self.speculative.reset()
+        self.logger.info("Talk now!")
+        transcript = self.whisper.request(GetTranscript(timeout=10, phrase_time_limit=30))
+        question = transcript.transcript.strip()
+        if not question:
+            return
+        print(f"You: {question}")
+        # Usually the speculative retrieval of the same text, which is done already
+        retrieved = self.speculative.result(question)
+        self.ask_question(question, stream=True, retrieved=retrieved)
+        print()
+
     def run(self):
         """Main demo flow."""
         try:
@@ -10,8 +10,6 @@ from sic_framework.core.message_python2 import (
 )
 
 from sic_framework.devices.common_desktop.desktop_camera import DesktopCameraConf
-from sic_framework.devices.common_desktop.desktop_speakers import SpeakersConf
-from sic_framework.devices.desktop import Desktop
 from sic_framework.services.dialogflow.dialogflow import (
     Dialogflow,
     DialogflowConf,
@@ -25,6 +23,12 @@ from sic_framework.services.google_tts.google_tts import (
 )
 from sic_framework.services.llm import GPT, GPTConf, GPTRequest
 
+# Import custom components (pip install -e . from the repository root)
+from custom_components.echo_gate import EchoGate
+from custom_components.resampling_speakers import ResamplingDesktop
+from custom_components.tts_cache import CachedTTS
+from custom_components.turn_latency import TurnLatencyTracker
+
 # Import demo-specific modules
 from os.path import abspath, join
 from subprocess import call
@@ -80,6 +84,13 @@ class ConversationApp(SICApplication):
     - run-dialogflow
     - run-google-tts
     - run-gpt
+    - python -m custom_components.echo_gate (from the repository root)
+
+    The microphone reaches Dialogflow through an echo gate, which silences the audio
+    recorded while the app is speaking, so its own voice is not sent to Dialogflow.
+
+    The LLM conversation records how long each step of a turn takes (speech recognition,
+    GPT, text-to-speech, playback) in latency_logs/ and logs percentiles at the end.
     """
 
     def __init__(self, google_keyfile_path, local_tts=False):
@@ -101,10 +112,12 @@ class ConversationApp(SICApplication):
         self.face_rec = None
         self.gpt = None
         self.dialogflow = None
+        self.echo_gate = None
         self.can_listen = True
         self.session_id = np.random.randint(10000)
         self.local_tts = local_tts
         self.tts = None
+        self.latency = TurnLatencyTracker(session_id=self.session_id)
 
         # Configure logging
         self.set_log_level(sic_logging.INFO)
@@ -124,19 +137,16 @@ class ConversationApp(SICApplication):
         # Create camera configuration using fx and fy to resize the image along x- and y-axis, and possibly flip image
         camera_conf = DesktopCameraConf(fx=self.fx, fy=self.fy, flip=self.flip)
 
-        # Connect Desktop
-        self.desktop = (
-            Desktop(camera_conf=camera_conf)
-            if self.local_tts
-            else Desktop(speakers_conf=SpeakersConf(sample_rate=24000))
-        )
+        # Connect Desktop, its speakers play the TTS audio at whatever sample rate it has
+        self.desktop = ResamplingDesktop(camera_conf=camera_conf)
 
         # connect to services
         if not self.local_tts:  # If Google TTS is used, initiate it.
             tts_conf = Text2SpeechConf(
                 keyfile_json=json.load(open(self.google_keyfile_path))
             )
-            self.tts = Text2Speech(conf=tts_conf)
+            # Fixed prompts are synthesized once and then served from the local TTS cache
+            self.tts = CachedTTS(Text2Speech(conf=tts_conf), provider="google")
         self.face_rec = FaceDetection(input_source=self.desktop.camera)
 
         # Send back the outputs to this program
@@ -158,9 +168,12 @@ class ConversationApp(SICApplication):
             language=self.language,
         )
 
+        # Silence the microphone while the app speaks (and shortly after)
+        self.echo_gate = EchoGate(input_source=self.desktop.mic)
+
         # initiate Dialogflow object
         self.dialogflow = Dialogflow(
-            ip="localhost", conf=dialogflow_conf, input_source=self.desktop.mic
+            ip="localhost", conf=dialogflow_conf, input_source=self.echo_gate
         )
 
         # register a callback function to act upon arrival of recognition_result
@@ -184,20 +197,25 @@ class ConversationApp(SICApplication):
         Returns:
             None
         """
+        self.latency.mark_recognition(message)
         if message.response:
             if message.response.recognition_result.is_final:
                 print("Transcript:", message.response.recognition_result.transcript)
 
     def speak(self, text):
         if self.local_tts:
-            call(["espeak", "-s140 -ven+18 -z", text])
+            with self.echo_gate.playing():
+                self.latency.mark("playback_start")
+                call(["espeak", "-s140 -ven+18 -z", text])
         else:
             # Request speech synthesis from Google TTS
             reply = self.tts.request(
                 GetSpeechRequest(text=text, voice_name="en-US-Standard-C")
             )
-            self.desktop.speakers.request(
-                AudioRequest(reply.waveform, reply.sample_rate)
+            self.latency.mark("tts_first_byte")
+            self.latency.mark("playback_start")
+            self.echo_gate.play(
+                self.desktop.speakers, AudioRequest(reply.waveform, reply.sample_rate)
             )
 
     def _kiosk_run_facedetection(self):
@@ -272,8 +290,10 @@ class ConversationApp(SICApplication):
 
         try:
             self.speak("What is your favorite hobby?")
+            self.latency.start_turn()
             reply = self.dialogflow.request(GetIntentRequest(self.session_id))
             if reply.response.query_result.query_text:
+                self.latency.mark("request_start")
                 gpt_response = self.gpt.request(
                     GPTRequest(
                         f"You are a chat bot. The bot just asked about a hobby of the user make a brief "
@@ -282,12 +302,15 @@ class ConversationApp(SICApplication):
                         f'This was the input by the user: "{reply.response.query_result.query_text}"'
                     )
                 )
+                self.latency.mark("first_token")
                 self.speak(gpt_response.response)
+            self.latency.end_turn(transcript=reply.response.query_result.query_text)
 
             self.logger.info("Chat completed")
         except Exception as e:
             self.logger.error("Exception: {}".format(e))
         finally:
+            self.latency.log_summary(self.logger)
             self.shutdown()
 
 
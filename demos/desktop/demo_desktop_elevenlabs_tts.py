@@ -7,8 +7,6 @@ from sic_framework.core import sic_logging
 # Import devices, messages, and services we will be using
 from sic_framework.core.message_python2 import AudioRequest
 from sic_framework.core.sic_application import SICApplication
-from sic_framework.devices.common_desktop.desktop_speakers import SpeakersConf
-from sic_framework.devices.desktop import Desktop
 from sic_framework.services.elevenlabs_tts.elevenlabs_tts import (
     ElevenLabsSpeechResult,
     ElevenLabsTTS,
@@ -16,6 +14,10 @@ from sic_framework.services.elevenlabs_tts.elevenlabs_tts import (
     GetElevenLabsSpeechRequest,
 )
 
+# Import custom components (pip install -e . from the repository root)
+from custom_components.resampling_speakers import ResamplingDesktop
+from custom_components.tts_cache import CachedTTS
+
 
 class ElevenLabsTTSDemo(SICApplication):
     """
@@ -59,7 +61,15 @@ class ElevenLabsTTSDemo(SICApplication):
             # model_id="eleven_flash_v2_5",
             # sample_rate=22050,
         )
-        self.tts = ElevenLabsTTS(conf=tts_conf)
+        # Repeated runs are served from the local TTS cache instead of calling ElevenLabs
+        self.tts = CachedTTS(
+            ElevenLabsTTS(conf=tts_conf),
+            provider="elevenlabs",
+            sample_rate=tts_conf.sample_rate,
+        )
+
+        # The speakers open once at the device rate and resample the audio from ElevenLabs
+        self.desktop = ResamplingDesktop()
 
     def run(self):
         self.logger.info("Starting ElevenLabs TTS Demo")
@@ -72,10 +82,6 @@ class ElevenLabsTTSDemo(SICApplication):
                 )
             )
 
-            self.desktop = Desktop(
-                speakers_conf=SpeakersConf(sample_rate=reply.sample_rate)
-            )
-
             self.desktop.speakers.request(
                 AudioRequest(reply.waveform, reply.sample_rate)
             )
@@ -3,15 +3,17 @@ from sic_framework.core.sic_application import SICApplication
 from sic_framework.core import sic_logging
 
 # Import the device(s), service(s), and message(s) we will be using
-from sic_framework.devices.desktop import Desktop
 from sic_framework.services.google_tts.google_tts import (
     GetSpeechRequest,
     Text2Speech,
     Text2SpeechConf,
 )
-from sic_framework.devices.common_desktop.desktop_speakers import SpeakersConf
 from sic_framework.core.message_python2 import AudioRequest
 
+# Import custom components (pip install -e . from the repository root)
+from custom_components.resampling_speakers import ResamplingDesktop
+from custom_components.tts_cache import CachedTTS
+
 # Import demo-specific modules
 from os.path import abspath, join
 import json
@@ -59,7 +61,11 @@ class GoogleTTSDemo(SICApplication):
         tts_conf = Text2SpeechConf(
             keyfile_json=json.load(open(self.google_keyfile_path))
         )
-        self.tts = Text2Speech(conf=tts_conf)
+        # Repeated runs are served from the local TTS cache instead of calling Google
+        self.tts = CachedTTS(Text2Speech(conf=tts_conf), provider="google")
+
+        # The speakers open once at the device rate and resample the audio from Google
+        self.desktop = ResamplingDesktop()
 
     def run(self):
         """Main application logic."""
@@ -73,11 +79,6 @@ class GoogleTTSDemo(SICApplication):
                 )
             )
 
-            # Make sure that the sample rate of the speakers is the same as the sample rate of the audio from Google
-            self.desktop = Desktop(
-                speakers_conf=SpeakersConf(sample_rate=reply.sample_rate)
-            )
-
             # Play the audio through the speakers
             response = self.desktop.speakers.request(
                 AudioRequest(reply.waveform, reply.sample_rate)
@@ -6,12 +6,19 @@ from sic_framework.core import sic_logging
 from sic_framework.core.message_python2 import AudioRequest
 from sic_framework.devices.common_desktop.desktop_speakers import SpeakersConf
 from sic_framework.devices.desktop import Desktop
-from sic_framework.services.elevenlabs_tts.elevenlabs_tts import (
-    ElevenLabsTTS, 
-    ElevenLabsTTSConf, 
-    GetElevenLabsSpeechRequest
-    )
+from sic_framework.services.elevenlabs_tts.elevenlabs_tts import ElevenLabsTTSConf
 from sic_framework.services.llm import GPT, GPTConf, GPTRequest
+from sic_framework.services.openai_whisper_stt.whisper_stt import GetTranscript
+from sic_framework.services.voice_detection.voice_detection import (
+    VoiceDetection,
+    VoiceDetectionConf,
+)
+
+# Import custom components (pip install -e . from the repository root)
+from custom_components.barge_in import BargeInController
+from custom_components.elevenlabs_streaming_tts import ElevenLabsStreamingTTS
+from custom_components.pre_roll_whisper import PreRollWhisper, PreRollWhisperConf
+from custom_components.sentence_segmenter import SentenceSegmenter
 
 # import demo-specific modules
 from dotenv import load_dotenv
@@ -19,13 +26,21 @@ from os import environ
 import threading
 import queue
 import os
-import re
-
-# Matches whitespace following a sentence-ending punctuation mark
-_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
 
 SAMPLE_RATE = 22050
 
+# How many synthesized audio chunks may wait for playback. Bounds how far synthesis
+# runs ahead of the speakers (ElevenLabs sends a chunk every few words).
+AUDIO_QUEUE_CHUNKS = 32
+
+# Speech from before the transcription request that Whisper transcribes too. Barge-in
+# is detected after min_speech_ms of speech and the turn is then wound down, so this
+# covers the start of the interrupting sentence.
+BARGE_IN_PRE_ROLL_MS = 1500
+
+# Queued by the synthesis worker after the last sentence of a turn
+_END_OF_TURN = object()
+
 
 class GPTElevenLabsStreamingDemo(SICApplication):
     """
@@ -33,19 +48,34 @@ class GPTElevenLabsStreamingDemo(SICApplication):
 
     As GPT streams tokens, complete sentences are detected and sent to
     ElevenLabs immediately for synthesis, so audio playback starts before
-    GPT has finished generating the full response.
+    GPT has finished generating the full response. ElevenLabs audio is
+    streamed over its websocket endpoint and every chunk is played as soon
+    as it arrives. Synthesis and playback run in separate threads: while one
+    sentence plays, the next ones are already being synthesized, so there is
+    no gap between sentences.
 
     Requirements:
     1. pip install social-interaction-cloud[openai-gpt,elevenlabs-tts]
-    2. OPENAI_API_KEY and ELEVENLABS_API_KEY in conf/.env
-    3. Install Docker Desktop (services start automatically via docker-compose.yml)
+    2. pip install -e . (from the repository root, for custom_components)
+    3. OPENAI_API_KEY and ELEVENLABS_API_KEY in conf/.env
+    4. Install Docker Desktop (services start automatically via docker-compose.yml)
 
     Manual alternative (without Docker auto-start):
     - run-gpt
-    - run-elevenlabs-tts
+    - python -m custom_components.elevenlabs_streaming_tts (from the repository root)
+
+    OPTIONAL: with barge_in=True you talk instead of type, and the assistant stops
+    talking as soon as you interrupt it: playback stops, queued sentences and running
+    synthesis are cancelled, and Whisper listens to you right away. Whisper keeps the
+    last BARGE_IN_PRE_ROLL_MS of microphone audio, so the words you interrupted with
+    are transcribed too. Use headphones, otherwise the microphone hears the assistant
+    and it interrupts itself. This needs the VoiceDetection and pre-roll Whisper
+    services to be running:
+    - run-voice-detection
+    - python -m custom_components.pre_roll_whisper (from the repository root)
     """
 
-    def __init__(self, api_key=None, env_path=None):
+    def __init__(self, api_key=None, env_path=None, barge_in=False):
         super(GPTElevenLabsStreamingDemo, self).__init__(
             services_compose="docker-compose.yml",
         )
@@ -56,10 +86,16 @@ class GPTElevenLabsStreamingDemo(SICApplication):
         self.gpt = None
         self.tts = None
         self.desktop = None
+        self.barge_in = barge_in
+        self.whisper = None
+        self.voice_detection = None
+        self.barge_in_controller = None
 
-        self._text_buffer = ""
+        self._segmenter = SentenceSegmenter()
         self._sentence_queue = queue.Queue()
+        self._audio_queue = queue.Queue(maxsize=AUDIO_QUEUE_CHUNKS)
         self._gpt_done = threading.Event()
+        self._cancel_event = threading.Event()
 
         self.set_log_level(sic_logging.INFO)
 
@@ -93,7 +129,7 @@ class GPTElevenLabsStreamingDemo(SICApplication):
             default_mode="ws",
             sample_rate=SAMPLE_RATE,
         )
-        self.tts = ElevenLabsTTS(conf=tts_conf)
+        self.tts = ElevenLabsStreamingTTS(conf=tts_conf)
 
         conf = GPTConf(
             openai_key=environ["OPENAI_API_KEY"],
@@ -106,41 +142,70 @@ class GPTElevenLabsStreamingDemo(SICApplication):
         self.gpt = GPT(conf=conf)
         self.gpt.register_callback(self._on_stream_chunk)
 
+        if self.barge_in:
+            # Frequent messages, so the controller hears that the user keeps talking
+            self.voice_detection = VoiceDetection(
+                input_source=self.desktop.mic,
+                conf=VoiceDetectionConf(message_frequency=10),
+            )
+            self.barge_in_controller = BargeInController(
+                self.voice_detection, on_barge_in=self._on_barge_in, min_speech_ms=300
+            )
+            # The interrupting speech started before the transcription request
+            self.whisper = PreRollWhisper(
+                input_source=self.desktop.mic,
+                conf=PreRollWhisperConf(
+                    openai_key=environ["OPENAI_API_KEY"],
+                    pre_roll_ms=BARGE_IN_PRE_ROLL_MS,
+                ),
+            )
+
     def _on_stream_chunk(self, message):
         """
         Fires for every GPT response event.
 
-        Intermediate chunks (is_stream_chunk=True) are buffered and split
-        on sentence boundaries. The final event flushes any remaining text.
+        Intermediate chunks (is_stream_chunk=True) are fed to the sentence
+        segmenter, which only scans the new text. The first segment may be a
+        short clause so audio starts early. The final event flushes any
+        remaining text.
         """
         if not hasattr(message, "response"):
             return
+        if self._cancel_event.is_set():
+            # The user interrupted, the rest of the reply is not spoken
+            return
 
         is_chunk = getattr(message, "is_stream_chunk", False)
 
         if is_chunk:
             print(message.response, end="", flush=True)
-            self._text_buffer += message.response
-
-            # Split on sentence boundaries; keep trailing incomplete fragment
-            parts = _SENTENCE_BOUNDARY.split(self._text_buffer)
-            for sentence in parts[:-1]:
-                sentence = sentence.strip()
-                if sentence:
-                    self._sentence_queue.put(sentence)
-            self._text_buffer = parts[-1]
+            for sentence in self._segmenter.feed(message.response):
+                self._sentence_queue.put(sentence)
         else:
             # Stream finished — flush whatever is left in the buffer
-            remainder = self._text_buffer.strip()
-            if remainder:
-                self._sentence_queue.put(remainder)
-            self._text_buffer = ""
+            for sentence in self._segmenter.flush():
+                self._sentence_queue.put(sentence)
             print()
             self._gpt_done.set()
 
-    def _speak_sentences(self):
-        """Worker thread: synthesize and play each queued sentence in order."""
-        while True:
+    def _put_unless_cancelled(self, q, item):
+        """Put an item on a bounded queue, giving up when the turn is cancelled."""
+        while not self._cancel_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _synthesize_sentences(self):
+        """
+        Synthesis worker: turn queued sentences into audio chunks, in order.
+
+        Runs at most AUDIO_QUEUE_CHUNKS chunks ahead of playback, because
+        the audio queue is bounded. Ends the turn by queueing _END_OF_TURN.
+        """
+        while not self._cancel_event.is_set():
             try:
                 sentence = self._sentence_queue.get(timeout=0.1)
             except queue.Empty:
@@ -148,22 +213,71 @@ class GPTElevenLabsStreamingDemo(SICApplication):
                     break
                 continue
 
-            self.logger.info("Speaking: {}".format(sentence))
+            self.logger.info("Synthesizing: {}".format(sentence))
+            try:
+                for chunk in self.tts.stream(sentence):
+                    if not self._put_unless_cancelled(self._audio_queue, chunk):
+                        return
+            except Exception as e:
+                self.logger.error("TTS error: {}".format(e))
+
+        self._put_unless_cancelled(self._audio_queue, _END_OF_TURN)
+
+    def _play_audio(self):
+        """Playback worker: play synthesized chunks in the order they were queued."""
+        while not self._cancel_event.is_set():
+            try:
+                item = self._audio_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END_OF_TURN:
+                break
+
             try:
-                reply = self.tts.request(
-                    GetElevenLabsSpeechRequest(text=sentence, mode="batch")
-                )
-                self.logger.info(
-                    "Got {} bytes, playing audio...".format(
-                        len(reply.waveform)
-                    )
-                )
                 self.desktop.speakers.request(
-                    AudioRequest(reply.waveform, reply.sample_rate)
+                    AudioRequest(item.waveform, item.sample_rate, is_stream=True)
                 )
-                self.logger.info("Playback done.")
             except Exception as e:
-                self.logger.error("TTS error: {}".format(e))
+                self.logger.error("Playback error: {}".format(e))
+
+    def cancel_speech(self):
+        """
+        Stop the current turn: pending sentences and synthesized audio are dropped.
+
+        The chunk that is currently playing is finished by the speakers.
+        """
+        self._cancel_event.set()
+        for q in (self._sentence_queue, self._audio_queue):
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _on_barge_in(self):
+        """The user talks over the assistant: stop speaking and let them talk."""
+        print()
+        self.logger.info("Interrupted, listening...")
+        self.cancel_speech()
+        # Also stop the sentence that ElevenLabs is synthesizing right now
+        self.tts.cancel()
+
+    def _next_user_input(self):
+        """Typed input, or a Whisper transcript when barge-in is enabled."""
+        if not self.barge_in:
+            return input("You: ").strip()
+
+        if not self.barge_in_controller.barged_in.is_set():
+            self.logger.info("Talk now!")
+        try:
+            transcript = self.whisper.request(
+                GetTranscript(timeout=10, phrase_time_limit=30)
+            ).transcript.strip()
+        except Exception as e:
+            self.logger.warning("No transcript: {}".format(e))
+            return ""
+        print("You: {}".format(transcript))
+        return transcript
 
     def run(self):
         self.logger.info(
@@ -172,36 +286,45 @@ class GPTElevenLabsStreamingDemo(SICApplication):
 
         try:
             while not self.shutdown_event.is_set():
-                user_input = input("You: ").strip()
-                if user_input.lower() in {"quit", "exit", "q"}:
+                user_input = self._next_user_input()
+                if user_input.lower().rstrip(".!") in {"quit", "exit", "q"}:
                     break
                 if not user_input:
                     continue
 
                 # Reset per-turn state
-                self._text_buffer = ""
+                self.cancel_speech()
+                self._segmenter.reset()
                 self._gpt_done.clear()
-                while not self._sentence_queue.empty():
-                    try:
-                        self._sentence_queue.get_nowait()
-                    except queue.Empty:
-                        break
-
-                # Audio thread starts immediately, consumes queued sentences
-                audio_thread = threading.Thread(
-                    target=self._speak_sentences, daemon=True
-                )
-                audio_thread.start()
+                self._cancel_event.clear()
+
+                # Both workers start immediately: synthesis consumes queued
+                # sentences, playback consumes synthesized audio
+                workers = [
+                    threading.Thread(target=self._synthesize_sentences, daemon=True),
+                    threading.Thread(target=self._play_audio, daemon=True),
+                ]
+                for worker in workers:
+                    worker.start()
+
+                if self.barge_in_controller is not None:
+                    self.barge_in_controller.arm()
 
                 print("AI: ", end="", flush=True)
                 self.gpt.request(GPTRequest(prompt=user_input, stream=True))
 
-                # Wait for all audio to finish before next turn
-                audio_thread.join()
+                # Wait for all audio to finish (or the user to interrupt) before
+                # the next turn
+                for worker in workers:
+                    worker.join()
+
+                if self.barge_in_controller is not None:
+                    self.barge_in_controller.disarm()
 
         except Exception as e:
             self.logger.error("Exception: {}".format(e))
         finally:
+            self.cancel_speech()
             self.shutdown()
 
 
@@ -9,9 +9,15 @@ from sic_framework.services.streaming_sortformer import (
     GetDiarizationRequest,
     STMSortformer,
     STMSortformerConf,
-    STMSortformerUtils,
 )
 
+# Import custom components (pip install -e . from the repository root)
+from custom_components.diarization_timeline import DiarizationTimeline
+
+# Import demo-specific modules
+from datetime import datetime
+import time
+
 
 class STMSortformerDemo(SICApplication):
     def __init__(self):
@@ -21,7 +27,7 @@ class STMSortformerDemo(SICApplication):
         self.desktop = None
         self.desktop_mic = None
         self.sortformer = None
-        self.utils = None
+        self.timeline = None
 
         # Configure logging
         self.set_log_level(sic_logging.INFO)
@@ -38,7 +44,9 @@ class STMSortformerDemo(SICApplication):
         """Initialize and configure Streaming Sortformer."""
         self.logger.info("Setting up Streaming Sortformer...")
 
-        self.utils = STMSortformerUtils()
+        # Keeps the merged segments per speaker and reports only what changed
+        self.timeline = DiarizationTimeline(gap_threshold=0.75)
+        self.timeline.subscribe(self.on_timeline_change)
 
         # initialize the desktop device to get the microphone
         mic_conf = MicrophoneConf(sample_rate=16000, device_index=0)
@@ -51,6 +59,23 @@ class STMSortformerDemo(SICApplication):
             conf=sortformer_conf, input_source=self.desktop_mic
         )
 
+    @staticmethod
+    def _clock(ts):
+        return datetime.fromtimestamp(ts).strftime("%H:%M:%S.%f")[:-3]
+
+    def on_timeline_change(self, added, removed):
+        """Print the segments that changed with the latest diarization result."""
+        for sign, segments in (("-", removed), ("+", added)):
+            for segment in segments:
+                print(
+                    "  {} Speaker {} {} - {}".format(
+                        sign,
+                        segment.speaker + 1,
+                        self._clock(segment.start),
+                        self._clock(segment.end),
+                    )
+                )
+
     def run(self):
         """Main application loop."""
         self.logger.info("Starting Sortformer Demo")
@@ -59,10 +84,14 @@ class STMSortformerDemo(SICApplication):
         try:
             while not self.shutdown_event.is_set():
                 result = self.sortformer.request(GetDiarizationRequest())
-                print(self.utils.show_diar_df(result.speaker_timestamps))
+                self.timeline.update(result.speaker_timestamps)
         except Exception as e:
             self.logger.error("Exception: {}".format(e))
         finally:
+            # Speaking time per speaker over the last minute
+            now = time.time()
+            for speaker, seconds in self.timeline.who_spoke(now - 60, now).items():
+                print("Speaker {}: {:.1f}s".format(speaker + 1, seconds))
             self.shutdown()
 
 
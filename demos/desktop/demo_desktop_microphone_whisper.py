@@ -11,6 +11,9 @@ from sic_framework.services.openai_whisper_stt.whisper_stt import (
     WhisperConf,
 )
 
+# Import custom components (pip install -e . from the repository root)
+from custom_components.vad_gate import VADGate, VADGateConf
+
 # Import demo-specific modules
 from os.path import abspath, join
 from os import environ
@@ -32,15 +35,21 @@ class WhisperDemo(SICApplication):
     NOTE: Requires you to have a secret OpenAI key.
     You can generate your personal env api key here: https://platform.openai.com/api-keys
     Put your key in a .env file in the conf/env folder as OPENAI_API_KEY="your key"
+
+    OPTIONAL: with use_vad_gate=True, only audio in which voice activity is detected is sent
+    to Whisper (plus a short pre-roll). This needs the VAD gate component to be running:
+    python -m custom_components.vad_gate (from the repository root)
     """
 
-    def __init__(self):
+    def __init__(self, use_vad_gate=False):
         # Call parent constructor (handles singleton initialization)
         super(WhisperDemo, self).__init__()
 
         # Demo-specific initialization
         self.desktop = None
         self.whisper = None
+        self.use_vad_gate = use_vad_gate
+        self.vad_gate = None
 
         # Configure logging
         self.set_log_level(sic_logging.INFO)
@@ -76,11 +85,26 @@ class WhisperDemo(SICApplication):
         # create a .env file in the conf/ folder and add your key there like this:
         # OPENAI_API_KEY="your key"
 
+        audio_source = self.desktop.mic
+        if self.use_vad_gate:
+            # Forward speech only, including 500 ms of audio before the detected onset
+            self.vad_gate = VADGate(
+                input_source=self.desktop.mic, conf=VADGateConf(pre_roll_ms=500)
+            )
+            audio_source = self.vad_gate
+
         whisper_conf = WhisperConf(openai_key=environ["OPENAI_API_KEY"])
-        self.whisper = SICWhisper(input_source=self.desktop.mic, conf=whisper_conf)
+        self.whisper = SICWhisper(input_source=audio_source, conf=whisper_conf)
 
         # Alternatively, use local model:
-        # self.whisper = SICWhisper(input_source=self.desktop.mic)
+        # self.whisper = SICWhisper(input_source=audio_source)
+
+        # Or the streaming int8 CPU model, which also outputs partial transcripts to on_transcript
+        # (run python -m custom_components.streaming_whisper from the repository root):
+        # from custom_components.streaming_whisper import StreamingWhisper, StreamingWhisperConf
+        # self.whisper = StreamingWhisper(
+        #     input_source=audio_source, conf=StreamingWhisperConf(model_size="base.en")
+        # )
 
         time.sleep(1)
 
@@ -11,6 +11,9 @@ from sic_framework.services.dialogflow.dialogflow import (
     GetIntentRequest,
 )
 
+# Import custom components (pip install -e . from the repository root)
+from custom_components.echo_gate import EchoGate
+
 # Import demo-specific modules
 from os.path import abspath, join
 import numpy as np
@@ -31,6 +34,10 @@ class NaoDialogflowDemo(SICApplication):
     1. pip install --upgrade social-interaction-cloud[dialogflow]
         Note: on macOS you might need use quotes pip install --upgrade "social-interaction-cloud[...]"
     2. run-dialogflow
+    3. python -m custom_components.echo_gate (from the repository root)
+
+    NAO's microphone reaches Dialogflow through an echo gate, which silences the audio
+    recorded while NAO is speaking, so NAO does not respond to its own voice.
     """
 
     def __init__(self, google_keyfile_path):
@@ -42,6 +49,7 @@ class NaoDialogflowDemo(SICApplication):
         self.google_keyfile_path = google_keyfile_path
         self.nao = None
         self.dialogflow = None
+        self.echo_gate = None
         self.session_id = np.random.randint(10000)
 
         self.set_log_level(sic_logging.INFO)
@@ -79,7 +87,8 @@ class NaoDialogflowDemo(SICApplication):
         # # Initialize NAO
         self.nao = Nao(ip=self.nao_ip)
 
-        nao_mic = self.nao.mic
+        # Silence the microphone while NAO speaks (and shortly after)
+        self.echo_gate = EchoGate(input_source=self.nao.mic)
 
         # Load the key json file
         keyfile_json = json.load(open(self.google_keyfile_path))
@@ -89,16 +98,21 @@ class NaoDialogflowDemo(SICApplication):
 
         self.logger.info("Initializing Dialogflow...")
         # Initiate Dialogflow object
-        self.dialogflow = Dialogflow(ip="localhost", conf=conf, input_source=nao_mic)
+        self.dialogflow = Dialogflow(ip="localhost", conf=conf, input_source=self.echo_gate)
 
         # Register a callback function to act upon arrival of recognition_result
         self.dialogflow.register_callback(self.on_dialog)
 
+    def say(self, text):
+        """Let NAO speak with the microphone gated."""
+        with self.echo_gate.playing():
+            self.nao.tts.request(NaoqiTextToSpeechRequest(text))
+
     def run(self):
         """Main application loop."""
         try:
             # Demo starts
-            self.nao.tts.request(NaoqiTextToSpeechRequest("Hello, who are you?"))
+            self.say("Hello, who are you?")
             self.logger.info(" -- Ready -- ")
 
             while not self.shutdown_event.is_set():
@@ -110,7 +124,7 @@ class NaoDialogflowDemo(SICApplication):
                 if reply.fulfillment_message:
                     text = reply.fulfillment_message
                     self.logger.info("Reply: {}".format(text))
-                    self.nao.tts.request(NaoqiTextToSpeechRequest(text))
+                    self.say(text)
         except Exception as e:
             self.logger.error("Exception: {}".format(e=e))
         finally:
@@ -9,11 +9,15 @@ from sic_framework.devices.common_naoqi.naoqi_motion import (
     NaoqiAnimationRequest,
 )
 from sic_framework.devices.nao import NaoqiTextToSpeechRequest
-from sic_framework.services.dialogflow_cx.dialogflow_cx import (
-    DetectIntentRequest,
-    DialogflowCX,
-    DialogflowCXConf,
+from sic_framework.services.dialogflow_cx.dialogflow_cx import DetectIntentRequest
+
+# Import custom components (pip install -e . from the repository root)
+from custom_components.echo_gate import EchoGate
+from custom_components.pre_roll_dialogflow_cx import (
+    PreRollDialogflowCX,
+    PreRollDialogflowCXConf,
 )
+from custom_components.turn_latency import TurnLatencyTracker
 
 # Import demo-specific modules
 from os.path import abspath, join
@@ -41,7 +45,21 @@ class NaoDialogflowCXDemo(SICApplication):
 
     3. The Dialogflow CX service needs to be running:
        - pip install social-interaction-cloud[dialogflow-cx]
-       - run-dialogflow-cx
+       - pip install -e . (from the repository root, for custom_components)
+       - python -m custom_components.pre_roll_dialogflow_cx (from the repository root)
+       - python -m custom_components.echo_gate (from the repository root)
+
+    The pre-roll variant of Dialogflow CX also recognizes the last half second of audio
+    before each request, so an answer that starts right after NAO stops talking is
+    not cut off. Set pre_roll_ms=0 to compare: the share of turns without a transcript
+    is logged when the demo stops. NAO's microphone reaches Dialogflow CX through an
+    echo gate, which silences the audio recorded while NAO is speaking, so neither the
+    request nor its pre-roll contains NAO's own voice.
+
+    The time from the final transcript to the agent's reply and NAO starting to speak
+    is recorded per turn in latency_logs/, with percentiles logged when the demo
+    stops. Dialogflow CX does not report the end of your speech, so the time it takes
+    to recognize it is not included.
 
     Note: This uses Dialogflow CX (v3), which is different from Dialogflow ES (v2).
     """
@@ -57,7 +75,11 @@ class NaoDialogflowCXDemo(SICApplication):
         )
         self.nao = None
         self.dialogflow_cx = None
+        self.echo_gate = None
         self.session_id = np.random.randint(10000)
+        self.turns = 0
+        self.turns_without_transcript = 0
+        self.latency = TurnLatencyTracker(session_id=self.session_id)
 
         self.set_log_level(sic_logging.INFO)
 
@@ -79,6 +101,7 @@ class NaoDialogflowCXDemo(SICApplication):
         Returns:
             None
         """
+        self.latency.mark_recognition(message)
         if message.response:
             if (
                 hasattr(message.response, "recognition_result")
@@ -97,7 +120,9 @@ class NaoDialogflowCXDemo(SICApplication):
 
         # Initialize NAO
         self.nao = Nao(ip=self.nao_ip)
-        nao_mic = self.nao.mic
+
+        # Silence the microphone while NAO speaks (and shortly after)
+        self.echo_gate = EchoGate(input_source=self.nao.mic)
 
         self.logger.info("Initializing Dialogflow CX...")
 
@@ -112,35 +137,48 @@ class NaoDialogflowCXDemo(SICApplication):
 
         # Create configuration for Dialogflow CX
         # Note: NAO uses 16000 Hz sample rate (not 44100 like desktop)
-        dialogflow_conf = DialogflowCXConf(
+        dialogflow_conf = PreRollDialogflowCXConf(
             keyfile_json=keyfile_json,
             agent_id=agent_id,
             location=location,
             sample_rate_hertz=16000,  # NAO's microphone sample rate
             language="en",
+            pre_roll_ms=500,  # audio from before each request that is recognized too
         )
 
         # Initialize Dialogflow CX with NAO's microphone as input
-        self.dialogflow_cx = DialogflowCX(conf=dialogflow_conf, input_source=nao_mic)
+        self.dialogflow_cx = PreRollDialogflowCX(
+            conf=dialogflow_conf, input_source=self.echo_gate
+        )
 
         self.logger.info("Initialized Dialogflow CX... registering callback function")
         # Register a callback function to handle recognition results
         self.dialogflow_cx.register_callback(callback=self.on_recognition)
 
+    def say(self, text):
+        """Let NAO speak with the microphone gated."""
+        with self.echo_gate.playing():
+            self.latency.mark("playback_start")
+            self.nao.tts.request(NaoqiTextToSpeechRequest(text))
+
     def run(self):
         """Main application loop."""
         try:
             # Demo starts
-            self.nao.tts.request(
-                NaoqiTextToSpeechRequest("Hello, I am Nao, nice to meet you!")
-            )
+            self.say("Hello, I am Nao, nice to meet you!")
             self.logger.info(" -- Ready -- ")
 
             while not self.shutdown_event.is_set():
                 self.logger.info(" ----- Your turn to talk!")
 
                 # Request intent detection with the current session
+                self.latency.start_turn()
                 reply = self.dialogflow_cx.request(DetectIntentRequest(self.session_id))
+                # Dialogflow CX answers with the intent and the reply at once
+                self.latency.mark("first_token")
+                self.turns += 1
+                if not reply.transcript:
+                    self.turns_without_transcript += 1
 
                 # Log the detected intent
                 if reply.intent:
@@ -180,9 +218,10 @@ class NaoDialogflowCXDemo(SICApplication):
                 if reply.fulfillment_message:
                     text = reply.fulfillment_message
                     self.logger.info("NAO reply: {text}".format(text=text))
-                    self.nao.tts.request(NaoqiTextToSpeechRequest(text))
+                    self.say(text)
                 else:
                     self.logger.info("No fulfillment message")
+                self.latency.end_turn(transcript=reply.transcript, intent=reply.intent)
 
                 # Log any parameters
                 if reply.parameters:
@@ -198,6 +237,13 @@ class NaoDialogflowCXDemo(SICApplication):
 
             traceback.print_exc()
         finally:
+            if self.turns:
+                self.logger.info(
+                    "{} of {} turns without transcript".format(
+                        self.turns_without_transcript, self.turns
+                    )
+                )
+            self.latency.log_summary(self.logger)
             self.shutdown()
 
 
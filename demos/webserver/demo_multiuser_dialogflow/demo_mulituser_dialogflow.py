@@ -4,12 +4,9 @@ from sic_framework.core.utils import is_sic_instance
 from sic_framework.core import sic_logging
 
 # import the device(s), service(s), and message(s) we will be using
-from sic_framework.core.message_python2 import AudioMessage
 from sic_framework.services.dialogflow_cx.dialogflow_cx import (
-    DetectIntentRequest,
     DialogflowCX,
     DialogflowCXConf,
-    StopListeningMessage,
 )
 from sic_framework.services.webserver.webserver_service import (
     ButtonClicked,
@@ -18,9 +15,11 @@ from sic_framework.services.webserver.webserver_service import (
     WebserverConf,
 )
 
+# Import custom components (pip install -e . from the repository root)
+from custom_components.session_engine import AsyncSessionEngine
+
 # import demo-specific modules
 from typing import Dict, Optional
-from dataclasses import dataclass
 from os.path import abspath, join
 import urllib.request
 import numpy as np
@@ -35,16 +34,6 @@ import os
 DOCKER_WEBFILES_PATH = "/webfiles"
 
 
-@dataclass
-class UserSessionState:
-    socket_id: str
-    session_id: int
-    agent: DialogflowCX
-    stop_event: threading.Event
-    start_listening_event: threading.Event
-    worker_thread: threading.Thread
-
-
 class DialogflowCXMultiUserWebDemo(SICApplication):
     """
     Multi-user Dialogflow CX web demo.
@@ -52,6 +41,12 @@ class DialogflowCXMultiUserWebDemo(SICApplication):
     Each browser socket that connects gets its own Dialogflow CX session ID.
     The frontend receives only the transcript/response labels for its own socket ID.
 
+    The turns of all users are served by an asyncio session engine with a small pool
+    of Dialogflow CX agents (max_concurrent_turns). A turn that starts while all
+    agents are busy waits in a bounded queue with its audio buffered, and is refused
+    with a "busy" reply when the queue is full, so a classroom of 100+ browsers can
+    share one host.
+
     Steps to run demo:
     - Install Docker Desktop (services start automatically via docker-compose.yml)
 
@@ -69,7 +64,10 @@ class DialogflowCXMultiUserWebDemo(SICApplication):
         self.web_port = 8080
 
         self._users_lock = threading.Lock()
-        self._users: Dict[str, UserSessionState] = {}
+        self._users: Dict[str, int] = {}  # socket id -> Dialogflow session id
+        self.engine = None
+        self.max_concurrent_turns = 8  # Dialogflow CX agents serving turns in parallel
+        self.max_queued_turns = 32  # turns waiting for an agent, more are refused
 
         self.agent_id = "27cdbb58-604e-4da9-bb34-91bb7bc62883"  # Replace if needed
         self.location = "europe-west4"  # Replace if needed
@@ -118,6 +116,16 @@ class DialogflowCXMultiUserWebDemo(SICApplication):
         with open(abspath(join("..", "..", "..", "conf", "google", "google-key.json"))) as f:
             self.keyfile_json = json.load(f)
 
+        self.engine = AsyncSessionEngine(
+            self._create_agent,
+            on_reply=self._on_turn_reply,
+            on_busy=self._on_turn_busy,
+            on_error=self._on_turn_error,
+            max_concurrent_turns=self.max_concurrent_turns,
+            max_queued_turns=self.max_queued_turns,
+        )
+        self.engine.start()
+
         self.logger.info("Ready for multi-user Dialogflow sessions")
 
     def _log_connection_urls(self) -> None:
@@ -186,7 +194,7 @@ class DialogflowCXMultiUserWebDemo(SICApplication):
         while True:
             candidate = int(np.random.randint(1, 1_000_000_000))
             with self._users_lock:
-                in_use = any(state.session_id == candidate for state in self._users.values())
+                in_use = candidate in self._users.values()
             if not in_use:
                 return candidate
 
@@ -212,12 +220,13 @@ class DialogflowCXMultiUserWebDemo(SICApplication):
         except Exception as e:
             self.logger.warning(f"Failed to publish update for socket {socket_id}: {e}")
 
-    def _create_user_agent(self) -> DialogflowCX:
+    def _create_agent(self) -> DialogflowCX:
         """
-        Construct a DialogflowCX connector for a single user session.
+        Construct a DialogflowCX connector for the agent pool of the session engine.
 
         Audio is streamed from the browser, not from a local microphone, so we
-        do not pass an input_source here.
+        do not pass an input_source here. An agent serves the turns of any user, the
+        conversation state is kept per session by Dialogflow.
         """
         ca_conf = DialogflowCXConf(
             keyfile_json=self.keyfile_json,
@@ -231,8 +240,8 @@ class DialogflowCXMultiUserWebDemo(SICApplication):
 
     def _start_user_session(self, socket_id: str) -> None:
         """
-        Create per-user state (Dialogflow connector + worker thread) for a new
-        Socket.IO connection identified by socket_id.
+        Register a Dialogflow session for a new Socket.IO connection identified by
+        socket_id with the session engine.
 
         If a session already exists for this socket_id, this is a no-op.
         """
@@ -243,113 +252,68 @@ class DialogflowCXMultiUserWebDemo(SICApplication):
         session_id = self._new_session_id()
         self.logger.info(f"Starting Dialogflow session {session_id} for socket {socket_id}")
 
-        try:
-            agent = self._create_user_agent()
-        except Exception as e:
-            self.logger.error(f"Failed to create Dialogflow connector for {socket_id}: {e}")
-            self._publish_to_user(socket_id, agent_response=f"(failed to initialize Dialogflow connector: {e})")
-            return
-
-        stop_event = threading.Event()
-        start_listening_event = threading.Event()
-        worker = threading.Thread(
-            target=self._user_loop,
-            args=(socket_id, session_id, agent, stop_event, start_listening_event),
-            daemon=True,
-        )
-        state = UserSessionState(
-            socket_id=socket_id,
-            session_id=session_id,
-            agent=agent,
-            stop_event=stop_event,
-            start_listening_event=start_listening_event,
-            worker_thread=worker,
-        )
-
         with self._users_lock:
-            self._users[socket_id] = state
+            self._users[socket_id] = session_id
+        self.engine.add_user(socket_id, session_id)
 
         self._publish_to_user(socket_id, transcript="—", agent_response="(listening...)")
-        worker.start()
 
     def _stop_user_session(self, socket_id: str) -> None:
         """
-        Stop a single user session and its Dialogflow connector, if it exists.
+        Stop a single user session, if it exists.
         """
         with self._users_lock:
-            state = self._users.pop(socket_id, None)
+            session_id = self._users.pop(socket_id, None)
 
-        if state is None:
+        if session_id is None:
             return
 
-        self.logger.info(f"Stopping Dialogflow session {state.session_id} for socket {socket_id}")
-        state.stop_event.set()
-        try:
-            state.agent.stop_component()
-        except Exception:
-            pass
+        self.logger.info(f"Stopping Dialogflow session {session_id} for socket {socket_id}")
+        self.engine.remove_user(socket_id)
 
     def _stop_all_user_sessions(self) -> None:
         """
-        Best-effort shutdown of all active user sessions on application exit.
+        Best-effort shutdown of all active user sessions and the agent pool on
+        application exit.
         """
         with self._users_lock:
-            socket_ids = list(self._users.keys())
-        for socket_id in socket_ids:
-            self._stop_user_session(socket_id)
+            self._users.clear()
+        if self.engine is not None:
+            self.engine.stop()
 
-    def _user_loop(
-        self,
-        socket_id: str,
-        session_id: int,
-        agent: DialogflowCX,
-        stop_event: threading.Event,
-        start_listening_event: threading.Event,
-    ) -> None:
+    def _turn_done(self, socket_id: str) -> None:
+        # Notify this client that the turn has completed, so it can auto-stop the mic.
         try:
-            while not self.shutdown_event.is_set() and not stop_event.is_set():
-                # Wait for user to press record before starting the next turn.
-                while not stop_event.is_set() and not self.shutdown_event.is_set():
-                    if start_listening_event.wait(timeout=0.25):
-                        break
-                if stop_event.is_set() or self.shutdown_event.is_set():
-                    break
-                start_listening_event.clear()
-
-                self.logger.info(f"[{socket_id}] Conversation turn (session {session_id})")
-                try:
-                    reply = agent.request(DetectIntentRequest(session_id))
-                except Exception as e:
-                    self.logger.error(f"[{socket_id}] Dialogflow request failed: {e}")
-                    self._publish_to_user(socket_id, agent_response=f"(error: {e})")
-                    time.sleep(0.5)
-                    continue
-
-                if stop_event.is_set() or self.shutdown_event.is_set():
-                    break
+            self.webserver.send_message(
+                WebInfoMessage(self._web_label("turn_done", socket_id), True)
+            )
+        except Exception as e:
+            self.logger.warning(f"Failed to publish turn_done for socket {socket_id}: {e}")
+
+    def _on_turn_reply(self, socket_id: str, reply) -> None:
+        """Called by the session engine when a user's turn has been answered."""
+        transcript = reply.transcript if reply and reply.transcript else ""
+        response = (
+            reply.fulfillment_message
+            if reply and reply.fulfillment_message
+            else "(no fulfillment message)"
+        )
 
-                transcript = reply.transcript if reply and reply.transcript else ""
-                response = (
-                    reply.fulfillment_message
-                    if reply and reply.fulfillment_message
-                    else "(no fulfillment message)"
-                )
+        self.logger.info(f"[{socket_id}] Transcript: {transcript}")
+        self.logger.info(f"[{socket_id}] Agent reply: {response}")
+        self._publish_to_user(socket_id, transcript=transcript, agent_response=response)
+        self._turn_done(socket_id)
 
-                self.logger.info(f"[{socket_id}] Transcript: {transcript}")
-                self.logger.info(f"[{socket_id}] Agent reply: {response}")
-                self._publish_to_user(socket_id, transcript=transcript, agent_response=response)
-                # Notify this client that the turn has completed, so it can auto-stop the mic.
-                try:
-                    self.webserver.send_message(
-                        WebInfoMessage(self._web_label("turn_done", socket_id), True)
-                    )
-                except Exception as e:
-                    self.logger.warning(f"Failed to publish turn_done for socket {socket_id}: {e}")
-        finally:
-            try:
-                agent.stop_component()
-            except Exception:
-                pass
+    def _on_turn_busy(self, socket_id: str) -> None:
+        """Called by the session engine when a turn is refused because it is at capacity."""
+        self.logger.warning(f"[{socket_id}] All agents busy, turn refused ({self.engine.status()})")
+        self._publish_to_user(socket_id, agent_response="(all agents are busy, please try again)")
+        self._turn_done(socket_id)
+
+    def _on_turn_error(self, socket_id: str, error: Exception) -> None:
+        self.logger.error(f"[{socket_id}] Dialogflow request failed: {error}")
+        self._publish_to_user(socket_id, agent_response=f"(error: {error})")
+        self._turn_done(socket_id)
 
     def on_web_event(self, message):
         """
@@ -376,15 +340,14 @@ class DialogflowCXMultiUserWebDemo(SICApplication):
 
         # All other events require an active user session.
         with self._users_lock:
-            state = self._users.get(socket_id)
-        if state is None:
-            return
+            if socket_id not in self._users:
+                return
 
         if event_type == "unregister_user":
             self._stop_user_session(socket_id)
         elif event_type == "start_audio":
-            # User pressed record; allow the next DetectIntentRequest to run.
-            state.start_listening_event.set()
+            # User pressed record; queue the next turn for a free agent.
+            self.engine.start_turn(socket_id)
         elif event_type == "audio_chunk":
             # Browser-streamed PCM16 audio for this user.
             audio_list = data.get("audio")
@@ -398,22 +361,22 @@ class DialogflowCXMultiUserWebDemo(SICApplication):
 
             sample_rate = int(data.get("sample_rate") or 44100)
             try:
-                state.agent.send_message(AudioMessage(audio_bytes, sample_rate=sample_rate))
+                self.engine.audio(socket_id, audio_bytes, sample_rate)
             except Exception as e:
                 self.logger.error(f"[{socket_id}] Failed to forward audio chunk: {e}")
         elif event_type == "stop_audio":
             # Signal Dialogflow to finalize the current turn.
             try:
-                state.agent.send_message(StopListeningMessage(session_id=state.session_id))
+                self.engine.stop_turn(socket_id)
             except Exception as e:
-                self.logger.error(f"[{socket_id}] Failed to send StopListeningMessage: {e}")
+                self.logger.error(f"[{socket_id}] Failed to stop the turn: {e}")
 
     def run(self):
         """
         Idle main loop that keeps the SICApplication alive until shutdown.
 
-        All Dialogflow work happens in per-user worker threads started in
-        _start_user_session; this loop just waits for Ctrl+C or shutdown_event.
+        All Dialogflow work happens in the session engine started in setup; this
+        loop just waits for Ctrl+C or shutdown_event.
         """
         self.logger.info(" -- Starting Multi-user Conversational Agents Demo -- ")
         try:
@@ -0,0 +1,553 @@
+"""
+Headless benchmark of the audio pipeline: voice detection, Whisper and Sortformer.
+
+Streams WAV files through the FakeMicrophone component as if they were recorded by
+Desktop().mic, at real-time speed or faster, and reports per stage:
+
+- endpoint latency: wall-clock time from the end of each utterance in the audio until
+  the stage reports it (VAD speech end, Whisper transcript, Sortformer segment),
+- real-time factor: CPU seconds used by the stage per second of audio,
+- CPU: average load of the stage processes during the run (100% = one core).
+
+Utterances are found with a simple energy detector on the input files, so use clips
+with little background noise. Clips are separated by --gap seconds of silence.
+CPU usage is measured with psutil (pip install psutil) by matching the command
+lines of the running processes, see --proc.
+
+The voice detection service decides that speech ended after a fixed wall-clock
+delay, so its endpoint latency does not scale down with --speed. Whisper expects
+audio at real-time speed, run it with --speed 1.
+
+Start the services before running the benchmark:
+    python -m custom_components.fake_microphone (from the repository root)
+    run-voice-detection
+    run-whisper (or python -m custom_components.streaming_whisper with --whisper streaming)
+    run-sortformer
+
+Usage (from the repository root):
+    python utils/benchmark_audio_pipeline.py
+    python utils/benchmark_audio_pipeline.py --clips path/to/clips --stages vad,sortformer --speed 4
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from sic_framework.core import sic_logging
+from sic_framework.core.sic_application import SICApplication
+from sic_framework.services.openai_whisper_stt.whisper_stt import (
+    GetTranscript,
+    SICWhisper,
+    WhisperConf,
+)
+from sic_framework.services.streaming_sortformer import (
+    GetDiarizationRequest,
+    STMSortformer,
+    STMSortformerConf,
+)
+from sic_framework.services.voice_detection.voice_detection import (
+    VoiceDetection,
+    VoiceDetectionConf,
+)
+
+# Import custom components (pip install -e . from the repository root)
+from custom_components.fake_microphone import FakeMicrophone, load_wav
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+DEFAULT_CLIP = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "example_media",
+    "audio",
+    "demo_audio.wav",
+)
+STAGES = ("vad", "whisper", "sortformer")
+# Command line patterns of the process running each stage
+DEFAULT_PROCESS_PATTERNS = {
+    "vad": r"voice.detection",
+    "whisper": r"whisper",
+    "sortformer": r"sortformer",
+}
+SAMPLE_RATE = 16000
+# Sortformer segment ends may fall slightly before the reference utterance end
+SEGMENT_END_TOLERANCE = 0.3
+
+
+def find_utterances(waveform, sample_rate, min_silence=0.8, frame_ms=30):
+    """
+    Find speech regions with an energy detector.
+
+    :param waveform: 16-bit mono PCM audio
+    :param min_silence: pauses shorter than this (seconds) do not end an utterance
+    :return: list of (start, end) in seconds
+    :rtype: list[tuple[float, float]]
+    """
+    samples = np.frombuffer(waveform, dtype=np.int16).astype(np.float32)
+    frame = int(sample_rate * frame_ms / 1000.0)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return []
+
+    rms = np.sqrt(
+        np.mean(samples[: n_frames * frame].reshape(n_frames, frame) ** 2, axis=1)
+    )
+    # Halfway (in dB) between the noise floor and the loud parts of the clip
+    floor = max(np.percentile(rms, 10), 1.0)
+    peak = max(np.percentile(rms, 95), floor)
+    threshold = np.sqrt(floor * peak)
+    active = rms > threshold
+
+    frame_s = frame / float(sample_rate)
+    utterances = []
+    start = None
+    last_active = None
+    for i, is_active in enumerate(active):
+        if is_active:
+            if start is None:
+                start = i
+            elif (i - last_active - 1) * frame_s >= min_silence:
+                utterances.append((start * frame_s, (last_active + 1) * frame_s))
+                start = i
+            last_active = i
+    if start is not None:
+        utterances.append((start * frame_s, (last_active + 1) * frame_s))
+
+    # Drop clicks that are too short to be speech
+    return [(s, e) for s, e in utterances if e - s >= 0.2]
+
+
+def match_latencies(reference_ends, event_times):
+    """
+    Latency from each reference end to the first event after it.
+
+    Events that come before the next reference end are attributed to the current
+    one, later events belong to later utterances.
+
+    :param reference_ends: sorted wall-clock times at which utterances ended
+    :param event_times: sorted wall-clock times at which the stage reported an end
+    :return: one latency (seconds) per reference end, None if it was missed
+    :rtype: list[float | None]
+    """
+    latencies = []
+    j = 0
+    for i, end in enumerate(reference_ends):
+        while j < len(event_times) and event_times[j] < end:
+            j += 1
+        next_end = (
+            reference_ends[i + 1] if i + 1 < len(reference_ends) else float("inf")
+        )
+        if j < len(event_times) and event_times[j] < next_end:
+            latencies.append(event_times[j] - end)
+            j += 1
+        else:
+            latencies.append(None)
+    return latencies
+
+
+class StageCPUMonitor(object):
+    """
+    Measures the CPU time used by the processes that run each stage.
+
+    :param patterns: stage name -> regular expression matched against process command lines
+    """
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.processes = {}
+        self.start_times = {}
+
+    def start(self):
+        if psutil is None:
+            return
+        own_pid = os.getpid()
+        for stage, pattern in self.patterns.items():
+            regex = re.compile(pattern)
+            self.processes[stage] = []
+            for process in psutil.process_iter(["pid", "cmdline"]):
+                cmdline = " ".join(process.info["cmdline"] or [])
+                if process.info["pid"] != own_pid and regex.search(cmdline):
+                    self.processes[stage].append(process)
+            self.start_times[stage] = self._cpu_seconds(stage)
+
+    def stop(self):
+        """
+        :return: stage name -> CPU seconds used since start(), None if not measured
+        :rtype: dict
+        """
+        usage = {}
+        for stage in self.patterns:
+            if not self.processes.get(stage):
+                usage[stage] = None
+                continue
+            usage[stage] = self._cpu_seconds(stage) - self.start_times[stage]
+        return usage
+
+    def _cpu_seconds(self, stage):
+        total = 0.0
+        for process in self.processes[stage]:
+            try:
+                for p in [process] + process.children(recursive=True):
+                    times = p.cpu_times()
+                    total += times.user + times.system
+            except psutil.Error:
+                continue
+        return total
+
+
+class AudioPipelineBenchmark(SICApplication):
+    """
+    Streams audio clips through the fake microphone and times every stage.
+    """
+
+    def __init__(
+        self,
+        clips,
+        stages=STAGES,
+        speed=1.0,
+        gap=2.0,
+        whisper_backend="local",
+        process_patterns=None,
+        min_silence=0.8,
+    ):
+        super(AudioPipelineBenchmark, self).__init__()
+
+        self.clips = clips
+        self.stages = stages
+        self.speed = speed
+        self.gap = gap
+        self.whisper_backend = whisper_backend
+        self.min_silence = min_silence
+        self.cpu_monitor = StageCPUMonitor(
+            {
+                stage: (process_patterns or {}).get(
+                    stage, DEFAULT_PROCESS_PATTERNS[stage]
+                )
+                for stage in stages
+            }
+        )
+
+        self.mic = None
+        self.vad = None
+        self.whisper = None
+        self.sortformer = None
+
+        self._stream_done = threading.Event()
+        # Wall-clock times at which each stage reported the end of an utterance
+        self._vad_ends = []
+        self._vad_starts = []
+        self._transcripts = []
+        # (receive time, end of the latest segment in seconds of audio)
+        self._diarization_updates = []
+        self._first_timestamp = None
+
+        self.set_log_level(sic_logging.WARNING)
+        self.load_env(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "../conf/.env")
+        )
+
+        self.setup()
+
+    def setup(self):
+        self.mic = FakeMicrophone()
+
+        if "vad" in self.stages:
+            self.vad = VoiceDetection(
+                input_source=self.mic,
+                conf=VoiceDetectionConf(sampling_rate=SAMPLE_RATE),
+            )
+            self.vad.register_callback(self._on_voice_detection)
+
+        if "whisper" in self.stages:
+            if self.whisper_backend == "streaming":
+                from custom_components.streaming_whisper import StreamingWhisper
+
+                self.whisper = StreamingWhisper(input_source=self.mic)
+            elif self.whisper_backend == "openai":
+                self.whisper = SICWhisper(
+                    input_source=self.mic,
+                    conf=WhisperConf(openai_key=os.environ["OPENAI_API_KEY"]),
+                )
+            else:
+                self.whisper = SICWhisper(input_source=self.mic)
+
+        if "sortformer" in self.stages:
+            self.sortformer = STMSortformer(
+                input_source=self.mic, conf=STMSortformerConf()
+            )
+
+    def _on_voice_detection(self, message):
+        if not hasattr(message, "is_speaking"):
+            return
+        if message.is_speaking:
+            self._vad_starts.append(time.time())
+        else:
+            self._vad_ends.append(time.time())
+
+    def _on_chunk_sent(self, message):
+        if self._first_timestamp is None:
+            self._first_timestamp = message._timestamp
+
+    def _transcribe_loop(self):
+        while not self._stream_done.is_set():
+            try:
+                reply = self.whisper.request(
+                    GetTranscript(timeout=2, phrase_time_limit=30)
+                )
+            except Exception as e:
+                self.logger.warning("Whisper request failed: {}".format(e))
+                continue
+            if reply.transcript and reply.transcript.strip():
+                self._transcripts.append((time.time(), reply.transcript.strip()))
+
+    def _diarization_loop(self):
+        while not self._stream_done.is_set():
+            try:
+                result = self.sortformer.request(GetDiarizationRequest())
+            except Exception as e:
+                self.logger.warning("Sortformer request failed: {}".format(e))
+                continue
+            ends = [end for speaker in result.speaker_timestamps for _, end in speaker]
+            if ends and self._first_timestamp is not None:
+                # Segment times are offset by the integer second of the first chunk
+                self._diarization_updates.append(
+                    (time.time(), max(ends) - float(self._first_timestamp[0]))
+                )
+
+    def _build_stream(self):
+        """
+        Concatenate the clips with silence in between.
+
+        :return: (waveform, utterances in seconds of the stream, seconds per clip)
+        """
+        silence = b"\x00\x00" * int(SAMPLE_RATE * self.gap)
+        parts = [silence]
+        utterances = []
+        offset = self.gap
+        for path in self.clips:
+            waveform, _ = load_wav(path, SAMPLE_RATE)
+            for start, end in find_utterances(waveform, SAMPLE_RATE, self.min_silence):
+                utterances.append((offset + start, offset + end))
+            parts.extend([waveform, silence])
+            offset += len(waveform) / 2.0 / SAMPLE_RATE + self.gap
+        return b"".join(parts), utterances
+
+    def run(self, drain=5.0):
+        """
+        Run the benchmark.
+
+        :param drain: seconds to keep the stages running after the audio has ended
+        :return: the report
+        :rtype: dict
+        """
+        waveform, utterances = self._build_stream()
+        audio_seconds = len(waveform) / 2.0 / SAMPLE_RATE
+        print(
+            "Streaming {} clip(s), {:.1f}s of audio with {} utterance(s) at {}x".format(
+                len(self.clips), audio_seconds, len(utterances), self.speed
+            )
+        )
+
+        workers = []
+        if self.whisper is not None:
+            workers.append(threading.Thread(target=self._transcribe_loop, daemon=True))
+        if self.sortformer is not None:
+            workers.append(threading.Thread(target=self._diarization_loop, daemon=True))
+
+        try:
+            self.cpu_monitor.start()
+            for worker in workers:
+                worker.start()
+
+            wall_start = time.time()
+            start_time = self.mic.stream(
+                waveform,
+                SAMPLE_RATE,
+                speed=self.speed,
+                stop_event=self.shutdown_event,
+                on_chunk=self._on_chunk_sent,
+            )
+            time.sleep(drain)
+            wall_seconds = time.time() - wall_start
+            cpu_seconds = self.cpu_monitor.stop()
+        finally:
+            self._stream_done.set()
+            for worker in workers:
+                worker.join(timeout=35)
+
+        return self._report(
+            utterances, start_time, audio_seconds, wall_seconds, cpu_seconds
+        )
+
+    def _report(self, utterances, start_time, audio_seconds, wall_seconds, cpu_seconds):
+        speed = self.speed if self.speed > 0 else float("inf")
+        reference_ends = [start_time + end / speed for _, end in utterances]
+
+        report = {
+            "clips": self.clips,
+            "speed": self.speed,
+            "audio_seconds": audio_seconds,
+            "wall_seconds": wall_seconds,
+            "utterances": len(utterances),
+            "stages": {},
+        }
+        for stage in self.stages:
+            if stage == "vad":
+                events = sorted(self._vad_ends)
+                extra = {"speech_starts": len(self._vad_starts)}
+            elif stage == "whisper":
+                events = [t for t, _ in self._transcripts]
+                extra = {"transcripts": [text for _, text in self._transcripts]}
+            else:
+                events = None
+                extra = {"updates": len(self._diarization_updates)}
+
+            if events is not None:
+                latencies = match_latencies(reference_ends, events)
+            else:
+                # An utterance is diarized once a segment reaches its end
+                latencies = []
+                for (_, end), reference_end in zip(utterances, reference_ends):
+                    covered = [
+                        t
+                        for t, segment_end in self._diarization_updates
+                        if segment_end >= end - SEGMENT_END_TOLERANCE
+                    ]
+                    latencies.append(min(covered) - reference_end if covered else None)
+            found = [latency for latency in latencies if latency is not None]
+            cpu = cpu_seconds.get(stage)
+            report["stages"][stage] = dict(
+                extra,
+                detected=len(found),
+                endpoint_latency_mean=float(np.mean(found)) if found else None,
+                endpoint_latency_p50=float(np.percentile(found, 50)) if found else None,
+                endpoint_latency_p95=float(np.percentile(found, 95)) if found else None,
+                cpu_seconds=cpu,
+                real_time_factor=cpu / audio_seconds if cpu is not None else None,
+                cpu_percent=100.0 * cpu / wall_seconds if cpu is not None else None,
+            )
+        return report
+
+
+def _fmt(value, pattern="{:.3f}"):
+    return "n/a" if value is None else pattern.format(value)
+
+
+def print_report(report):
+    print(
+        "\n{:.1f}s of audio in {:.1f}s, {} reference utterance(s)".format(
+            report["audio_seconds"], report["wall_seconds"], report["utterances"]
+        )
+    )
+    print(
+        "{:<11}{:>10}{:>12}{:>12}{:>12}{:>10}{:>8}".format(
+            "stage", "detected", "latency", "p50", "p95", "RTF", "CPU"
+        )
+    )
+    for stage, stats in report["stages"].items():
+        print(
+            "{:<11}{:>10}{:>12}{:>12}{:>12}{:>10}{:>8}".format(
+                stage,
+                "{}/{}".format(stats["detected"], report["utterances"]),
+                _fmt(stats["endpoint_latency_mean"]),
+                _fmt(stats["endpoint_latency_p50"]),
+                _fmt(stats["endpoint_latency_p95"]),
+                _fmt(stats["real_time_factor"]),
+                _fmt(stats["cpu_percent"], "{:.0f}%"),
+            )
+        )
+    if psutil is None:
+        print("Install psutil to measure the CPU usage and real-time factor per stage.")
+    for text in report["stages"].get("whisper", {}).get("transcripts", []):
+        print("  transcript: {}".format(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--clips",
+        default=DEFAULT_CLIP,
+        help="WAV file or folder of WAV files to stream (default: demo_audio.wav)",
+    )
+    parser.add_argument(
+        "--stages",
+        default=",".join(STAGES),
+        help="comma separated stages to run: vad, whisper, sortformer",
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="playback speed, 0 for no pacing"
+    )
+    parser.add_argument(
+        "--gap", type=float, default=2.0, help="seconds of silence between clips"
+    )
+    parser.add_argument(
+        "--drain",
+        type=float,
+        default=5.0,
+        help="seconds to wait for the stages after the audio has ended",
+    )
+    parser.add_argument(
+        "--min-silence",
+        type=float,
+        default=0.8,
+        help="shortest pause (seconds) that separates two reference utterances",
+    )
+    parser.add_argument(
+        "--whisper",
+        choices=["local", "openai", "streaming"],
+        default="local",
+        help="Whisper backend: local model, OpenAI API or custom_components.streaming_whisper",
+    )
+    parser.add_argument(
+        "--proc",
+        action="append",
+        default=[],
+        metavar="STAGE=REGEX",
+        help="command line pattern of the process running a stage, for CPU measurement",
+    )
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.clips):
+        clips = sorted(glob.glob(os.path.join(args.clips, "*.wav")))
+    else:
+        clips = [args.clips]
+    if not clips:
+        parser.error("no WAV files found in {}".format(args.clips))
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error("unknown stage {}".format(stage))
+
+    patterns = dict(p.split("=", 1) for p in args.proc)
+
+    benchmark = AudioPipelineBenchmark(
+        clips,
+        stages=stages,
+        speed=args.speed,
+        gap=args.gap,
+        whisper_backend=args.whisper,
+        process_patterns=patterns,
+        min_silence=args.min_silence,
+    )
+    try:
+        report = benchmark.run(drain=args.drain)
+        print_report(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        benchmark.shutdown()
+
+
+if __name__ == "__main__":
+    main()